@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.totals import find_drift, recalculate
+
+
+class Command(BaseCommand):
+    help = 'Compares every invoice total (and GST) with the sum of its items; --fix repairs drifted invoices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Re-sum drifted invoices from their items.')
+
+    def handle(self, *args, **options):
+        drifted = list(find_drift())
+        for pk, stored, actual in drifted:
+            self.stdout.write(
+                f"Invoice {pk}: stored total={stored[0]} gst={stored[1]}, items total={actual[0]} gst={actual[1]}"
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("All invoice totals match their items."))
+            return
+        if not options['fix']:
+            raise CommandError(f"{len(drifted)} invoices differ from their items (run with --fix to repair).")
+
+        fixed = recalculate()
+        self.stdout.write(self.style.SUCCESS(f"Repaired {fixed} invoices."))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_invoiceitem_dosage_invoiceitem_duration'),
+        ('patients', '0005_patient_patient_created_idx_visit_visit_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-created_at'], name='invoice_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['payment_status', 'created_at'], name='invoice_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['visit', 'payment_status'], name='invoice_visit_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceitem',
+            index=models.Index(fields=['created_at'], name='invoiceitem_created_idx'),
+        ),
+    ]
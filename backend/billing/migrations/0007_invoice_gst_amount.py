@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_gst_amounts(apps, schema_editor):
+    # Same rounding as billing.totals.item_gst (GST-inclusive amounts)
+    InvoiceItem = apps.get_model('billing', 'InvoiceItem')
+    Invoice = apps.get_model('billing', 'Invoice')
+    cent = Decimal('0.01')
+    batch = []
+    for item in InvoiceItem.objects.exclude(gst_percent=0).only('amount', 'gst_percent').iterator(chunk_size=2000):
+        amount, rate = Decimal(str(item.amount)), Decimal(str(item.gst_percent))
+        item.gst_amount = (amount * rate / (100 + rate)).quantize(cent, rounding=ROUND_HALF_UP)
+        batch.append(item)
+        if len(batch) >= 2000:
+            InvoiceItem.objects.bulk_update(batch, ['gst_amount'])
+            batch = []
+    InvoiceItem.objects.bulk_update(batch, ['gst_amount'])
+
+    rows = InvoiceItem.objects.exclude(gst_amount=0).values('invoice').annotate(gst=Sum('gst_amount')).order_by()
+    for row in rows:
+        Invoice.objects.filter(pk=row['invoice']).update(gst_amount=row['gst'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_invoice_invoice_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='gst_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='gst_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_gst_amounts, migrations.RunPython.noop),
+    ]
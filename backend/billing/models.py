@@ -6,9 +6,20 @@ class Invoice(BaseModel):
     PAYMENT_STATUS = (('PAID', 'Paid'), ('PENDING', 'Pending'))
     visit = models.ForeignKey(Visit, on_delete=models.SET_NULL, null=True, related_name='invoices')
     patient_name = models.CharField(max_length=255, null=True, blank=True)
-    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Kept in step with the items by billing.totals; not written directly
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    gst_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0) # GST included in total_amount
     payment_status = models.CharField(max_length=20, default='PENDING', choices=PAYMENT_STATUS)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='invoice_created_idx'),
+            # Revenue (PAID + date window) and pending totals
+            models.Index(fields=['payment_status', 'created_at'], name='invoice_status_created_idx'),
+            # get_or_create(visit=..., payment_status='PENDING') on every lab/consultation charge
+            models.Index(fields=['visit', 'payment_status'], name='invoice_visit_status_idx'),
+        ]
+
     def __str__(self):
         return f"Invoice {self.id} - {self.total_amount}"
 
@@ -29,6 +40,13 @@ class InvoiceItem(BaseModel):
     gst_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    gst_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0) # GST included in amount
+
+    class Meta:
+        indexes = [
+            # Visit billing summary report
+            models.Index(fields=['created_at'], name='invoiceitem_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.dept}: {self.description}"
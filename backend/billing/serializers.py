@@ -1,11 +1,16 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import Invoice, InvoiceItem
+from . import totals
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
+    # Writable so edits can match existing rows (see revive_cms.utils.sync_nested)
+    id = serializers.UUIDField(required=False)
+
     class Meta:
         model = InvoiceItem
         fields = '__all__'
-        read_only_fields = ['invoice']
+        read_only_fields = ['invoice', 'gst_amount']
 
 class InvoiceSerializer(serializers.ModelSerializer):
     items = InvoiceItemSerializer(many=True, required=False)
@@ -14,7 +19,14 @@ class InvoiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Invoice
-        fields = ['id', 'visit', 'patient_name', 'total_amount', 'payment_status', 'items', 'patient_display', 'patient_id', 'created_at']
+        fields = ['id', 'visit', 'patient_name', 'total_amount', 'gst_amount', 'payment_status', 'items', 'patient_display', 'patient_id', 'created_at']
+        # Summed from the items by billing.totals
+        read_only_fields = ['total_amount', 'gst_amount']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Loads the visit's patient by JOIN and the items by prefetch, so a page costs a fixed number of queries."""
+        return queryset.select_related('visit__patient').prefetch_related('items')
 
     def get_patient_display(self, obj):
         if obj.visit and obj.visit.patient:
@@ -26,6 +38,7 @@ class InvoiceSerializer(serializers.ModelSerializer):
             return obj.visit.patient.id
         return None
 
+    @transaction.atomic
     def create(self, validated_data):
         try:
             items_data = validated_data.pop('items', [])
@@ -33,26 +46,30 @@ class InvoiceSerializer(serializers.ModelSerializer):
             for item_data in items_data:
                 # Remove non-model fields that might be sent from frontend
                 item_data.pop('stock_deducted', None) 
-                InvoiceItem.objects.create(invoice=invoice, **item_data)
+            # One insert for the items and one UPDATE for the totals
+            totals.sync_items(invoice, items_data)
+            invoice.refresh_from_db(fields=['total_amount', 'gst_amount'])
             return invoice
         except Exception as e:
             print(f"Error creating invoice: {str(e)}")
             raise serializers.ValidationError(f"Creation failed: {str(e)}")
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
         
         # Update Invoice Instance
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
+        # Only the edited fields, so the totals maintained by billing.totals are never overwritten
+        instance.save(update_fields=[*validated_data, 'updated_at'])
 
         # Update Items if provided
         if items_data is not None:
-            # Simplest approach: Remove old items and re-create new ones
-            instance.items.all().delete()
+            # Matched by id: only changed rows are updated, new ones inserted, missing ones deleted
             for item_data in items_data:
                 item_data.pop('stock_deducted', None)
-                InvoiceItem.objects.create(invoice=instance, **item_data)
+            totals.sync_items(instance, items_data)
+            instance.refresh_from_db(fields=['total_amount', 'gst_amount'])
         
         return instance
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
 from django.dispatch import receiver
 from patients.models import Visit
 from .models import Invoice, InvoiceItem
+from . import totals
 
 @receiver(post_save, sender=Visit)
 def create_or_update_consultation_invoice(sender, instance, created, **kwargs):
@@ -11,11 +12,10 @@ def create_or_update_consultation_invoice(sender, instance, created, **kwargs):
         amount = instance.doctor.consultation_fee
     
     if created:
-        # Create new invoice
+        # Create new invoice (the item below brings its total up)
         invoice = Invoice.objects.create(
             visit=instance,
             patient_name=instance.patient.full_name,
-            total_amount=amount,
             payment_status='PENDING'
         )
         InvoiceItem.objects.create(
@@ -34,12 +34,45 @@ def create_or_update_consultation_invoice(sender, instance, created, **kwargs):
             cons_item = InvoiceItem.objects.filter(invoice=invoice, dept='CONSULTATION').first()
             if cons_item:
                 # If the amount differs (e.g. doctor assigned/changed), update it
+                # (the invoice total follows through billing.totals)
                 if cons_item.amount != amount:
                     cons_item.amount = amount
                     cons_item.unit_price = amount
                     cons_item.save()
-                    
-                    # Update Invoice Total
-                    # Re-sum all items to ensure accuracy
-                    invoice.total_amount = sum(item.amount for item in invoice.items.all())
-                    invoice.save()
+
+
+@receiver(post_init, sender=InvoiceItem)
+def remember_item_totals(sender, instance, **kwargs):
+    totals.remember(instance)
+
+
+@receiver(pre_save, sender=InvoiceItem)
+def fill_item_gst(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    totals.prepare(instance)
+
+
+@receiver(post_save, sender=InvoiceItem)
+def update_invoice_totals(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_totals_old', None)
+    if not created and old is None:
+        # Loaded without its amounts, so there is nothing to diff against
+        totals.recalculate(Invoice.objects.filter(pk=instance.invoice_id))
+    else:
+        amount, gst = totals.contribution(instance)
+        if not created:
+            amount, gst = amount - old[0], gst - old[1]
+        totals.apply_delta(instance.invoice_id, amount, gst)
+    totals.remember(instance)
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def remove_from_invoice_totals(sender, instance, origin=None, **kwargs):
+    # Items deleted along with their invoice have no total left to update
+    if isinstance(origin, Invoice) or getattr(origin, 'model', None) is Invoice:
+        return
+    amount, gst = totals.contribution(instance)
+    totals.apply_delta(instance.invoice_id, -amount, -gst)
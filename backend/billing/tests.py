@@ -1,3 +1,185 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from pharmacy import catalog
+from pharmacy.models import PharmacyStock
+from users.models import User
+from .models import Invoice
+
+# Creating an invoice costs a fixed number of queries (savepoints included), whatever its
+# number of lines: invoice and item inserts, one totals UPDATE, one stock resolve, one locked
+# read plus one bulk UPDATE for the deductions, and one catalog refresh
+FIFTY_LINE_QUERIES = 23
+
+# Editing one line of a bill costs the same whatever its size (savepoints included): the
+# invoice and its items, the invoice save, one bulk_update for the changed row, the totals
+# UPDATE and re-read, then the items again for the response
+EDIT_ONE_LINE_QUERIES = 13
+
+
+class InvoiceCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reception', password='x', role='RECEPTION')
+        cls.stocks = PharmacyStock.objects.bulk_create([
+            PharmacyStock(
+                name=f'Medicine {n:02d}', batch_no=f'B{n:02d}', expiry_date=date.today() + timedelta(days=300),
+                mrp=10, selling_price=10, qty_available=100, gst_percent=12,
+            ) for n in range(50)
+        ])
+        # bulk_create skips the stock signals; start from a catalog that is up to date
+        catalog.rebuild()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_invoice(self, lines):
+        items = [{
+            'dept': 'PHARMACY', 'description': stock.name, 'batch': stock.batch_no,
+            'qty': 2, 'unit_price': '10.00', 'amount': '20.00', 'gst_percent': '12.00',
+        } for stock in self.stocks[:lines]]
+        return self.client.post('/api/billing/invoices/', {
+            'patient_name': 'Walk-in', 'payment_status': 'PENDING', 'items': items,
+        }, format='json')
+
+    def test_query_count_does_not_grow_with_lines(self):
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.post_invoice(5).status_code, 201)
+        with self.assertNumQueries(len(small)):
+            response = self.post_invoice(50)
+        self.assertEqual(response.status_code, 201)
+
+    def test_fifty_line_invoice(self):
+        with self.assertNumQueries(FIFTY_LINE_QUERIES):
+            response = self.post_invoice(50)
+        self.assertEqual(response.status_code, 201, response.data)
+
+        invoice = Invoice.objects.get(pk=response.data['id'])
+        self.assertEqual(invoice.items.count(), 50)
+        self.assertEqual(invoice.total_amount, Decimal('1000.00'))
+        self.assertEqual(invoice.gst_amount, Decimal('107.00'))  # 50 x 2.14 contained in 20.00 at 12%
+        self.assertEqual({row['deducted'] for row in response.data['stock_deductions']}, {2})
+        self.assertEqual(set(PharmacyStock.objects.values_list('qty_available', flat=True)), {98})
+
+
+class InvoiceEditTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('reception', password='x', role='RECEPTION'))
+        response = self.client.post('/api/billing/invoices/', {
+            'patient_name': 'Walk-in', 'payment_status': 'PENDING', 'items': [
+                {'dept': 'CONSULTATION', 'description': 'Consultation', 'qty': 1, 'unit_price': '500.00', 'amount': '500.00'},
+                {'dept': 'LAB', 'description': 'CBC', 'qty': 1, 'unit_price': '200.00', 'amount': '200.00'},
+                {'dept': 'LAB', 'description': 'Lipid profile', 'qty': 1, 'unit_price': '600.00', 'amount': '600.00'},
+            ],
+        }, format='json')
+        self.invoice = response.data
+
+    def test_edit_keeps_unchanged_rows(self):
+        consultation, cbc, lipid = self.invoice['items']
+        before = {row.pk: row.updated_at for row in Invoice.objects.get(pk=self.invoice['id']).items.all()}
+
+        cbc['amount'] = cbc['unit_price'] = '250.00'
+        new = {'dept': 'LAB', 'description': 'TSH', 'qty': 1, 'unit_price': '300.00', 'amount': '300.00'}
+        response = self.client.patch(f"/api/billing/invoices/{self.invoice['id']}/", {
+            'items': [consultation, cbc, new],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+        invoice = Invoice.objects.get(pk=self.invoice['id'])
+        rows = {row.description: row for row in invoice.items.all()}
+        self.assertEqual(set(rows), {'Consultation', 'CBC', 'TSH'})
+        # Same rows (ids) for the kept lines; only the edited one was written
+        self.assertEqual(str(rows['Consultation'].pk), consultation['id'])
+        self.assertEqual(rows['Consultation'].updated_at, before[rows['Consultation'].pk])
+        self.assertEqual(str(rows['CBC'].pk), cbc['id'])
+        self.assertGreater(rows['CBC'].updated_at, before[rows['CBC'].pk])
+        self.assertNotIn(rows['TSH'].pk, before)
+        self.assertEqual(invoice.total_amount, Decimal('1050.00'))
+
+    def edit_one_line_queries(self, lines):
+        response = self.client.post('/api/billing/invoices/', {
+            'patient_name': 'Walk-in', 'payment_status': 'PENDING', 'items': [
+                {'dept': 'LAB', 'description': f'Test {n}', 'qty': 1, 'unit_price': '100.00', 'amount': '100.00'}
+                for n in range(lines)
+            ],
+        }, format='json')
+        items = response.data['items']
+        items[0]['amount'] = items[0]['unit_price'] = '150.00'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f"/api/billing/invoices/{response.data['id']}/", {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['total_amount'], f'{lines * 100 + 50}.00')
+        return len(queries)
+
+    def test_edit_queries_do_not_grow_with_lines(self):
+        self.assertEqual(self.edit_one_line_queries(5), self.edit_one_line_queries(50))
+        self.assertEqual(self.edit_one_line_queries(50), EDIT_ONE_LINE_QUERIES)
+
+
+class InvoiceListTests(TestCase):
+    def test_status_filter_runs_fixed_queries(self):
+        from patients.models import Patient, Visit
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('reception', password='x', role='RECEPTION'))
+        # Each visit opens a pending invoice with its consultation line
+        for n in range(12):
+            patient = Patient.objects.create(full_name=f'Patient {n}', age=30, gender='M', phone=f'97000{n:05d}', address='-')
+            Visit.objects.create(patient=patient)
+
+        # The count, one page with visit and patient joined in, and one prefetch of the items
+        with self.assertNumQueries(3):
+            response = client.get('/api/billing/invoices/', {'payment_status': 'PENDING'})
+        self.assertEqual(response.data['count'], 12)
+        first = response.data['results'][0]
+        self.assertEqual((first['patient_display'][:8], len(first['items'])), ('Patient ', 1))
+
+
+class InvoiceDriftTests(TestCase):
+    def setUp(self):
+        from .models import InvoiceItem
+        from .totals import add_items
+
+        self.invoice = Invoice.objects.create(payment_status='PAID')
+        add_items(self.invoice, [
+            InvoiceItem(dept='PHARMACY', description='Paracetamol', qty=10, unit_price=2, amount=20, gst_percent=12),
+            InvoiceItem(dept='LAB', description='CBC', qty=1, unit_price=250, amount=250),
+        ])
+        self.invoice.refresh_from_db()
+        self.expected = (self.invoice.total_amount, self.invoice.gst_amount)
+
+    def test_corrupted_total_is_found_and_repaired(self):
+        from .totals import find_drift, recalculate
+
+        self.assertEqual(self.expected, (Decimal('270.00'), Decimal('2.14')))
+        self.assertEqual(list(find_drift()), [])
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(total_amount=999, gst_amount=0)
+        self.assertEqual(list(find_drift()), [(self.invoice.pk, (Decimal('999.00'), Decimal('0.00')), self.expected)])
+
+        self.assertEqual(recalculate(), 1)
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.total_amount, self.invoice.gst_amount), self.expected)
+        self.assertEqual(list(find_drift()), [])
+
+    def test_check_command(self):
+        from io import StringIO
+        from django.core.management import call_command, CommandError
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(total_amount=999)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_invoice_totals', stdout=out)
+        self.assertIn(f'Invoice {self.invoice.pk}: stored total=999.00', out.getvalue())
 
-# Create your tests here.
+        call_command('check_invoice_totals', '--fix', stdout=StringIO())
+        out = StringIO()
+        call_command('check_invoice_totals', stdout=out)
+        self.assertIn('All invoice totals match their items.', out.getvalue())
@@ -0,0 +1,148 @@
+"""
+Invoice totals kept up to date from their items.
+
+Every item change moves Invoice.total_amount and Invoice.gst_amount by the difference with
+one atomic UPDATE (total = total + delta), so adding a line never reloads the other lines.
+Single saves and deletes go through billing.signals; serializer writes go through
+sync_items(), which moves the totals once per write. recalculate() re-sums items in
+the database to repair drift, and the check_invoice_totals command reports it.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import F, Sum, Subquery, OuterRef, DecimalField, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Invoice, InvoiceItem
+
+CENT = Decimal('0.01')
+
+
+def to_decimal(value):
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def item_gst(amount, gst_percent):
+    """GST contained in a GST-inclusive amount (prices are MRP)."""
+    amount, gst_percent = to_decimal(amount), Decimal(str(gst_percent or 0))
+    if not gst_percent:
+        return Decimal('0.00')
+    return (amount * gst_percent / (100 + gst_percent)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def prepare(item):
+    """Fills in the derived gst_amount; call before writing an item without save()."""
+    item.gst_amount = item_gst(item.amount, item.gst_percent)
+    return item
+
+
+def contribution(item):
+    return to_decimal(item.amount), to_decimal(item.gst_amount)
+
+
+def remember(item):
+    # What the stored row adds to its invoice, to diff against after the next write
+    if {'amount', 'gst_amount'} & item.get_deferred_fields():
+        item._totals_old = None
+        return
+    item._totals_old = contribution(item)
+
+
+def apply_delta(invoice_id, amount, gst):
+    """Moves one invoice's totals by (amount, gst) in place, without reading its items."""
+    if not amount and not gst:
+        return
+    with transaction.atomic():
+        Invoice.objects.filter(pk=invoice_id).update(
+            total_amount=F('total_amount') + amount,
+            gst_amount=F('gst_amount') + gst,
+            updated_at=timezone.now(),
+        )
+        if amount:
+            # .update() skips the revenue rollup signals, so pass PAID changes on here
+            invoice = Invoice.objects.filter(pk=invoice_id, payment_status='PAID').only('created_at').first()
+            if invoice:
+                from reports.rollup import apply_delta as apply_rollup_delta
+                apply_rollup_delta(timezone.localdate(invoice.created_at), 'BILLING', amount, 0)
+
+
+def add_items(invoice, items):
+    """Appends new InvoiceItem objects with one insert and one totals UPDATE."""
+    for item in items:
+        item.invoice = invoice
+        prepare(item)
+    InvoiceItem.objects.bulk_create(items)
+    apply_delta(
+        invoice.pk,
+        sum((to_decimal(item.amount) for item in items), Decimal('0.00')),
+        sum((to_decimal(item.gst_amount) for item in items), Decimal('0.00')),
+    )
+    for item in items:
+        remember(item)
+    return items
+
+
+def sync_items(invoice, items_data):
+    """
+    Writes the invoice's items from validated dicts (see revive_cms.utils.sync_nested) and
+    moves its totals once for every new and changed row. Removed rows are taken off by the
+    post_delete signal.
+    """
+    from revive_cms.utils import sync_nested
+
+    created, updated = sync_nested(invoice, 'items', items_data, prepare=prepare, derived_fields=['gst_amount'])
+    amount = gst = Decimal('0.00')
+    for item in created:
+        item_amount, item_gst = contribution(item)
+        amount, gst = amount + item_amount, gst + item_gst
+    for item in updated:
+        # Rows were loaded whole, so post_init remembered what they added before
+        (item_amount, item_gst), old = contribution(item), item._totals_old
+        amount, gst = amount + item_amount - old[0], gst + item_gst - old[1]
+    apply_delta(invoice.pk, amount, gst)
+    for item in chain(created, updated):
+        remember(item)
+    return created, updated
+
+
+def item_sums():
+    """(total, gst) subqueries summing an invoice's items in the database."""
+    items = InvoiceItem.objects.filter(invoice=OuterRef('pk')).values('invoice').order_by()
+    zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    return (
+        Coalesce(Subquery(items.annotate(s=Sum('amount')).values('s')), zero),
+        Coalesce(Subquery(items.annotate(s=Sum('gst_amount')).values('s')), zero),
+    )
+
+
+def find_drift(queryset=None):
+    """
+    Yields (invoice id, stored (total, gst), items (total, gst)) for invoices whose
+    stored totals do not match the sum of their items.
+    """
+    total, gst = item_sums()
+    rows = (
+        (queryset if queryset is not None else Invoice.objects.all())
+        .annotate(items_total=total, items_gst=gst)
+        .values_list('id', 'total_amount', 'gst_amount', 'items_total', 'items_gst')
+        .order_by()
+    )
+    for pk, stored_total, stored_gst, items_total, items_gst in rows.iterator(chunk_size=2000):
+        stored = (to_decimal(stored_total), to_decimal(stored_gst))
+        actual = (to_decimal(items_total), to_decimal(items_gst))
+        if stored != actual:
+            yield pk, stored, actual
+
+
+def recalculate(queryset=None):
+    """
+    Repairs drifted invoices from a database-side Sum of their items. Each fix goes
+    through apply_delta() so the revenue rollup moves with it. Returns the number fixed.
+    """
+    fixed = 0
+    for pk, stored, actual in list(find_drift(queryset)):
+        apply_delta(pk, actual[0] - stored[0], actual[1] - stored[1])
+        fixed += 1
+    return fixed
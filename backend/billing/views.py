@@ -2,13 +2,15 @@ from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db.models import Sum, F
+from django.db import transaction
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from patients.models import Visit
 from patients.serializers import VisitSerializer
 from .models import Invoice
 from .serializers import InvoiceSerializer
-from pharmacy.models import PharmacyStock
+from pharmacy.stock import deduct_available, resolve
+from revive_cms.utils import day_bounds
 
 class IsAdminOrReception(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -23,13 +25,23 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     filterset_fields = ['payment_status', 'visit__doctor', 'visit__patient', 'visit__patient__id']
     ordering_fields = ['created_at', 'total_amount']
 
+    def get_queryset(self):
+        return InvoiceSerializer.setup_eager_loading(super().get_queryset())
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data['stock_deductions'] = self.stock_deductions
+        return response
+
+    @transaction.atomic
     def perform_create(self, serializer):
         invoice = serializer.save()
         
         # Deduct Stock based on request data (preserves stock_deducted flag)
         items_data = serializer.initial_data.get('items', [])
         
-        for item in items_data:
+        lines = []
+        for index, item in enumerate(items_data):
             # Check if item is from Pharmacy dept and NOT already deducted
             if item.get('dept') == 'PHARMACY' and not item.get('stock_deducted'):
                 name = item.get('description')
@@ -40,32 +52,38 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                     qty = 0
                 
                 if name and qty > 0:
-                    # Find Stock - prefer batch match, fallback to just name
-                    stock = None
-                    if batch:
-                        stock = PharmacyStock.objects.filter(name=name, batch_no=batch).first()
-                    
-                    if not stock:
-                        stock = PharmacyStock.objects.filter(name=name).first() # Fallback
-                    
-                    if stock:
-                        if stock.qty_available >= qty:
-                            # Avoid F() expression because it crashes signal handlers
-                            stock.qty_available -= qty 
-                            stock.save()
-                        else:
-                            # Partial deduct or just set to 0? 
-                            # Let's just deduct available
-                            stock.qty_available = 0
-                            stock.save()
+                    lines.append((index, name, batch, qty))
+
+        # Resolve every line in one query: exact (name, batch), else any batch of that name
+        stocks = resolve({(name, batch) for index, name, batch, qty in lines})
+        matched = [stocks.get((name, batch)) for index, name, batch, qty in lines]
+
+        # The invoice records a sale that already happened, so a short batch is deducted
+        # down to 0 rather than failing; rows are locked so concurrent invoices/sales don't race
+        deducted = deduct_available([
+            (stock.pk if stock else None, qty) for stock, (index, name, batch, qty) in zip(matched, lines)
+        ])
+
+        self.stock_deductions = [{
+            'line': index,
+            'description': name,
+            'batch': batch,
+            'med_stock': stock.pk if stock else None,
+            'matched_batch': stock.batch_no if stock else None,
+            'qty': qty,
+            'deducted': taken,
+            'shortfall': qty - taken,
+        } for (index, name, batch, qty), stock, (_, taken) in zip(lines, matched, deducted)]
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        today = timezone.now().date()
+        # Half-open bounds for today so the created_at index is usable
+        day_start, day_end = day_bounds(timezone.localdate())
         
         # Revenue Today (Sum of paid invoices)
         revenue = Invoice.objects.filter(
-            created_at__date=today, 
+            created_at__gte=day_start,
+            created_at__lt=day_end,
             payment_status='PAID'
         ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
 
@@ -75,7 +93,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
 
         # Invoices Count Today
-        count = Invoice.objects.filter(created_at__date=today).count()
+        count = Invoice.objects.filter(created_at__gte=day_start, created_at__lt=day_end).count()
 
         return Response({
             'revenue_today': revenue,
@@ -91,5 +109,6 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             pharmacy_sales__isnull=False,  # Must have pharmacy sales
             invoices__isnull=True  # No invoice yet
         ).distinct().order_by('-updated_at')
+        visits = VisitSerializer.setup_eager_loading(visits)
         serializer = VisitSerializer(visits, many=True)
         return Response(serializer.data)
@@ -0,0 +1,131 @@
+"""
+Threshold alerts for inventory items, shared by pharmacy stock and lab inventory.
+
+Each item remembers the level it was loaded with (post_init). After a save or a bulk
+write only items whose low/not-low side actually changed are looked up in AlertState,
+in one query per call, and notifications for every new crossing go out in one insert.
+A crossing only alerts if this writer's AlertState insert or conditional UPDATE took
+effect, so two writers racing on the same item send one alert.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AlertState, Notification
+from .notifications import create_notifications
+
+LOW_STOCK = 'LOW_STOCK'
+
+# item_type -> how to read an item's level and who hears about it
+SOURCES = {
+    'PHARMACY_STOCK': {
+        'qty': 'qty_available',
+        'threshold': 'reorder_level',
+        'roles': ['PHARMACY', 'ADMIN'],
+        'message': lambda s: f"Low stock alert: {s.name} (Batch: {s.batch_no}) has only {s.qty_available} units left.",
+    },
+    'LAB_INVENTORY': {
+        'qty': 'qty',
+        'threshold': 'reorder_level',
+        'roles': ['LAB', 'ADMIN'],
+        'message': lambda i: f"Lab Low Stock: {i.item_name} has only {i.qty} units left.",
+    },
+}
+
+
+def get_level(item_type, item):
+    source = SOURCES[item_type]
+    return getattr(item, source['qty']), getattr(item, source['threshold'])
+
+
+def is_low(level):
+    qty, threshold = level
+    return qty < threshold
+
+
+def remember_level(item_type, item):
+    # Reading a deferred field from post_init reloads the row, which inits again: never touch them
+    source = SOURCES[item_type]
+    if {source['qty'], source['threshold']} & item.get_deferred_fields():
+        item._alert_level = None
+        return
+    item._alert_level = get_level(item_type, item)
+
+
+def has_crossed(item_type, item):
+    previous = getattr(item, '_alert_level', None)
+    if previous is None:
+        return True
+    return is_low(previous) != is_low(get_level(item_type, item))
+
+
+def check_levels(item_type, items, created=False):
+    """
+    Raises or clears LOW_STOCK alerts for `items` (all of one item_type).
+    `created=True` means the items were just inserted, so only the ones already low matter.
+    Returns the number of notifications sent.
+    """
+    if created:
+        candidates = [item for item in items if is_low(get_level(item_type, item))]
+    else:
+        candidates = [item for item in items if has_crossed(item_type, item)]
+    for item in items:
+        remember_level(item_type, item)
+    if not candidates:
+        return 0
+
+    # Same item can appear twice in a batch; the last copy has the current level
+    candidates = list({item.pk: item for item in candidates}.values())
+    states = {
+        state.item_id: state
+        for state in AlertState.objects.filter(
+            item_type=item_type, kind=LOW_STOCK, item_id__in=[item.pk for item in candidates]
+        )
+    }
+
+    now = timezone.now()
+    new_states, raised, cleared = [], [], []
+    for item in candidates:
+        qty, threshold = get_level(item_type, item)
+        low = is_low((qty, threshold))
+        state = states.get(item.pk)
+
+        if low and state is None:
+            # First time below the threshold: raise the alert
+            new_states.append(AlertState(
+                item_type=item_type, item_id=item.pk, kind=LOW_STOCK,
+                is_active=True, level=qty, threshold=threshold
+            ))
+        elif low and not state.is_active:
+            # Dropped below the threshold again
+            raised.append((item, state))
+        elif not low and state and state.is_active:
+            # Back above the threshold: clear it so the next drop alerts again
+            state.is_active = False
+            state.level = qty
+            state.threshold = threshold
+            state.updated_at = now
+            cleared.append(state)
+
+    source = SOURCES[item_type]
+    with transaction.atomic():
+        fired = set()
+        if new_states:
+            AlertState.objects.bulk_create(new_states, ignore_conflicts=True)
+            # A concurrent writer may have inserted the same item first; only our rows alert
+            fired.update(
+                AlertState.objects.filter(pk__in=[state.pk for state in new_states]).values_list('item_id', flat=True)
+            )
+        for item, state in raised:
+            # Claimed with a conditional UPDATE, so two writers crossing at once alert once
+            level, threshold = get_level(item_type, item)
+            if AlertState.objects.filter(pk=state.pk, is_active=False).update(
+                is_active=True, level=level, threshold=threshold, updated_at=now
+            ):
+                fired.add(item.pk)
+        if cleared:
+            AlertState.objects.bulk_update(cleared, ['is_active', 'level', 'threshold', 'updated_at'])
+        create_notifications([
+            Notification(role=role, message=source['message'](item), type='WARNING', related_id=item.pk)
+            for item in candidates if item.pk in fired for role in source['roles']
+        ])
+    return len(fired)
@@ -6,7 +6,7 @@ from pharmacy.models import PharmacySale, PharmacyStock, PurchaseInvoice
 from lab.models import LabInventory, LabCharge
 from casualty.models import CasualtyLog
 from medical.models import DoctorNote
-from core.models import Notification
+from core.models import Notification, NotificationCounter
 
 class Command(BaseCommand):
     help = 'Flushes validation/transactional data but keeps Users.'
@@ -43,5 +43,7 @@ class Command(BaseCommand):
             # 4. Notifications
             deleted_notifs, _ = Notification.objects.all().delete()
             self.stdout.write(f"Deleted {deleted_notifs} Notifications")
+            # Unread badge counters would be stale; they are recomputed on next read
+            NotificationCounter.objects.all().delete()
 
         self.stdout.write(self.style.SUCCESS('Successfully flushed all transactional data.'))
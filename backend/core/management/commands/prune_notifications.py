@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import RealtimeEvent
+from core.notifications import prune_read
+
+
+class Command(BaseCommand):
+    help = 'Deletes read notifications older than --days and realtime resume events older than --event-days. Run daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Keep read notifications this many days (default 30).')
+        parser.add_argument('--event-days', type=int, default=3, help='Keep socket resume events this many days (default 3).')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        notifications, receipts = prune_read(now - timedelta(days=options['days']))
+        self.stdout.write(f"Deleted {notifications} read notifications and {receipts} redundant receipts")
+
+        # Clients further behind than this get reset=True from the resume endpoint and reload
+        events, _ = RealtimeEvent.objects.filter(created_at__lt=now - timedelta(days=options['event_days'])).delete()
+        self.stdout.write(f"Deleted {events} realtime events")
+
+        self.stdout.write(self.style.SUCCESS("Notification retention complete."))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:32
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RealtimeSequence',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('room', models.CharField(max_length=100, unique=True)),
+                ('last_seq', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RealtimeEvent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('room', models.CharField(max_length=100)),
+                ('seq', models.PositiveBigIntegerField()),
+                ('event', models.CharField(max_length=50)),
+                ('payload', models.JSONField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('room', 'seq'), name='unique_realtime_event_room_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.db import migrations
+
+# Rows of one broadcast were bulk-created together; anything further apart is a separate event
+BROADCAST_WINDOW = timedelta(seconds=5)
+
+
+def collapse_broadcasts(apps, schema_editor):
+    """
+    Per-user copies of the same message (same type, related_id and a few seconds apart) become
+    one role notification per recipient role; users who had read their copy get a receipt.
+
+    Only real broadcasts are collapsed: at least two distinct recipients of the role, covering
+    every active member who had joined by then. A message sent to a few users directly stays
+    with them instead of becoming visible to the whole role.
+    """
+    Notification = apps.get_model('core', 'Notification')
+    NotificationReceipt = apps.get_model('core', 'NotificationReceipt')
+    User = apps.get_model('users', 'User')
+
+    members = {}
+    for user_id, role, joined in User.objects.filter(is_active=True).values_list('id', 'role', 'date_joined'):
+        members.setdefault(role, []).append((user_id, joined))
+
+    def is_broadcast(role, copies):
+        recipients = {row.recipient_id for row in copies}
+        sent_at = copies[0].created_at
+        expected = {user_id for user_id, joined in members.get(role, []) if joined <= sent_at}
+        return len(recipients) >= 2 and expected <= recipients
+
+    rows = (
+        Notification.objects.filter(recipient__isnull=False)
+        .select_related('recipient')
+        .order_by('message', 'type', 'related_id', 'created_at')
+    )
+
+    groups = []
+    for row in rows.iterator(chunk_size=2000):
+        last = groups[-1][-1] if groups else None
+        if (
+            last is not None
+            and (last.message, last.type, last.related_id) == (row.message, row.type, row.related_id)
+            and row.created_at - groups[-1][0].created_at <= BROADCAST_WINDOW
+        ):
+            groups[-1].append(row)
+        else:
+            groups.append([row])
+
+    for group in groups:
+        if len(group) < 2:
+            continue
+
+        by_role = {}
+        for row in group:
+            by_role.setdefault(row.recipient.role, []).append(row)
+
+        collapsed = []
+        for role, copies in by_role.items():
+            if not is_broadcast(role, copies):
+                continue
+            collapsed.extend(copies)
+            first = copies[0]
+            notification = Notification.objects.create(
+                role=role,
+                message=first.message,
+                type=first.type,
+                related_id=first.related_id,
+            )
+            # auto_now_add stamped "now"; keep the original event time
+            Notification.objects.filter(pk=notification.pk).update(created_at=first.created_at)
+            NotificationReceipt.objects.bulk_create([
+                NotificationReceipt(notification=notification, user_id=row.recipient_id)
+                for row in copies if row.is_read
+            ], ignore_conflicts=True)
+
+        Notification.objects.filter(pk__in=[row.pk for row in collapsed]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_role_notifications'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_broadcasts, migrations.RunPython.noop),
+    ]
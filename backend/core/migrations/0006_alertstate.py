@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:45
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_convert_role_broadcasts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertState',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('item_type', models.CharField(choices=[('PHARMACY_STOCK', 'Pharmacy Stock'), ('LAB_INVENTORY', 'Lab Inventory')], max_length=20)),
+                ('item_id', models.UUIDField()),
+                ('kind', models.CharField(choices=[('LOW_STOCK', 'Low Stock')], default='LOW_STOCK', max_length=20)),
+                ('is_active', models.BooleanField(default=False)),
+                ('level', models.IntegerField(default=0)),
+                ('threshold', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item_type', 'item_id', 'kind'), name='unique_alert_state_item_kind')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def seed_alert_states(apps, schema_editor):
+    """
+    Items that were already below their reorder level before crossing-based alerts were
+    deployed have no AlertState, so the first save after deploy would alert for every one of
+    them at once. Record them as active without notifying; the next drop after a restock
+    alerts as usual.
+    """
+    AlertState = apps.get_model('core', 'AlertState')
+    PharmacyStock = apps.get_model('pharmacy', 'PharmacyStock')
+    LabInventory = apps.get_model('lab', 'LabInventory')
+    from django.db.models import F
+
+    # (item_type, low items, qty field)
+    sources = [
+        ('PHARMACY_STOCK', PharmacyStock.objects.filter(is_deleted=False, qty_available__lt=F('reorder_level')),
+         'qty_available'),
+        ('LAB_INVENTORY', LabInventory.objects.filter(qty__lt=F('reorder_level')), 'qty'),
+    ]
+    for item_type, items, qty_field in sources:
+        known = set(AlertState.objects.filter(item_type=item_type, kind='LOW_STOCK').values_list('item_id', flat=True))
+        AlertState.objects.bulk_create([
+            AlertState(
+                item_type=item_type, item_id=item.pk, kind='LOW_STOCK',
+                is_active=True, level=getattr(item, qty_field), threshold=item.reorder_level,
+            )
+            for item in items.iterator(chunk_size=2000) if item.pk not in known
+        ], batch_size=2000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_notificationcounter'),
+        ('pharmacy', '0014_stock_batch_idx'),
+        ('lab', '0013_labcharge_labcharge_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_alert_states, migrations.RunPython.noop),
+    ]
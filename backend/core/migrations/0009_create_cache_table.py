@@ -0,0 +1,19 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # Shared cache for the barcode index and lab catalog versions (settings.CACHES);
+    # a no-op when the configured backend is not the database cache or the table exists
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_seed_alert_states'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -12,11 +12,105 @@ class BaseModel(models.Model):
         abstract = True
 
 class Notification(BaseModel):
-    recipient = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='notifications')
+    # Direct notifications have a recipient and use is_read. Role notifications are stored
+    # once with `role` set; per-user read state lives in NotificationReceipt/NotificationWatermark.
+    recipient = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
+    role = models.CharField(max_length=20, null=True, blank=True)
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     type = models.CharField(max_length=50, default='INFO') # e.g., VISIT_ASSIGNED
     related_id = models.UUIDField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # NotificationViewSet: recipient=user ordered by -created_at, unread filters
+            models.Index(fields=['recipient', 'is_read', '-created_at'], name='notif_recipient_read_idx'),
+            models.Index(fields=['recipient', '-created_at'], name='notif_recipient_created_idx'),
+            models.Index(fields=['role', '-created_at'], name='notif_role_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification for {self.recipient or self.role}: {self.message}"
+
+class NotificationReceipt(BaseModel):
+    """A user has read one role notification (only rows newer than their watermark need one)."""
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='receipts')
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='notification_receipts')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='unique_notification_receipt')
+        ]
+
+    def __str__(self):
+        return f"{self.user} read {self.notification_id}"
+
+class NotificationWatermark(BaseModel):
+    """Every role notification created at or before `read_until` counts as read for `user`."""
+    user = models.OneToOneField('users.User', on_delete=models.CASCADE, related_name='notification_watermark')
+    read_until = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user} read until {self.read_until}"
+
+class RealtimeSequence(BaseModel):
+    """Last sequence number handed out for a Socket.IO room (see core.realtime)."""
+    room = models.CharField(max_length=100, unique=True)
+    last_seq = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.room} @ {self.last_seq}"
+
+class RealtimeEvent(BaseModel):
+    """A delta as it was sent to one room, kept so reconnecting clients can resume."""
+    room = models.CharField(max_length=100)
+    seq = models.PositiveBigIntegerField()
+    event = models.CharField(max_length=50)
+    payload = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'seq'], name='unique_realtime_event_room_seq')
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.room}#{self.seq}"
+
+class NotificationCounter(BaseModel):
+    """
+    Cached unread count for the notification badge. Kept in step by core.notifications;
+    a missing row is recomputed on the next read.
+    """
+    user = models.OneToOneField('users.User', on_delete=models.CASCADE, related_name='notification_counter')
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user}: {self.unread} unread"
+
+class AlertState(BaseModel):
+    """
+    Whether a threshold alert is currently raised for one inventory item (see core.alerts).
+    A notification is only sent when an item crosses into the alert state, not on every save.
+    """
+    ITEM_TYPE_CHOICES = (
+        ('PHARMACY_STOCK', 'Pharmacy Stock'),
+        ('LAB_INVENTORY', 'Lab Inventory'),
+    )
+    KIND_CHOICES = (
+        ('LOW_STOCK', 'Low Stock'),
+    )
+
+    item_type = models.CharField(max_length=20, choices=ITEM_TYPE_CHOICES)
+    item_id = models.UUIDField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='LOW_STOCK')
+    is_active = models.BooleanField(default=False)
+    level = models.IntegerField(default=0)  # quantity when the state last changed
+    threshold = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item_type', 'item_id', 'kind'], name='unique_alert_state_item_kind')
+        ]
+
     def __str__(self):
-        return f"Notification for {self.recipient}: {self.message}"
+        return f"{self.kind} {self.item_type}:{self.item_id} ({'active' if self.is_active else 'clear'})"
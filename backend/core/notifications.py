@@ -0,0 +1,210 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Q, F, Exists, OuterRef, Case, When, Value, BooleanField
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, NotificationReceipt, NotificationWatermark, NotificationCounter
+
+
+def create_notifications(notifications):
+    """
+    Inserts `notifications` (unsaved Notification objects) and bumps the unread counter of
+    everyone who will see them: one UPDATE per recipient or role, not per user.
+    Every notification should be created through here so the badge counts stay right.
+    """
+    if not notifications:
+        return []
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(notifications)
+        count_created(created)
+    return created
+
+
+def count_created(notifications):
+    """Adds freshly saved `notifications` to the unread counters and pushes the new counts."""
+    direct = Counter(n.recipient_id for n in notifications if n.recipient_id)
+    roles = Counter(n.role for n in notifications if n.recipient_id is None and n.role)
+    with transaction.atomic():
+        lock_uncounted(Q(pk__in=direct) | Q(role__in=roles))
+        for user_id, count in direct.items():
+            NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + count)
+        for role, count in roles.items():
+            NotificationCounter.objects.filter(user__role=role).update(unread=F('unread') + count)
+    push_counts(user_ids=list(direct), roles=list(roles))
+
+
+def lock_uncounted(users):
+    """
+    Locks the `users` (a Q on User) that have no counter row yet, in primary key order.
+    get_unread_count() holds the same lock while it builds a missing counter, so a
+    notification committed meanwhile is either in its count or added to the row once
+    it exists, never dropped by an UPDATE that found no row.
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+
+    return list(
+        User.objects.select_for_update(of=('self',))
+        .filter(users, notification_counter__isnull=True)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def notify_user(user, message, type='INFO', related_id=None):
+    """One notification for one user."""
+    return create_notifications([
+        Notification(recipient=user, message=message, type=type, related_id=related_id)
+    ])[0]
+
+
+def notify_roles(roles, message, type='INFO', related_id=None):
+    """
+    One row per role, read by every member of that role (fan-out on read), instead of
+    one row per active user.
+    """
+    if isinstance(roles, str):
+        roles = [roles]
+    return create_notifications([
+        Notification(role=role, message=message, type=type, related_id=related_id)
+        for role in roles
+    ])
+
+
+def visible_to(user):
+    """
+    Direct notifications for `user` plus their role's notifications since they joined.
+    """
+    return Notification.objects.filter(
+        Q(recipient=user) | Q(role=user.role, recipient__isnull=True, created_at__gte=user.date_joined)
+    )
+
+
+def get_watermark(user):
+    return NotificationWatermark.objects.filter(user=user).values_list('read_until', flat=True).first()
+
+
+def role_read_condition(user):
+    """Condition on Notification rows: this role notification is read by `user`."""
+    condition = Exists(NotificationReceipt.objects.filter(notification=OuterRef('pk'), user=user))
+    watermark = get_watermark(user)
+    if watermark:
+        condition = Q(created_at__lte=watermark) | condition
+    return condition
+
+
+def with_read_state(queryset, user):
+    """
+    Annotates `read` for `user`: is_read on direct rows, watermark or receipt on role rows.
+    """
+    return queryset.annotate(read=Case(
+        When(recipient__isnull=False, then=F('is_read')),
+        When(role_read_condition(user), then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    ))
+
+
+def count_unread(user):
+    return with_read_state(visible_to(user), user).filter(read=False).count()
+
+
+def get_unread_count(user):
+    """Badge count from the per-user counter, computing and storing it the first time."""
+    unread = NotificationCounter.objects.filter(user=user).values_list('unread', flat=True).first()
+    if unread is not None:
+        return unread
+
+    with transaction.atomic():
+        lock_uncounted(Q(pk=user.pk))
+        counter, created = NotificationCounter.objects.get_or_create(user=user, defaults={'unread': 0})
+        if created:
+            # Added rather than assigned, so nothing counted into the new row before this
+            # commits is overwritten
+            NotificationCounter.objects.filter(pk=counter.pk).update(unread=F('unread') + count_unread(user))
+        return NotificationCounter.objects.filter(pk=counter.pk).values_list('unread', flat=True).get()
+
+
+def push_counts(user_ids=(), roles=()):
+    """Sends the current unread count to each affected user's Socket.IO room."""
+    if not user_ids and not roles:
+        return
+    from revive_cms.sio import emit_event, user_room
+
+    counters = NotificationCounter.objects.filter(
+        Q(user_id__in=user_ids) | Q(user__role__in=roles)
+    ).values_list('user_id', 'unread')
+    for user_id, unread in counters:
+        emit_event(
+            'notification_count', {'unread': unread}, [user_room(user_id)],
+            include_admin=False, key=('notification_count', str(user_id))
+        )
+
+
+def mark_read(user, ids):
+    """
+    Marks the given notifications read for `user` only. Returns how many were unread.
+    """
+    unread = with_read_state(visible_to(user).filter(id__in=ids), user).filter(read=False)
+    direct_ids, role_ids = [], []
+    for notification_id, recipient_id in unread.values_list('id', 'recipient_id'):
+        (direct_ids if recipient_id else role_ids).append(notification_id)
+    count = len(direct_ids) + len(role_ids)
+    if not count:
+        return 0
+
+    with transaction.atomic():
+        Notification.objects.filter(id__in=direct_ids).update(is_read=True)
+        NotificationReceipt.objects.bulk_create([
+            NotificationReceipt(notification_id=notification_id, user=user) for notification_id in role_ids
+        ], ignore_conflicts=True)
+        NotificationCounter.objects.filter(user=user).update(unread=Greatest(F('unread') - count, 0))
+
+    push_counts(user_ids=[user.id])
+    return count
+
+
+def mark_all_read(user):
+    """
+    Everything visible to `user` becomes read: direct rows are flagged, role rows are covered
+    by moving the user's watermark to now, which also makes their receipts redundant.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        NotificationWatermark.objects.update_or_create(user=user, defaults={'read_until': now})
+        NotificationReceipt.objects.filter(user=user, notification__created_at__lte=now).delete()
+        NotificationCounter.objects.update_or_create(user=user, defaults={'unread': 0})
+
+    push_counts(user_ids=[user.id])
+
+
+def prune_read(cutoff):
+    """
+    Deletes notifications older than `cutoff` that are read by everyone who can see them,
+    and receipts already covered by their user's watermark. Returns (notifications, receipts).
+    """
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+
+    # Active role members who joined before the notification and have not read it yet
+    unread_members = User.objects.filter(
+        role=OuterRef('role'), is_active=True, date_joined__lte=OuterRef('created_at')
+    ).exclude(
+        notification_watermark__read_until__gte=OuterRef('created_at')
+    ).exclude(
+        Exists(NotificationReceipt.objects.filter(user=OuterRef('pk'), notification=OuterRef(OuterRef('pk'))))
+    )
+
+    with transaction.atomic():
+        _, direct = Notification.objects.filter(
+            recipient__isnull=False, is_read=True, created_at__lt=cutoff
+        ).delete()
+        _, role = Notification.objects.filter(
+            recipient__isnull=True, created_at__lt=cutoff
+        ).exclude(Exists(unread_members)).delete()
+        receipts, _ = NotificationReceipt.objects.filter(
+            user__notification_watermark__read_until__gte=F('notification__created_at')
+        ).delete()
+    return direct.get('core.Notification', 0) + role.get('core.Notification', 0), receipts
@@ -3,8 +3,13 @@ from .models import Notification
 
 class NotificationSerializer(serializers.ModelSerializer):
     timestamp = serializers.DateTimeField(source='created_at', read_only=True)
+    # Per-user read state: annotated by core.notifications.with_read_state for role notifications
+    is_read = serializers.SerializerMethodField()
     
     class Meta:
         model = Notification
-        fields = ['id', 'recipient', 'message', 'is_read', 'type', 'related_id', 'timestamp']
-        read_only_fields = ['recipient', 'created_at']
+        fields = ['id', 'recipient', 'role', 'message', 'is_read', 'type', 'related_id', 'timestamp']
+        read_only_fields = ['recipient', 'role', 'created_at']
+
+    def get_is_read(self, obj):
+        return getattr(obj, 'read', obj.is_read)
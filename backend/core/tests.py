@@ -1,3 +1,327 @@
+from django.db import transaction
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from patients.models import Patient, Visit
+from users.models import User
+from .models import (
+    Notification, NotificationCounter, NotificationReceipt, NotificationWatermark, RealtimeEvent, RealtimeSequence,
+)
+from .notifications import (
+    count_unread, get_unread_count, mark_all_read, mark_read, notify_roles, notify_user, prune_read,
+)
+from .realtime import publish
+
+
+class RealtimePublishTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('doctor', password='x', role='DOCTOR')
+        cls.other_doctor = User.objects.create_user('doctor2', password='x', role='DOCTOR')
+        patient = Patient.objects.create(full_name='Ravi', age=50, gender='M', phone='9400000001', address='-')
+        cls.visit = Visit.objects.create(patient=patient, doctor=cls.doctor)
+
+    def test_sequences_are_allocated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                publish('visit_update', 'visit', self.visit.pk, {'status': 'OPEN'}, ['role:DOCTOR'])
+                publish('visit_update', 'visit', self.visit.pk, {'status': 'CLOSED'}, ['role:DOCTOR'])
+                # Nothing is sequenced or locked while the write is still open
+                self.assertFalse(RealtimeSequence.objects.exists())
+                self.assertFalse(RealtimeEvent.objects.exists())
+
+        self.assertEqual(
+            list(RealtimeEvent.objects.filter(room='role:DOCTOR').order_by('seq').values_list('seq', 'payload__data__status')),
+            [(1, 'OPEN'), (2, 'CLOSED')],
+        )
+        # Admins get their own copy with their own sequence
+        self.assertEqual(RealtimeSequence.objects.get(room='role:ADMIN').last_seq, 2)
+
+    def test_delivery_query_count_does_not_grow_with_rooms(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .realtime import deliver
+
+        counts = []
+        for rooms in (['role:LAB'], ['role:LAB', 'role:PHARMACY', 'role:RECEPTION', 'user:1', 'user:2']):
+            for _ in range(2):  # new sequence rows, then existing ones
+                with CaptureQueriesContext(connection) as queries:
+                    deliver('visit_update', {'id': '1'}, rooms)
+                counts.append(len(queries))
+        self.assertEqual(counts[0], counts[2])
+        self.assertEqual(counts[1], counts[3])
+        self.assertEqual(
+            dict(RealtimeSequence.objects.values_list('room', 'last_seq')),
+            {'role:LAB': 4, 'role:PHARMACY': 2, 'role:RECEPTION': 2, 'user:1': 2, 'user:2': 2},
+        )
+        self.assertEqual(RealtimeEvent.objects.filter(room='role:LAB').count(), 4)
+
+    def test_resume_checks_visit_access(self):
+        client = APIClient()
+        room = f'visit:{self.visit.pk}'
+
+        client.force_authenticate(self.doctor)
+        self.assertEqual(client.get('/api/core/events/resume/', {'room': room}).status_code, 200)
+        client.force_authenticate(self.other_doctor)
+        self.assertEqual(client.get('/api/core/events/resume/', {'room': room}).status_code, 403)
+
+
+class EventBusLatencyTests(TestCase):
+    def test_emit_event_does_not_wait_for_the_socket(self):
+        import asyncio
+        import threading
+        import time
+        from unittest import mock
+
+        from revive_cms.event_bus import EventBus
+        from revive_cms.sio import emit_event
+
+        sent = threading.Event()
+
+        async def slow_emit(event, data, to=None):
+            await asyncio.sleep(0.5)
+            sent.set()
+
+        bus = EventBus()
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(lambda: (bus.start(), started.set()))
+            loop.run_forever()
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        started.wait(1)
+        try:
+            with mock.patch('revive_cms.event_bus.event_bus', bus), \
+                    mock.patch('revive_cms.sio.sio.emit', side_effect=slow_emit):
+                with self.captureOnCommitCallbacks(execute=True):
+                    begin = time.monotonic()
+                    emit_event('visit_update', {'id': 1}, ['role:DOCTOR'])
+                    elapsed = time.monotonic() - begin
+                # The caller only queues the event; the slow send happens on the loop
+                self.assertLess(elapsed, 0.05)
+                self.assertFalse(sent.is_set())
+                self.assertTrue(sent.wait(2))
+        finally:
+            def shutdown():
+                for task in asyncio.all_tasks(loop):
+                    task.cancel()
+                loop.call_soon(loop.stop)
+            loop.call_soon_threadsafe(shutdown)
+            thread.join(1)
+            loop.close()
+        self.assertEqual(bus.get_metrics()['enqueued'], 1)
+
+
+class EventBusOrderTests(TestCase):
+    def test_each_room_gets_its_events_in_order(self):
+        import asyncio
+        import time
+        from unittest import mock
+
+        from revive_cms.event_bus import EventBus
+
+        sent = []
+
+        async def emit(event, data, to=None):
+            await asyncio.sleep(data['delay'])
+            sent.append((data['source'], data['seq']))
+
+        events = [
+            # (source, seq, rooms, seconds the send takes)
+            ('visit', 1, ['visit:1'], 0.1),
+            ('lab', 1, ['role:LAB'], 0.05),
+            ('visit', 2, ['visit:1', 'role:ADMIN'], 0),
+            ('lab', 2, ['role:LAB'], 0),
+            ('pharmacy', 1, ['role:PHARMACY'], 0),
+        ]
+
+        async def scenario():
+            bus = EventBus()
+            bus.start()
+            for source, seq, rooms, delay in events:
+                bus.put((time.monotonic(), 'update', {'source': source, 'seq': seq, 'delay': delay}, rooms, None))
+            for _ in range(100):
+                if bus.metrics['dispatched'] == len(events):
+                    break
+                await asyncio.sleep(0.01)
+
+        with mock.patch('revive_cms.sio.sio.emit', side_effect=emit):
+            asyncio.run(scenario())
+
+        self.assertEqual(len(sent), len(events))
+        for source in ('visit', 'lab'):
+            self.assertEqual([seq for sent_source, seq in sent if sent_source == source], [1, 2])
+        # Other rooms are not held up by the slow ones
+        self.assertEqual(sent[0], ('pharmacy', 1))
+
+
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacist = User.objects.create_user('pharmacist', password='x', role='PHARMACY')
+        cls.pharmacist2 = User.objects.create_user('pharmacist2', password='x', role='PHARMACY')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacist)
+
+    def test_role_notification_only_accepts_read_acknowledgement(self):
+        notify_roles('PHARMACY', 'Low stock: Paracetamol', type='WARNING')
+        notification = Notification.objects.get(role='PHARMACY')
+        url = f'/api/core/notifications/{notification.pk}/'
+
+        response = self.client.patch(url, {'message': 'edited', 'type': 'INFO'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.put(url, {'message': 'edited'}, format='json').status_code, 400)
+        notification.refresh_from_db()
+        self.assertEqual((notification.message, notification.type), ('Low stock: Paracetamol', 'WARNING'))
+
+        response = self.client.patch(url, {'is_read': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_read'])
+        # Read for this user only
+        self.client.force_authenticate(self.pharmacist2)
+        self.assertFalse(self.client.get(url).data['is_read'])
+
+    def test_count_endpoint(self):
+        notify_roles('PHARMACY', 'Restock due')
+        notify_user(self.pharmacist, 'Shift changed')
+        notify_user(self.pharmacist2, 'Not yours')
+        response = self.client.get('/api/core/notifications/count/')
+        self.assertEqual(response.data, {'count': 2, 'unread': 2})
+
+
+class UnreadCounterTests(TestCase):
+    """The stored badge count must always equal a fresh count of unread notifications."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pharmacist = User.objects.create_user('pharmacist', password='x', role='PHARMACY')
+        cls.pharmacist2 = User.objects.create_user('pharmacist2', password='x', role='PHARMACY')
+
+    def assertCounted(self, user, unread):
+        self.assertEqual(count_unread(user), unread)
+        self.assertEqual(get_unread_count(user), unread)
+
+    def test_counter_is_built_once_then_kept_by_writes(self):
+        notify_roles('PHARMACY', 'Restock due')
+        notify_user(self.pharmacist, 'Shift changed')
+        self.assertFalse(NotificationCounter.objects.exists())
+        self.assertCounted(self.pharmacist, 2)
+
+        notify_roles('PHARMACY', 'Cold chain alarm')
+        notify_user(self.pharmacist2, 'Not yours')
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unread_count(self.pharmacist), 3)
+        self.assertCounted(self.pharmacist, 3)
+
+    def test_notification_created_while_building_the_counter_is_kept(self):
+        from unittest import mock
+        from . import notifications
+
+        notify_roles('PHARMACY', 'Restock due')
+        real_count = notifications.count_unread
+
+        def count_then_notify(user):
+            unread = real_count(user)
+            notify_roles('PHARMACY', 'Arrived mid-count')
+            return unread
+
+        with mock.patch.object(notifications, 'count_unread', side_effect=count_then_notify):
+            self.assertEqual(get_unread_count(self.pharmacist), 2)
+        self.assertCounted(self.pharmacist, 2)
+
+    def test_mark_read(self):
+        role = notify_roles('PHARMACY', 'Restock due')[0]
+        direct = notify_user(self.pharmacist, 'Shift changed')
+        notify_user(self.pharmacist, 'Still unread')
+        get_unread_count(self.pharmacist)
+        get_unread_count(self.pharmacist2)
+
+        self.assertEqual(mark_read(self.pharmacist, [role.pk, direct.pk]), 2)
+        self.assertEqual(mark_read(self.pharmacist, [role.pk, direct.pk]), 0)
+        self.assertCounted(self.pharmacist, 1)
+        # A role notification is read per user
+        self.assertCounted(self.pharmacist2, 1)
+
+    def test_mark_all_read(self):
+        notify_roles('PHARMACY', 'Restock due')
+        notify_user(self.pharmacist, 'Shift changed')
+        get_unread_count(self.pharmacist)
+
+        mark_all_read(self.pharmacist)
+        self.assertCounted(self.pharmacist, 0)
+        self.assertCounted(self.pharmacist2, 1)
+
+        notify_roles('PHARMACY', 'Cold chain alarm')
+        self.assertCounted(self.pharmacist, 1)
+
+    def test_prune_read(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        read_direct = notify_user(self.pharmacist, 'Old and read')
+        unread_direct = notify_user(self.pharmacist, 'Old and unread')
+        read_by_all = notify_roles('PHARMACY', 'Read by both')[0]
+        read_by_one = notify_roles('PHARMACY', 'Read by one')[0]
+        mark_read(self.pharmacist, [read_direct.pk, read_by_all.pk, read_by_one.pk])
+        mark_read(self.pharmacist2, [read_by_all.pk])
+
+        old = timezone.now() - timedelta(days=40)
+        Notification.objects.update(created_at=old)
+        User.objects.update(date_joined=old - timedelta(days=1))
+        recent = notify_roles('PHARMACY', 'Recent')[0]
+        mark_read(self.pharmacist, [recent.pk])
+        # A watermark past every receipt makes them redundant
+        NotificationWatermark.objects.create(user=self.pharmacist, read_until=timezone.now())
+        before = {user: count_unread(user) for user in (self.pharmacist, self.pharmacist2)}
+
+        self.assertEqual(prune_read(timezone.now() - timedelta(days=30)), (2, 2))
+        self.assertEqual(
+            set(Notification.objects.values_list('pk', flat=True)), {unread_direct.pk, read_by_one.pk, recent.pk}
+        )
+        self.assertFalse(NotificationReceipt.objects.exists())
+        # Only rows read by everyone went, so nobody's count moved
+        for user, unread in before.items():
+            self.assertCounted(user, unread)
+
+
+class CollapseBroadcastMigrationTests(TestCase):
+    """core 0005 turns per-user copies of a broadcast into one role notification."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctors = [User.objects.create_user(f'doctor{n}', password='x', role='DOCTOR') for n in range(3)]
+
+    def collapse(self):
+        from importlib import import_module
+        from django.apps import apps
+        import_module('core.migrations.0005_convert_role_broadcasts').collapse_broadcasts(apps, None)
+
+    def copies(self, message, users, read=()):
+        Notification.objects.bulk_create([
+            Notification(recipient=user, message=message, type='VISIT_ASSIGNED', is_read=user in read)
+            for user in users
+        ])
+
+    def test_copies_to_every_member_become_one_role_notification(self):
+        self.copies('New Patient in Queue: Asha', self.doctors, read=[self.doctors[0]])
+        self.collapse()
+
+        notification = Notification.objects.get()
+        self.assertEqual((notification.role, notification.recipient_id), ('DOCTOR', None))
+        self.assertEqual(
+            list(NotificationReceipt.objects.values_list('user_id', flat=True)), [self.doctors[0].pk]
+        )
+
+    def test_copies_to_some_members_stay_direct(self):
+        self.copies('Transferred patient: Asha', self.doctors[:2])
+        self.copies('Shift changed', self.doctors[:1])
+        self.collapse()
+
+        self.assertFalse(Notification.objects.filter(role__isnull=False).exists())
+        self.assertEqual(Notification.objects.filter(recipient__isnull=False).count(), 3)
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DashboardStatsView, NotificationViewSet
+from .views import DashboardStatsView, NotificationViewSet, RealtimeResumeView, RealtimeMetricsView
 
 router = DefaultRouter()
 router.register('notifications', NotificationViewSet, basename='notifications')
 
 urlpatterns = [
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
+    path('events/resume/', RealtimeResumeView.as_view(), name='realtime-resume'),
+    path('events/metrics/', RealtimeMetricsView.as_view(), name='realtime-metrics'),
     path('', include(router.urls)),
 ]
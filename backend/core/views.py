@@ -9,18 +9,20 @@ from billing.models import Invoice
 from pharmacy.models import PharmacyStock
 
 from lab.models import LabCharge
-from django.db.models.functions import TruncDate
+from reports.rollup import get_totals
+from revive_cms.utils import day_bounds
 from datetime import timedelta
 
 class DashboardStatsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        today = timezone.now().date()
+        today = timezone.localdate()
         last_week = today - timedelta(days=7)
+        day_start, day_end = day_bounds(today)
 
         # 1. Patient & Visit Stats
-        new_patients_today = Patient.objects.filter(created_at__date=today).count()
+        new_patients_today = Patient.objects.filter(created_at__gte=day_start, created_at__lt=day_end).count()
         active_visits = Visit.objects.filter(status__in=['OPEN', 'IN_PROGRESS']).count()
         
         # 2. Recent Activity (Visits)
@@ -32,16 +34,15 @@ class DashboardStatsView(APIView):
             "id": v.id
         } for v in recent_visits]
 
-        # 3. Financials (Today & Weekly Trend)
-        revenue_today = Invoice.objects.filter(
-            created_at__date=today, 
-            payment_status='PAID'
-        ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
+        # 3. Financials (Today & Weekly Trend) - read from the daily rollup (one row per day)
+        daily_totals = get_totals(last_week, today)
+        revenue_today = daily_totals.get(today, {}).get('BILLING', 0)
 
-        weekly_revenue = Invoice.objects.filter(
-            created_at__date__gte=last_week,
-            payment_status='PAID'
-        ).annotate(date=TruncDate('created_at')).values('date').annotate(total=Sum('total_amount')).order_by('date')
+        weekly_revenue = [
+            {'date': date, 'total': departments['BILLING']}
+            for date, departments in sorted(daily_totals.items())
+            if 'BILLING' in departments
+        ]
 
         # 4. Lab Stats
         pending_labs = LabCharge.objects.filter(status='PENDING').count()
@@ -64,19 +65,120 @@ class DashboardStatsView(APIView):
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from .models import Notification
+from .permissions import IsAdminRole
 from .serializers import NotificationSerializer
 
+class NotificationCursorPagination(CursorPagination):
+    # Direct and role notifications are merged in one ordered query; a cursor keeps pages
+    # stable while new notifications keep arriving at the top
+    ordering = '-created_at'
+
+
 class NotificationViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = NotificationSerializer
+    pagination_class = NotificationCursorPagination
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user).order_by('-created_at')
+        from .notifications import visible_to, with_read_state
+        return with_read_state(visible_to(self.request.user), self.request.user).order_by('-created_at')
+
+    def perform_create(self, serializer):
+        from .notifications import count_created
+        notification = serializer.save(recipient=self.request.user)
+        count_created([notification])
+
+    def update(self, request, *args, **kwargs):
+        # Role notifications are shared rows, so the only write a reader may make is the
+        # per-user acknowledgement: PATCH {"is_read": true}, the same path as mark_read
+        instance = self.get_object()
+        changed = set(request.data) - {'is_read'}
+        if changed:
+            return Response(
+                {"detail": f"Only is_read can be changed, not: {', '.join(sorted(changed))}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if str(request.data.get('is_read')).lower() == 'true':
+            from .notifications import mark_read
+            mark_read(request.user, [instance.id])
+            instance = self.get_object()
+        return Response(self.get_serializer(instance).data)
+
+    def perform_destroy(self, instance):
+        from .notifications import mark_read
+        # Marking read first keeps the unread counter right. A role notification is shared,
+        # so "deleting" it only marks it read for this user.
+        mark_read(self.request.user, [instance.id])
+        if instance.recipient_id is not None:
+            instance.delete()
 
     @action(detail=False, methods=['post'])
     def mark_read(self, request):
+        from .notifications import mark_read, get_unread_count
         ids = request.data.get('ids', [])
         if ids:
-            self.get_queryset().filter(id__in=ids).update(is_read=True)
-        return Response({'status': 'ok'})
+            mark_read(request.user, ids)
+        return Response({'status': 'ok', 'unread': get_unread_count(request.user)})
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        from .notifications import mark_all_read
+        mark_all_read(request.user)
+        return Response({'status': 'ok', 'unread': 0})
+
+    @action(detail=False, methods=['get'])
+    def count(self, request):
+        # Cursor pages carry no total (it would cost a COUNT per page); clients that need it ask here
+        from .notifications import visible_to, get_unread_count
+        return Response({
+            'count': visible_to(request.user).count(),
+            'unread': get_unread_count(request.user),
+        })
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        # Badge endpoint: reads the per-user counter, no COUNT over notifications
+        from .notifications import get_unread_count
+        return Response({'unread': get_unread_count(request.user)})
+
+
+class RealtimeResumeView(APIView):
+    """
+    Deltas a reconnecting client missed in one room.
+    GET ?room=role:PHARMACY&since=<last seq seen>
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        from .realtime import can_access_room, get_events_since, RESUME_LIMIT
+
+        room = request.query_params.get('room', '').strip()
+        if not room:
+            return Response({"room": ["This field is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            since = int(request.query_params.get('since', 0))
+        except ValueError:
+            return Response({"since": ["Must be an integer."]}, status=status.HTTP_400_BAD_REQUEST)
+        if not can_access_room(request.user, room):
+            return Response({"detail": "You cannot read this room."}, status=status.HTTP_403_FORBIDDEN)
+
+        latest, reset, events = get_events_since(room, since)
+        return Response({
+            "room": room,
+            "since": since,
+            "latest_seq": latest,
+            "reset": reset,
+            "has_more": len(events) == RESUME_LIMIT,
+            "events": events
+        })
+
+
+class RealtimeMetricsView(APIView):
+    """Queue depth and dispatch latency of the outbound Socket.IO event bus."""
+    permission_classes = [IsAdminRole]
+
+    def get(self, request):
+        from revive_cms.event_bus import event_bus
+        return Response(event_bus.get_metrics())
@@ -0,0 +1,51 @@
+"""
+Versioned lab test catalog for the requisition screens.
+
+A version token (revive_cms.versions) changes on commit whenever a LabTest, one of its
+parameters or required items, or the name of a referenced inventory item changes
+(lab.signals). The serialized full catalog is cached under its version, and the version
+doubles as the ETag, so clients revalidating with If-None-Match get a 304 without the
+catalog being rebuilt or sent. The token is checked against the shared cache at most once
+per settings.VERSION_CHECK_TTL, so a revalidation within that window runs no query; edits
+from other worker processes change the ETag within the TTL.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+from revive_cms import versions
+
+VERSION_KEY = 'lab:test_catalog:v'
+
+# Cached catalogs are replaced by version anyway; this just lets unused ones expire
+CATALOG_TTL = 60 * 60 * 24
+
+
+def get_version():
+    return versions.get_version(VERSION_KEY)
+
+
+def bump():
+    versions.bump([VERSION_KEY])
+
+
+def invalidate():
+    """Moves the catalog to a new version once the current transaction commits."""
+    transaction.on_commit(bump)
+
+
+def etag_for(version, query=''):
+    # Filtered listings get their own tag per query string
+    suffix = f"-{hashlib.md5(query.encode()).hexdigest()[:12]}" if query else ''
+    return f'"lab-tests-{version}{suffix}"'
+
+
+def get_catalog(version, build):
+    """The full serialized catalog for `version`, built with `build()` on a miss."""
+    key = f'lab:test_catalog:{version}'
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, CATALOG_TTL)
+    return data
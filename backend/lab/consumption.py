@@ -0,0 +1,167 @@
+"""
+Lab inventory movements and test completion.
+
+Stock in/out are single conditional UPDATEs, so concurrent counters cannot lose or
+oversell units. Completing charges consumes every reagent of every charge with one
+locked read and one bulk write, logs them with one insert and bills the visit's pending
+invoice in the same transaction, so the query count does not grow with the recipe.
+Bulk writes skip post_save, so low stock alerts are checked here for the whole batch.
+"""
+import uuid
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.alerts import check_levels
+from .models import LabInventory, LabInventoryLog, LabTest
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def moved(item_id, change):
+    """The item after a stock UPDATE, looking as if loaded before it so alerts see the crossing."""
+    item = LabInventory.objects.get(pk=item_id)
+    item._alert_level = (item.qty - change, item.reorder_level)
+    check_levels('LAB_INVENTORY', [item])
+    return item
+
+
+@transaction.atomic
+def stock_in(item_id, qty, cost=0, performed_by=None, notes=''):
+    LabInventory.objects.filter(pk=item_id).update(qty=F('qty') + qty, updated_at=timezone.now())
+    item = moved(item_id, qty)
+    LabInventoryLog.objects.create(
+        item=item, transaction_type='STOCK_IN', qty=qty, cost=cost, performed_by=performed_by, notes=notes
+    )
+    return item
+
+
+@transaction.atomic
+def stock_out(item_id, qty, performed_by=None, notes=''):
+    """Takes `qty` off only if that much is there; raises InsufficientStock otherwise."""
+    updated = LabInventory.objects.filter(pk=item_id, qty__gte=qty).update(
+        qty=F('qty') - qty, updated_at=timezone.now()
+    )
+    if not updated:
+        raise InsufficientStock()
+    item = moved(item_id, -qty)
+    LabInventoryLog.objects.create(
+        item=item, transaction_type='STOCK_OUT', qty=qty, performed_by=performed_by, notes=notes
+    )
+    return item
+
+
+def consume(lines):
+    """
+    Deducts [(item_id, qty, performed_by, notes)] in one go, never below zero (a short
+    reagent must not block a finished test). Rows are locked in primary key order and
+    written back with one bulk_update; the STOCK_OUT logs go in with one bulk_create.
+    Unknown item ids are skipped. Returns the number of log rows written.
+    """
+    lines = [line for line in lines if line[0] and line[1] > 0]
+    if not lines:
+        return 0
+
+    now = timezone.now()
+    items = {
+        item.pk: item
+        for item in LabInventory.objects.select_for_update().filter(pk__in={line[0] for line in lines}).order_by('pk')
+    }
+    logs = []
+    for item_id, qty, performed_by, notes in lines:
+        item = items.get(item_id)
+        if item is None:
+            continue
+        item.qty = max(0, item.qty - qty)
+        item.updated_at = now
+        logs.append(LabInventoryLog(
+            item=item, transaction_type='STOCK_OUT', qty=qty, performed_by=performed_by, notes=notes
+        ))
+    LabInventory.objects.bulk_update(items.values(), ['qty', 'updated_at'])
+    LabInventoryLog.objects.bulk_create(logs)
+    check_levels('LAB_INVENTORY', list(items.values()))
+    return len(logs)
+
+
+def consumption_lines(charges, consumed_items=None):
+    """
+    What completing `charges` uses up. `consumed_items` ([{inventory_item, qty}], as the
+    technician recorded it) applies to a single charge; otherwise each test's default
+    recipe is used, loaded for all charges with two queries.
+    """
+    lines = []
+    if consumed_items and isinstance(consumed_items, list) and len(charges) == 1:
+        charge = charges[0]
+        for item in consumed_items:
+            try:
+                item_id = uuid.UUID(str(item.get('inventory_item')))
+                qty = int(item.get('qty', 0))
+            except (ValueError, TypeError, AttributeError):
+                continue
+            lines.append((
+                item_id, qty,
+                charge.technician_name or 'System (Auto)',
+                f'Test Consumption: {charge.test_name} (Patient: {charge.visit.patient.full_name})',
+            ))
+        return lines
+
+    recipes = {}
+    for test in LabTest.objects.filter(name__in={charge.test_name for charge in charges}).prefetch_related('required_items'):
+        # Same behaviour as .first() on a duplicated name: keep the first one
+        recipes.setdefault(test.name, test.required_items.all())
+    for charge in charges:
+        for requirement in recipes.get(charge.test_name, []):
+            lines.append((
+                requirement.inventory_item_id, requirement.qty_per_test,
+                charge.technician_name or 'System (Auto)',
+                f'Auto-deduction for Test: {charge.test_name} (Patient: {charge.visit.patient.full_name})',
+            ))
+    return lines
+
+
+def bill(charges):
+    """Adds a LAB line per charge to its visit's pending invoice (created if missing)."""
+    from billing.models import Invoice, InvoiceItem
+    from billing.totals import add_items
+
+    by_visit = {}
+    for charge in charges:
+        by_visit.setdefault(charge.visit_id, []).append(charge)
+
+    invoices = {}
+    for invoice in Invoice.objects.filter(visit_id__in=by_visit, payment_status='PENDING').order_by('created_at'):
+        invoices.setdefault(invoice.visit_id, invoice)
+
+    for visit_id, visit_charges in by_visit.items():
+        invoice = invoices.get(visit_id)
+        if invoice is None:
+            patient = visit_charges[0].visit.patient
+            invoice = Invoice.objects.create(
+                visit_id=visit_id,
+                payment_status='PENDING',
+                patient_name=patient.full_name if patient else 'Unknown',
+            )
+        add_items(invoice, [
+            InvoiceItem(
+                dept='LAB',
+                description=charge.test_name,
+                qty=1,
+                unit_price=charge.amount,
+                amount=charge.amount,
+            ) for charge in visit_charges
+        ])
+
+
+@transaction.atomic
+def complete(charges, consumed_items=None):
+    """
+    Inventory and billing side of completing `charges` (already saved as COMPLETED, with
+    visit__patient loaded). Everything rolls back together if any step fails.
+    """
+    if not charges:
+        return
+    consume(consumption_lines(charges, consumed_items))
+    bill(charges)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0012_labtestrequireditem'),
+        ('patients', '0005_patient_patient_created_idx_visit_visit_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='labcharge',
+            index=models.Index(fields=['-created_at'], name='labcharge_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labcharge',
+            index=models.Index(fields=['status', '-created_at'], name='labcharge_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labinventorylog',
+            index=models.Index(fields=['created_at'], name='labinvlog_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labtest',
+            index=models.Index(fields=['name'], name='labtest_name_idx'),
+        ),
+    ]
@@ -34,6 +34,11 @@ class LabInventoryLog(BaseModel):
     performed_by = models.CharField(max_length=255, blank=True, null=True) # Name of user
     notes = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='labinvlog_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.item.item_name} - {self.transaction_type} - {self.qty}"
 
@@ -55,6 +60,13 @@ class LabCharge(BaseModel):
     technician_name = models.CharField(max_length=255, blank=True, null=True)
     specimen = models.CharField(max_length=100, default='BLOOD', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='labcharge_created_idx'),
+            # Lab queue (?status=PENDING) and pending count on the dashboard
+            models.Index(fields=['status', '-created_at'], name='labcharge_status_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.test_name} - {getattr(self.visit, 'id', self.visit.id)}"
 
@@ -78,6 +90,12 @@ class LabTest(BaseModel):
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     normal_range = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Recipe lookup by name when a charge is completed
+            models.Index(fields=['name'], name='labtest_name_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.get_category_display()})"
 
@@ -1,14 +1,20 @@
+from django.db import transaction
 from rest_framework import serializers
+from revive_cms.utils import sync_nested
 from .models import LabInventory, LabCharge, LabInventoryLog, LabTest, LabTestParameter, LabTestRequiredItem
 
 
 class LabTestParameterSerializer(serializers.ModelSerializer):
+    # Writable so edits can match existing rows (see revive_cms.utils.sync_nested)
+    id = serializers.UUIDField(required=False)
+
     class Meta:
         model = LabTestParameter
         fields = ['id', 'name', 'unit', 'normal_range']
 
 
 class LabTestRequiredItemSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(required=False)
     item_name = serializers.CharField(source='inventory_item.item_name', read_only=True)
     
     class Meta:
@@ -25,20 +31,19 @@ class LabTestSerializer(serializers.ModelSerializer):
         model = LabTest
         fields = ['id', 'name', 'category', 'category_display', 'price', 'normal_range', 'parameters', 'required_items']
 
+    @transaction.atomic
     def create(self, validated_data):
         parameters_data = validated_data.pop('parameters', [])
         required_items_data = validated_data.pop('required_items', [])
         
         lab_test = LabTest.objects.create(**validated_data)
         
-        for param_data in parameters_data:
-            LabTestParameter.objects.create(test=lab_test, **param_data)
-            
-        for item_data in required_items_data:
-            LabTestRequiredItem.objects.create(test=lab_test, **item_data)
+        sync_nested(lab_test, 'parameters', parameters_data)
+        sync_nested(lab_test, 'required_items', required_items_data)
             
         return lab_test
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         parameters_data = validated_data.pop('parameters', None)
         required_items_data = validated_data.pop('required_items', None)
@@ -49,15 +54,12 @@ class LabTestSerializer(serializers.ModelSerializer):
         instance.normal_range = validated_data.get('normal_range', instance.normal_range)
         instance.save()
 
+        # Matched by id: only changed rows are updated, new ones inserted, missing ones deleted
         if parameters_data is not None:
-            instance.parameters.all().delete()
-            for param_data in parameters_data:
-                LabTestParameter.objects.create(test=instance, **param_data)
+            sync_nested(instance, 'parameters', parameters_data)
                 
         if required_items_data is not None:
-            instance.required_items.all().delete()
-            for item_data in required_items_data:
-                LabTestRequiredItem.objects.create(test=instance, **item_data)
+            sync_nested(instance, 'required_items', required_items_data)
         
         return instance
 
@@ -97,19 +99,31 @@ class LabChargeSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['lc_id', 'created_at', 'updated_at']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # The patient fields above read visit.patient for every row
+        return queryset.select_related('visit__patient')
+
     def update(self, instance, validated_data):
         instance = super().update(instance, validated_data)
         
         if instance.status == 'COMPLETED':
-             try:
-                from asgiref.sync import async_to_sync
-                from revive_cms.sio import sio
-                
-                async_to_sync(sio.emit)('lab_update', {
-                    'lc_id': str(instance.id),
-                    'visit_id': str(instance.visit.id),
-                    'status': 'COMPLETED'
-                })
-             except Exception as e:
-                print(f"Socket emit error: {e}")
+            publish_completed(instance)
         return instance
+
+
+def publish_completed(instance):
+    from core.realtime import publish
+    from revive_cms.sio import role_room, user_room, visit_room
+
+    # Results matter to the lab desk and the doctor who ordered them
+    doctor_id = instance.visit.doctor_id
+    publish('lab_update', 'lab_charge', instance.id, LabChargeSerializer(instance).data, [
+        role_room('LAB'),
+        user_room(doctor_id) if doctor_id else None,
+        visit_room(instance.visit_id),
+    ], legacy={
+        'lc_id': str(instance.id),
+        'visit_id': str(instance.visit_id),
+        'status': 'COMPLETED'
+    })
@@ -1,27 +1,41 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
-from .models import LabInventory
-from core.models import Notification
-from django.contrib.auth import get_user_model
+from .models import LabInventory, LabTest, LabTestParameter, LabTestRequiredItem
+from . import catalog
+from core.alerts import check_levels, remember_level
+
+
+@receiver(post_init, sender=LabInventory)
+def remember_lab_level(sender, instance, **kwargs):
+    remember_level('LAB_INVENTORY', instance)
+    if 'item_name' not in instance.get_deferred_fields():
+        instance._loaded_name = instance.item_name
+
+
+@receiver(post_save, sender=LabInventory)
+def check_lab_low_stock(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    check_levels('LAB_INVENTORY', [instance], created=created)
+
+
+@receiver(post_save, sender=LabTest)
+@receiver(post_save, sender=LabTestParameter)
+@receiver(post_save, sender=LabTestRequiredItem)
+@receiver(post_delete, sender=LabTest)
+@receiver(post_delete, sender=LabTestParameter)
+@receiver(post_delete, sender=LabTestRequiredItem)
+def invalidate_test_catalog(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    catalog.invalidate()
 
-User = get_user_model()
 
 @receiver(post_save, sender=LabInventory)
-def check_lab_low_stock(sender, instance, **kwargs):
-    if instance.qty < instance.reorder_level:
-        # Check active notification
-        pass_check = Notification.objects.filter(
-            message__contains=f"Lab Low Stock: {instance.item_name}",
-            is_read=False
-        ).exists()
-
-        if not pass_check:
-            recipients = User.objects.filter(role__in=['LAB', 'ADMIN'], is_active=True)
-            notifications = [
-                Notification(
-                    recipient=u,
-                    message=f"Lab Low Stock: {instance.item_name} has only {instance.qty} units left.",
-                    type='WARNING'
-                ) for u in recipients
-            ]
-            Notification.objects.bulk_create(notifications)
+def invalidate_catalog_item_name(sender, instance, created, raw=False, **kwargs):
+    # Required items show the inventory item's name
+    if raw or created:
+        return
+    if getattr(instance, '_loaded_name', instance.item_name) != instance.item_name:
+        catalog.invalidate()
+    instance._loaded_name = instance.item_name
@@ -1,3 +1,165 @@
-from django.test import TestCase
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from billing.models import InvoiceItem
+from patients.models import Patient, Visit
+from users.models import User
+from .models import LabCharge, LabInventory, LabInventoryLog, LabTest, LabTestParameter, LabTestRequiredItem
+from .serializers import LabChargeSerializer
+from .views import LabChargeViewSet
+
+
+class LabCompletionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('lab', password='x', role='LAB')
+        patient = Patient.objects.create(full_name='Meena', age=34, gender='F', phone='9600000001', address='-')
+        cls.visit = Visit.objects.create(patient=patient, assigned_role='LAB')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_test(self, name, reagents):
+        test = LabTest.objects.create(name=name, category='BIOCHEMISTRY', price=300)
+        items = LabInventory.objects.bulk_create([
+            LabInventory(item_name=f'{name} reagent {n}', category='REAGENT', qty=100, reorder_level=5)
+            for n in range(reagents)
+        ])
+        LabTestRequiredItem.objects.bulk_create([
+            LabTestRequiredItem(test=test, inventory_item=item, qty_per_test=2) for item in items
+        ])
+        return LabCharge.objects.create(visit=self.visit, test_name=name, amount=300)
+
+    def complete(self, charge):
+        return self.client.patch(f'/api/lab/charges/{charge.pk}/', {
+            'status': 'COMPLETED', 'results': {'Value': '5.1'}, 'technician_name': 'Tech',
+        }, format='json')
+
+    def test_completion_consumes_and_bills_once(self):
+        charge = self.make_test('Lipid profile', reagents=3)
+        stale = LabCharge.objects.get(pk=charge.pk)
+        self.assertEqual(self.complete(charge).status_code, 200)
+
+        # A concurrent PATCH that loaded the charge while it was still pending
+        serializer = LabChargeSerializer(stale, data={'status': 'COMPLETED'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        view = LabChargeViewSet(request=SimpleNamespace(data={}))
+        view.perform_update(serializer)
+
+        self.assertEqual(LabInventoryLog.objects.filter(transaction_type='STOCK_OUT').count(), 3)
+        self.assertEqual(set(LabInventory.objects.values_list('qty', flat=True)), {98})
+        self.assertEqual(InvoiceItem.objects.filter(dept='LAB', description='Lipid profile').count(), 1)
+
+    def test_completion_query_count_does_not_grow_with_recipe(self):
+        counts = []
+        for reagents in (1, 5, 20):
+            charge = self.make_test(f'Panel {reagents}', reagents)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.complete(charge).status_code, 200)
+            counts.append(len(queries))
+            self.assertEqual(LabInventoryLog.objects.filter(item__item_name__startswith=f'Panel {reagents} ').count(), reagents)
+        self.assertEqual(len(set(counts)), 1, counts)
+
+
+    def test_complete_many(self):
+        charges = [self.make_test('Lipid profile', reagents=2), self.make_test('HbA1c', reagents=1)]
+        response = self.client.post('/api/lab/charges/complete/', {
+            'visit': str(self.visit.pk), 'technician_name': 'Tech',
+            'charges': [{'lc_id': str(charge.pk), 'results': {'Value': '1'}} for charge in charges],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(set(LabCharge.objects.values_list('status', flat=True)), {'COMPLETED'})
+        self.assertEqual(LabInventoryLog.objects.filter(transaction_type='STOCK_OUT').count(), 3)
+
+    def test_complete_many_rejects_a_malformed_visit(self):
+        charge = self.make_test('Lipid profile', reagents=1)
+        response = self.client.post('/api/lab/charges/complete/', {
+            'visit': 'not-a-uuid', 'charges': [{'lc_id': str(charge.pk)}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        charge.refresh_from_db()
+        self.assertEqual(charge.status, 'PENDING')
+
+
+class LabChargeListTests(TestCase):
+    def test_status_queue_runs_fixed_queries(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('lab', password='x', role='LAB'))
+        for n in range(12):
+            patient = Patient.objects.create(full_name=f'Patient {n}', age=30, gender='F', phone=f'96100{n:05d}', address='-')
+            LabCharge.objects.create(visit=Visit.objects.create(patient=patient), test_name='CBC', amount=200)
+
+        # The count, then one page with the patients joined in
+        with self.assertNumQueries(2):
+            response = client.get('/api/lab/charges/', {'status': 'PENDING'})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(response.data['results'][0]['patient_name'][:8], 'Patient ')
+
+
+class LabCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('lab', password='x', role='LAB')
+        LabTest.objects.create(name='CBC', category='HAEMATOLOGY', price=250)
+
+    def setUp(self):
+        from revive_cms import versions
+
+        # Remembered tokens outlive the per-test rollback of the cache table
+        versions.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_version_lives_in_the_shared_cache(self):
+        from django.conf import settings
+        self.assertNotIn('LocMemCache', settings.CACHES['default']['BACKEND'])
+
+    def test_revalidation_runs_no_query(self):
+        etag = self.client.get('/api/lab/tests/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/lab/tests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_edit_in_this_process_changes_the_etag_at_once(self):
+        etag = self.client.get('/api/lab/tests/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            LabTest.objects.filter(name='CBC').get().save()
+        self.assertEqual(self.client.get('/api/lab/tests/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def edit_one_parameter_queries(self, count):
+        response = self.client.post('/api/lab/tests/', {
+            'name': f'Panel {count}', 'category': 'BIOCHEMISTRY', 'price': 500,
+            'parameters': [{'name': f'Analyte {n}', 'unit': 'mg/dL'} for n in range(count)],
+        }, format='json')
+        parameters = response.data['parameters']
+        parameters[0]['normal_range'] = '70-110'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f"/api/lab/tests/{response.data['id']}/", {'parameters': parameters}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(LabTestParameter.objects.filter(test__name=f'Panel {count}', normal_range='70-110').count(), 1)
+        return len(queries)
+
+    def test_edit_queries_do_not_grow_with_parameters(self):
+        self.assertEqual(self.edit_one_parameter_queries(3), self.edit_one_parameter_queries(30))
+
+    @override_settings(VERSION_CHECK_TTL=0)
+    def test_edit_in_another_process_changes_the_etag(self):
+        from django.core.cache import caches
+        from revive_cms.versions import new_version
+        from . import catalog
+
+        etag = self.client.get('/api/lab/tests/')['ETag']
+        self.assertEqual(self.client.get('/api/lab/tests/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Another worker edits a test and stores a new token through its own cache connection
+        LabTest.objects.filter(name='CBC').update(price=300)
+        caches.create_connection('default').set(catalog.VERSION_KEY, new_version(), None)
+        response = self.client.get('/api/lab/tests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data[0]['price'], '300.00')
@@ -2,11 +2,14 @@ from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.http import parse_etags
+import uuid
 
-from billing.models import Invoice, InvoiceItem
 from .models import LabInventory, LabCharge, LabInventoryLog, LabTest
-from .serializers import LabInventorySerializer, LabChargeSerializer, LabInventoryLogSerializer, LabTestSerializer
+from .serializers import LabInventorySerializer, LabChargeSerializer, LabInventoryLogSerializer, LabTestSerializer, publish_completed
+from .consumption import stock_in, stock_out, complete, InsufficientStock
 
 
 
@@ -19,7 +22,8 @@ class IsLabOrAdmin(permissions.BasePermission):
 
 
 class LabTestViewSet(viewsets.ModelViewSet):
-    queryset = LabTest.objects.all().order_by('category', 'name')
+    # Nested parameters and required items (with their inventory names) in three extra queries in total
+    queryset = LabTest.objects.prefetch_related('parameters', 'required_items__inventory_item').order_by('category', 'name')
     serializer_class = LabTestSerializer
     permission_classes = [IsLabOrAdmin]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
@@ -27,6 +31,27 @@ class LabTestViewSet(viewsets.ModelViewSet):
     ordering_fields = ['category', 'name', 'price']
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        """
+        Whole catalog from cache (see lab.catalog), with ETag / If-None-Match so
+        unchanged catalogs are answered with 304 and no body.
+        """
+        from .catalog import get_version, etag_for, get_catalog
+        version = get_version()
+        query = request.query_params.urlencode()
+        etag = etag_for(version, query)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if query:
+            # Searches and custom orderings are cheap with prefetching; only the full list is cached
+            data = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+        else:
+            data = get_catalog(version, lambda: list(self.get_serializer(self.get_queryset(), many=True).data))
+        return Response(data, headers=headers)
+
 
 
 class LabInventoryViewSet(viewsets.ModelViewSet):
@@ -52,19 +77,8 @@ class LabInventoryViewSet(viewsets.ModelViewSet):
         if qty <= 0:
             return Response({'error': 'Quantity must be positive'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update Stock
-        item.qty += qty
-        item.save()
-
-        # Log
-        LabInventoryLog.objects.create(
-            item=item,
-            transaction_type='STOCK_IN',
-            qty=qty,
-            cost=cost,
-            performed_by=user,
-            notes=request.data.get('notes', '')
-        )
+        # Atomic increment, logged in the same transaction
+        item = stock_in(item.pk, qty, cost=cost, performed_by=user, notes=request.data.get('notes', ''))
 
         return Response(self.get_serializer(item).data)
 
@@ -77,22 +91,12 @@ class LabInventoryViewSet(viewsets.ModelViewSet):
         if qty <= 0:
             return Response({'error': 'Quantity must be positive'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if item.qty < qty:
+        # Conditional decrement: fails instead of overselling when two counters race
+        try:
+            item = stock_out(item.pk, qty, performed_by=user, notes=request.data.get('notes', ''))
+        except InsufficientStock:
             return Response({'error': 'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update Stock
-        item.qty -= qty
-        item.save()
-
-        # Log
-        LabInventoryLog.objects.create(
-            item=item,
-            transaction_type='STOCK_OUT',
-            qty=qty,
-            performed_by=user,
-            notes=request.data.get('notes', '')
-        )
-
         return Response(self.get_serializer(item).data)
 
 
@@ -104,81 +108,69 @@ class LabChargeViewSet(viewsets.ModelViewSet):
     search_fields = ['test_name', 'visit__patient__full_name', 'visit__patient__phone']
     filterset_fields = ['visit', 'status']
 
+    def get_queryset(self):
+        return LabChargeSerializer.setup_eager_loading(super().get_queryset())
+
     def perform_update(self, serializer):
-        instance = serializer.save()
-        
-        # Trigger Billing & Inventory if status matches COMPLETED
-        if instance.status == 'COMPLETED':
-            # --- INVENTORY DEDUCTION LOGIC ---
-            try:
-                # Check if specific consumption data was sent (Wastage Handling)
-                consumed_items = self.request.data.get('consumed_items')
-                
-                if consumed_items and isinstance(consumed_items, list):
-                    # Manual/Actual Consumption Provided
-                    for item in consumed_items:
-                        inv_id = item.get('inventory_item')
-                        qty_used = int(item.get('qty', 0))
-                        
-                        if inv_id and qty_used > 0:
-                            inv_item = LabInventory.objects.get(id=inv_id)
-                            inv_item.qty = max(0, inv_item.qty - qty_used)
-                            inv_item.save()
-                            
-                            LabInventoryLog.objects.create(
-                                item=inv_item,
-                                transaction_type='STOCK_OUT',
-                                qty=qty_used,
-                                performed_by=instance.technician_name or 'System (Auto)',
-                                notes=f'Test Consumption: {instance.test_name} (Patient: {instance.visit.patient.full_name})'
-                            )
-                else:
-                    # Fallback to Default Recipe
-                    lab_test = LabTest.objects.filter(name=instance.test_name).first()
-                    if lab_test:
-                        for requirement in lab_test.required_items.all():
-                            inventory_item = requirement.inventory_item
-                            qty_needed = requirement.qty_per_test
-                            
-                            # Deduct Stock
-                            inventory_item.qty = max(0, inventory_item.qty - qty_needed)
-                            inventory_item.save()
-                            
-                            # Log Transaction
-                            LabInventoryLog.objects.create(
-                                item=inventory_item,
-                                transaction_type='STOCK_OUT',
-                                qty=qty_needed,
-                                performed_by=instance.technician_name or 'System (Auto)',
-                                notes=f'Auto-deduction for Test: {instance.test_name} (Patient: {instance.visit.patient.full_name})'
-                            )
-            except Exception as e:
-                print(f"Inventory Auto-Stockout Error: {e}")
-
-            # --- BILLING LOGIC ---
-            # 1. Get/Create Invoice for this Visit
-            # We look for a pending invoice for this visit, or create one.
-            invoice, created = Invoice.objects.get_or_create(
-                visit=instance.visit,
-                payment_status='PENDING',
-                defaults={
-                    'patient_name': instance.visit.patient.full_name if instance.visit.patient else 'Unknown',
-                    'total_amount': 0
-                }
+        with transaction.atomic():
+            # Consume reagents and bill only when the charge becomes COMPLETED, not on later edits.
+            # The transition is claimed with a conditional UPDATE, so of two concurrent PATCHes
+            # only the one that actually flipped the row completes it.
+            completed = False
+            if serializer.validated_data.get('status') == 'COMPLETED':
+                completed = LabCharge.objects.filter(pk=serializer.instance.pk).exclude(status='COMPLETED').update(
+                    status='COMPLETED', updated_at=timezone.now()
+                ) == 1
+            instance = serializer.save()
+
+            if completed:
+                complete([instance], consumed_items=self.request.data.get('consumed_items'))
+
+    @action(detail=False, methods=['post'], url_path='complete')
+    def complete_many(self, request):
+        """
+        Completes several charges of one visit in one call:
+        Input: { "visit": id, "charges": [ { "lc_id": id, "results": {...}, "specimen": "BLOOD" }, ... ],
+                 "technician_name": "..." }
+        Reagents use each test's default recipe. Charges already completed are skipped.
+        """
+        visit_id = request.data.get('visit')
+        entries = request.data.get('charges')
+        if not visit_id or not isinstance(entries, list) or not entries:
+            return Response({'error': 'visit and a non-empty charges list are required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            visit_id = uuid.UUID(str(visit_id))
+        except ValueError:
+            return Response({'error': 'visit must be a valid id'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            entries = {uuid.UUID(str(entry.get('lc_id') or entry.get('id'))): entry for entry in entries}
+        except (ValueError, TypeError, AttributeError):
+            return Response({'error': 'Each charge needs a valid lc_id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        technician = request.data.get('technician_name')
+        now = timezone.now()
+        with transaction.atomic():
+            charges = list(
+                LabCharge.objects.select_for_update(of=('self',))
+                .select_related('visit__patient')
+                .filter(visit_id=visit_id, pk__in=entries)
+                .exclude(status='COMPLETED')
+                .order_by('pk')
             )
-
-            # 2. Add Invoice Item
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                dept='LAB',
-                description=instance.test_name,
-                qty=1,
-                unit_price=instance.amount,
-                amount=instance.amount
+            for charge in charges:
+                entry = entries[charge.pk]
+                charge.status = 'COMPLETED'
+                charge.results = entry.get('results', charge.results)
+                charge.specimen = entry.get('specimen', charge.specimen)
+                charge.technician_name = entry.get('technician_name') or technician or charge.technician_name
+                charge.report_date = charge.report_date or now
+                charge.updated_at = now
+            # Status/results only, so the revenue rollup (keyed on amount) needs no signal
+            LabCharge.objects.bulk_update(
+                charges, ['status', 'results', 'specimen', 'technician_name', 'report_date', 'updated_at']
             )
+            complete(charges)
+            for charge in charges:
+                publish_completed(charge)
 
-            # 3. Update Invoice Total
-            # Recalculate total to be safe
-            total = sum(item.amount for item in invoice.items.all())
-            invoice.total_amount = total
-            invoice.save()
+        return Response(self.get_serializer(charges, many=True).data)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0005_delete_casualtylog'),
+        ('patients', '0005_patient_patient_created_idx_visit_visit_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctornote',
+            index=models.Index(fields=['-created_at'], name='doctornote_created_idx'),
+        ),
+    ]
@@ -25,18 +25,21 @@ class DoctorNoteSerializer(serializers.ModelSerializer):
         return note
 
     def emit_socket_update(self, note):
-        try:
-            from asgiref.sync import async_to_sync
-            from revive_cms.sio import sio
-            
-            data = {
-                'visit_id': str(note.visit.id),
-                'note_id': str(note.id),
-                'has_prescription': bool(note.prescription),
-                'has_lab': bool(note.lab_referral_details)
-            }
-            async_to_sync(sio.emit)('doctor_notes_update', data)
-        except Exception as e:
-            print(f"Socket emit error: {e}")
+        from core.realtime import publish
+        from revive_cms.sio import role_room, user_room, visit_room
+
+        legacy = {
+            'visit_id': str(note.visit_id),
+            'note_id': str(note.id),
+            'has_prescription': bool(note.prescription),
+            'has_lab': bool(note.lab_referral_details)
+        }
+        # Prescriptions go to pharmacy, lab referrals to lab
+        publish('doctor_notes_update', 'doctor_note', note.id, DoctorNoteSerializer(note).data, [
+            role_room('PHARMACY'),
+            role_room('LAB'),
+            user_room(note.visit.doctor_id) if note.visit.doctor_id else None,
+            visit_room(note.visit_id),
+        ], legacy=legacy)
 
 
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from patients.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the patient name token index used by the typeahead endpoint.'
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} patients."))
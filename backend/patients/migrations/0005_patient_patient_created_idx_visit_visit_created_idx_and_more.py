@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_visit_assigned_role'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['-created_at'], name='patient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['-created_at'], name='visit_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['assigned_role', 'status', 'updated_at'], name='visit_role_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['status', '-updated_at'], name='visit_status_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:36
+
+import django.db.models.deletion
+import re
+import uuid
+from django.db import migrations, models
+
+
+def index_existing_patients(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientNameToken = apps.get_model('patients', 'PatientNameToken')
+    batch = []
+    for patient_id, full_name in Patient.objects.values_list('id', 'full_name').iterator(chunk_size=2000):
+        for position, token in enumerate(re.findall(r'\w+', (full_name or '').lower())):
+            batch.append(PatientNameToken(patient_id=patient_id, token=token[:64], position=position))
+        if len(batch) >= 2000:
+            PatientNameToken.objects.bulk_create(batch)
+            batch = []
+    PatientNameToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_patient_patient_created_idx_visit_visit_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientNameToken',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('token', models.CharField(max_length=64)),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_tokens', to='patients.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'patient'], name='patient_token_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_patients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_patientnametoken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['patient', 'status'], name='visit_patient_status_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_visit_visit_patient_status_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patientnametoken',
+            name='patient_token_idx',
+        ),
+        migrations.AddIndex(
+            model_name='patientnametoken',
+            index=models.Index(fields=['token', 'patient'], name='patient_token_idx', opclasses=['varchar_pattern_ops', 'uuid_ops']),
+        ),
+    ]
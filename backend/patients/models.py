@@ -19,16 +19,44 @@ class Patient(BaseModel):
     address = models.TextField()
     id_proof = models.CharField(max_length=50, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # PatientViewSet default ordering
+            models.Index(fields=['-created_at'], name='patient_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.full_name} ({self.phone})"
 
 
+class PatientNameToken(BaseModel):
+    """
+    One lowercased word of a patient's name. Typeahead matches query words by indexed
+    prefix (token LIKE 'x%') instead of LIKE '%x%' over full_name.
+    Maintained by patients.signals; rebuild with `manage.py rebuild_patient_search`.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='name_tokens')
+    token = models.CharField(max_length=64)
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Pattern opclass so PostgreSQL can serve startswith from it under any collation
+            models.Index(fields=['token', 'patient'], name='patient_token_idx', opclasses=['varchar_pattern_ops', 'uuid_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.patient_id}"
+
+
 class Visit(BaseModel):
     STATUS_CHOICES = (
         ('OPEN', 'Open'),
         ('IN_PROGRESS', 'In Progress'),
         ('CLOSED', 'Closed'),
     )
+    # Statuses that block opening a new visit for the same patient
+    ACTIVE_STATUSES = ['OPEN', 'IN_PROGRESS']
 
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='visits')
     doctor = models.ForeignKey(
@@ -53,5 +81,16 @@ class Visit(BaseModel):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='OPEN')
     vitals = models.JSONField(default=dict, blank=True)
 
+    class Meta:
+        indexes = [
+            # Visit list ordering and dashboard/report date windows
+            models.Index(fields=['-created_at'], name='visit_created_idx'),
+            # Queue screens: ?status__in=...&assigned_role=...
+            models.Index(fields=['assigned_role', 'status', 'updated_at'], name='visit_role_status_idx'),
+            models.Index(fields=['status', '-updated_at'], name='visit_status_updated_idx'),
+            # Per-patient active visit check (exclude_active / has_active_visit)
+            models.Index(fields=['patient', 'status'], name='visit_patient_status_idx'),
+        ]
+
     def __str__(self):
         return f"Visit {self.id} - {self.patient.full_name}"
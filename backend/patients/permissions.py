@@ -7,3 +7,38 @@ class IsReceptionistOrAdmin(permissions.BasePermission):
         # Staff (needs to see patients/visits) OR Admin
         allowed_roles = ['RECEPTION', 'DOCTOR', 'LAB', 'PHARMACY', 'ADMIN']
         return request.user.role in allowed_roles or request.user.is_superuser
+
+
+# Roles that work the whole visit board (registration, billing) rather than a queue
+ALL_VISIT_ROLES = ['ADMIN', 'RECEPTION']
+
+
+def followable_visits(user):
+    """
+    Visits whose live updates `user` may follow: their own patients for doctors, visits
+    assigned to their department, and visits their department has work on.
+    """
+    from django.db.models import Q
+    from .models import Visit
+
+    role = 'ADMIN' if user.is_superuser else user.role
+    if role in ALL_VISIT_ROLES:
+        return Visit.objects.all()
+    allowed = Q(doctor=user) | Q(assigned_role=role)
+    if role == 'DOCTOR':
+        # Visits default to the DOCTOR role; once a doctor is set, only they follow it
+        allowed = Q(doctor=user) | Q(assigned_role=role, doctor__isnull=True)
+    elif role == 'LAB':
+        allowed |= Q(lab_charges__isnull=False)
+    elif role == 'PHARMACY':
+        allowed |= Q(pharmacy_sales__isnull=False) | Q(doctor_note__isnull=False)
+    return Visit.objects.filter(allowed).distinct()
+
+
+def can_follow_visit(user, visit_id):
+    import uuid
+    try:
+        visit_id = uuid.UUID(str(visit_id))
+    except ValueError:
+        return False
+    return followable_visits(user).filter(pk=visit_id).exists()
@@ -0,0 +1,97 @@
+import re
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from revive_cms.utils import name_tokens, prefix_match
+from .models import Patient, PatientNameToken
+
+# Rows returned by the typeahead endpoint
+TYPEAHEAD_LIMIT = 10
+# Patients pulled through the token index before ranking
+CANDIDATE_LIMIT = 200
+# Columns needed to rank and serialize a result
+RESULT_FIELDS = ('id', 'full_name', 'age', 'gender', 'phone', 'created_at')
+
+
+def index_patient(patient):
+    """
+    Replaces the name tokens of one patient.
+    """
+    with transaction.atomic():
+        PatientNameToken.objects.filter(patient=patient).delete()
+        PatientNameToken.objects.bulk_create([
+            PatientNameToken(patient=patient, token=token, position=position)
+            for position, token in enumerate(name_tokens(patient.full_name))
+        ])
+
+
+def rebuild_index(batch_size=2000):
+    """
+    Regenerates the token table for every patient. Returns the number of patients indexed.
+    """
+    count = 0
+    with transaction.atomic():
+        PatientNameToken.objects.all().delete()
+        batch = []
+        for patient_id, full_name in Patient.objects.values_list('id', 'full_name').iterator(chunk_size=batch_size):
+            for position, token in enumerate(name_tokens(full_name)):
+                batch.append(PatientNameToken(patient_id=patient_id, token=token, position=position))
+            count += 1
+            if len(batch) >= batch_size:
+                PatientNameToken.objects.bulk_create(batch)
+                batch = []
+        PatientNameToken.objects.bulk_create(batch)
+    return count
+
+
+def rank(patient, query, tokens):
+    """
+    Sort key for name matches, best first: name starts with the query, every query word
+    is a whole name word, then shorter and newer names.
+    """
+    name = patient.full_name.lower()
+    words = name_tokens(patient.full_name)
+    return (
+        not name.startswith(query.lower()),
+        not all(token in words for token in tokens),
+        len(name),
+        -patient.created_at.timestamp(),
+    )
+
+
+def typeahead(query, limit=TYPEAHEAD_LIMIT):
+    """
+    Ranked patients for a reception search box: digits match a phone prefix, anything else
+    matches name words by prefix (all words must match, in any order).
+    """
+    query = (query or '').strip()
+    if not query:
+        return []
+
+    digits = re.sub(r'\D', '', query)
+    if digits and digits == query.replace(' ', '').lstrip('+'):
+        # Phone order already ranks an exact match first, then the closest numbers
+        return list(
+            Patient.objects.filter(prefix_match('phone', digits))
+            .only(*RESULT_FIELDS)
+            .order_by('phone')[:limit]
+        )
+
+    tokens = name_tokens(query)
+    if not tokens:
+        return []
+
+    # Walk the longest (most selective) word's prefix and probe the other words per patient,
+    # so the scan can stop as soon as CANDIDATE_LIMIT patients are found
+    tokens.sort(key=len, reverse=True)
+    matches = PatientNameToken.objects.filter(prefix_match('token', tokens[0]))
+    for token in tokens[1:]:
+        matches = matches.filter(Exists(PatientNameToken.objects.filter(
+            prefix_match('token', token),
+            patient_id=OuterRef('patient_id'),
+        )))
+    patient_ids = list(matches.values_list('patient_id', flat=True).distinct()[:CANDIDATE_LIMIT])
+
+    candidates = Patient.objects.filter(id__in=patient_ids).only(*RESULT_FIELDS)
+    return sorted(candidates, key=lambda p: rank(p, query, tokens))[:limit]
@@ -1,3 +1,5 @@
+from django.db.models import Prefetch, OuterRef, Subquery, Exists, Count, IntegerField, UUIDField, Value
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 from .models import Patient, Visit
 
@@ -6,15 +8,43 @@ class PatientSerializer(serializers.ModelSerializer):
     p_id = serializers.UUIDField(source='id', read_only=True)
 
     total_visits = serializers.SerializerMethodField()
+    has_active_visit = serializers.SerializerMethodField()
 
     class Meta:
         model = Patient
-        fields = ['id', 'p_id', 'full_name', 'age', 'gender', 'phone', 'address', 'id_proof', 'total_visits', 'last_consulted_doctor', 'created_at', 'updated_at']
+        fields = ['id', 'p_id', 'full_name', 'age', 'gender', 'phone', 'address', 'id_proof', 'total_visits', 'last_consulted_doctor', 'has_active_visit', 'created_at', 'updated_at']
         read_only_fields = ['id', 'p_id', 'created_at', 'updated_at']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Annotates the visit count, the last consulting doctor and whether an active visit exists
+        as correlated subqueries, so a page of patients costs one query instead of several per row.
+        """
+        visits = Visit.objects.filter(patient=OuterRef('pk')).order_by()
+        last_doctor_visit = visits.filter(doctor__isnull=False).order_by('-created_at')
+        return queryset.annotate(
+            visit_count=Coalesce(
+                Subquery(visits.values('patient').annotate(c=Count('id')).values('c'), output_field=IntegerField()),
+                Value(0)
+            ),
+            last_doctor_id=Subquery(last_doctor_visit.values('doctor_id')[:1], output_field=UUIDField()),
+            last_doctor_first_name=Subquery(last_doctor_visit.values('doctor__first_name')[:1]),
+            last_doctor_last_name=Subquery(last_doctor_visit.values('doctor__last_name')[:1]),
+            has_active_visit=Exists(visits.filter(status__in=Visit.ACTIVE_STATUSES)),
+        )
+
     def get_total_visits(self, obj):
+        # Annotated by setup_eager_loading; single-object responses fall back to a query
+        if hasattr(obj, 'visit_count'):
+            return obj.visit_count
         return obj.visits.count()
 
+    def get_has_active_visit(self, obj):
+        if hasattr(obj, 'has_active_visit'):
+            return obj.has_active_visit
+        return obj.visits.filter(status__in=Visit.ACTIVE_STATUSES).exists()
+
     def validate_phone(self, value):
         cleaned = value.strip()
         # simple validation; adjust for your country format if needed
@@ -27,6 +57,14 @@ class PatientSerializer(serializers.ModelSerializer):
     last_consulted_doctor = serializers.SerializerMethodField()
 
     def get_last_consulted_doctor(self, obj):
+        if hasattr(obj, 'last_doctor_id'):
+            if obj.last_doctor_id is None:
+                return None
+            return {
+                "id": obj.last_doctor_id,
+                "name": f"Dr. {obj.last_doctor_first_name} {obj.last_doctor_last_name}"
+            }
+
         # Find the last visit that actually had a doctor assigned
         last_visit = obj.visits.filter(doctor__isnull=False).order_by('-created_at').first()
         if last_visit:
@@ -37,6 +75,15 @@ class PatientSerializer(serializers.ModelSerializer):
         return None
 
 
+class PatientTypeaheadSerializer(serializers.ModelSerializer):
+    """Lightweight row for typeahead results (no per-patient visit queries)."""
+    p_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = Patient
+        fields = ['id', 'p_id', 'full_name', 'age', 'gender', 'phone']
+
+
 class VisitSerializer(serializers.ModelSerializer):
     v_id = serializers.UUIDField(source='id', read_only=True)
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
@@ -75,10 +122,25 @@ class VisitSerializer(serializers.ModelSerializer):
             return float(obj.doctor.consultation_fee)
         return 500.00  # Default fee
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Loads everything the method fields below touch in a fixed number of queries:
+        patient/doctor/doctor_note via JOIN, pharmacy sales -> items -> med_stock and
+        completed lab charges via prefetch. List views should always go through this.
+        """
+        from lab.models import LabCharge
+        from pharmacy.models import PharmacySaleItem
+        return queryset.select_related('patient', 'doctor', 'doctor_note').prefetch_related(
+            Prefetch('pharmacy_sales__items', queryset=PharmacySaleItem.objects.select_related('med_stock')),
+            Prefetch('lab_charges', queryset=LabCharge.objects.filter(status='COMPLETED'), to_attr='completed_lab_charges'),
+        )
+
     def get_pharmacy_items(self, obj):
         # Return list of items from all PENDING pharmacy sales
         try:
             # Fetch ALL pharmacy sales for this visit to be safe (billing can filter if needed)
+            # .all() reads from the prefetch cache when loaded via setup_eager_loading
             sales = obj.pharmacy_sales.all()
         except Exception:
             return []
@@ -166,7 +228,10 @@ class VisitSerializer(serializers.ModelSerializer):
     def get_lab_results(self, obj):
         # Return completed lab results for this visit
         try:
-            charges = obj.lab_charges.filter(status='COMPLETED')
+            # Prefer the prefetched list from setup_eager_loading, fall back to a query for single objects
+            charges = getattr(obj, 'completed_lab_charges', None)
+            if charges is None:
+                charges = obj.lab_charges.filter(status='COMPLETED')
             results = []
             for c in charges:
                 results.append({
@@ -195,18 +260,23 @@ class VisitSerializer(serializers.ModelSerializer):
         return visit
 
     def emit_socket_update(self, visit):
-        try:
-            from asgiref.sync import async_to_sync
-            from revive_cms.sio import sio
-            
-            data = {
-                'visit_id': str(visit.id),
-                'doctor_id': str(visit.doctor.id) if visit.doctor else None,
-                'status': visit.status
-            }
-            print(f"--- ATTEMPTING SOCKET EMIT: visit_update --- Data: {data}")
-            # Emit to all clients (broadcast)
-            async_to_sync(sio.emit)('visit_update', data)
-        except Exception as e:
-            # Non-blocking error logging
-            print(f"Socket emit error: {e}")
+        from core.realtime import publish
+        from revive_cms.sio import role_room, user_room, visit_room
+
+        legacy = {
+            'visit_id': str(visit.id),
+            'doctor_id': str(visit.doctor_id) if visit.doctor_id else None,
+            'status': visit.status
+        }
+        # Reception and casualty boards show every visit; the assigned department
+        # only needs visits routed to it, and a specific doctor only their own
+        department = visit.assigned_role
+        if department == 'DOCTOR' and visit.doctor_id:
+            department = None
+        publish('visit_update', 'visit', visit.id, VisitSerializer(visit).data, [
+            role_room('RECEPTION'),
+            role_room('CASUALTY'),
+            role_room(department) if department else None,
+            user_room(visit.doctor_id) if visit.doctor_id else None,
+            visit_room(visit.id),
+        ], legacy=legacy)
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Patient
+from .search import index_patient
+
+
+@receiver(post_save, sender=Patient)
+def update_name_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # Only re-tokenize when the name can have changed
+    if update_fields is not None and 'full_name' not in update_fields:
+        return
+    index_patient(instance)
@@ -1,3 +1,272 @@
+import uuid
+from datetime import date, timedelta
+
+from unittest import skipUnless
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from lab.models import LabCharge
+from medical.models import DoctorNote
+from pharmacy.models import PharmacySale, PharmacySaleItem, PharmacyStock
+from users.models import User
+from .models import Patient, Visit
+
+
+class VisitListQueryTests(TestCase):
+    """The visit lists load nested data with a fixed number of queries per page."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reception', password='x', role='RECEPTION')
+        cls.doctor = User.objects.create_user('doctor', password='x', role='DOCTOR')
+        cls.stock = PharmacyStock.objects.create(
+            name='Amoxicillin 250mg', batch_no='A1', expiry_date=date.today() + timedelta(days=365),
+            mrp=5, selling_price=5, qty_available=1000,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_visits(self, count):
+        start = Patient.objects.count()
+        for n in range(start, start + count):
+            patient = Patient.objects.create(full_name=f'Patient {n}', age=30, gender='F', phone=f'90000{n:05d}', address='-')
+            visit = Visit.objects.create(patient=patient, doctor=self.doctor, assigned_role='PHARMACY')
+            DoctorNote.objects.create(visit=visit, diagnosis='Fever', prescription={'Amoxicillin 250mg': '1-0-1'})
+            LabCharge.objects.create(visit=visit, test_name='CBC', amount=200, status='COMPLETED', results={'Hb': '13'})
+            sale = PharmacySale.objects.create(patient=patient, visit=visit, total_amount=10)
+            PharmacySaleItem.objects.create(sale=sale, med_stock=self.stock, qty=2, unit_price=5, amount=10)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def assert_constant(self, url):
+        self.add_visits(1)
+        few, response = self.count_queries(url)
+        self.assertEqual(response.data['count'], 1)
+        self.add_visits(9)
+        many, response = self.count_queries(url)
+        self.assertEqual(len(response.data['results']), 10)
+        first = response.data['results'][0]
+        self.assertTrue(first['pharmacy_items'] and first['lab_results'] and first['prescription'])
+        self.assertEqual(few, many)
+
+    def test_visit_list(self):
+        self.assert_constant('/api/reception/visits/')
+
+    def test_pharmacy_queue(self):
+        self.assert_constant('/api/pharmacy/queue/')
+
+    def test_role_queue_filter(self):
+        # The count, the page, then the sale items and completed lab charges prefetches
+        self.add_visits(12)
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/reception/visits/', {'assigned_role': 'PHARMACY', 'status': 'OPEN'})
+        self.assertEqual(response.data['count'], 12)
+
+
+class PatientExportTests(TestCase):
+    def test_export_streams_every_patient(self):
+        user = User.objects.create_user('reception', password='x', role='RECEPTION')
+        for n in range(3):
+            Patient.objects.create(full_name=f'Patient {n}', age=30, gender='M', phone=f'92000{n:05d}', address='-')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get('/api/reception/patients/export/')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,full_name,age,gender,phone,created_at')
+        self.assertEqual(len(lines), 4)
+
+    def test_export_is_one_query_however_many_patients(self):
+        from unittest import mock
+
+        user = User.objects.create_user('reception', password='x', role='RECEPTION')
+        for n in range(25):
+            patient = Patient.objects.create(full_name=f'Patient {n}', age=30, gender='M', phone=f'92000{n:05d}', address='-')
+            Visit.objects.create(patient=patient, doctor=user if n % 2 else None)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        # The rows are read as the body streams, several chunks of them
+        with mock.patch('revive_cms.utils.EXPORT_CHUNK_SIZE', 4), self.assertNumQueries(1):
+            response = client.get('/api/reception/patients/export/')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 26)
+
+
+class VisitRoomAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('doctor', password='x', role='DOCTOR')
+        cls.other_doctor = User.objects.create_user('doctor2', password='x', role='DOCTOR')
+        cls.lab = User.objects.create_user('lab', password='x', role='LAB')
+        cls.reception = User.objects.create_user('reception', password='x', role='RECEPTION')
+        patient = Patient.objects.create(full_name='Asha', age=30, gender='F', phone='9300000001', address='-')
+        cls.visit = Visit.objects.create(patient=patient, doctor=cls.doctor)
+
+    def test_visit_rooms_need_role_or_assignment(self):
+        from revive_cms.sio import can_join_room
+
+        room = f'visit:{self.visit.pk}'
+        self.assertTrue(can_join_room(self.doctor.pk, room))
+        self.assertTrue(can_join_room(self.reception.pk, room))
+        self.assertFalse(can_join_room(self.other_doctor.pk, room))
+        self.assertFalse(can_join_room(self.lab.pk, room))
+
+        LabCharge.objects.create(visit=self.visit, test_name='CBC', amount=200)
+        self.assertTrue(can_join_room(self.lab.pk, room))
+
+    def test_only_visit_rooms_can_be_joined(self):
+        from revive_cms.sio import can_join_room
+
+        self.assertFalse(can_join_room(self.doctor.pk, 'role:ADMIN'))
+        self.assertFalse(can_join_room(self.doctor.pk, 'visit:not-a-uuid'))
+
+    def test_room_checks_run_fixed_queries(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        from revive_cms.sio import can_join_room, get_user_for_token
+
+        # Connect: one user lookup for the token
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_for_token(str(AccessToken.for_user(self.doctor))), self.doctor)
+
+        # Join: the user, then a single EXISTS over the visits the role may follow
+        room = f'visit:{self.visit.pk}'
+        for user in (self.doctor, self.other_doctor, self.lab, self.reception):
+            with self.assertNumQueries(2):
+                can_join_room(user.pk, room)
+        with self.assertNumQueries(0):
+            self.assertFalse(can_join_room(self.doctor.pk, 'role:ADMIN'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'reads SQLite EXPLAIN QUERY PLAN output')
+class VisitIndexTests(TestCase):
+    """The queue and active-visit filters are answered from their composite indexes."""
+
+    def test_queue_filter_uses_role_status_index(self):
+        plan = Visit.objects.filter(assigned_role='LAB', status__in=['OPEN', 'IN_PROGRESS']).explain()
+        self.assertIn('USING INDEX visit_role_status_idx', plan)
+
+    def test_active_visit_check_uses_patient_status_index(self):
+        plan = Visit.objects.filter(patient_id=uuid.uuid4(), status__in=Visit.ACTIVE_STATUSES).explain()
+        self.assertIn('visit_patient_status_idx', plan)
+
+
+class TypeaheadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reception', password='x', role='RECEPTION')
+        for name, phone in [
+            ('Ramesh Kumar', '9876500001'),
+            ('Kumari Devi', '9876500002'),
+            ('Ram Prasad', '9123400003'),
+            ('Suresh Raman', '9123400004'),
+        ]:
+            Patient.objects.create(full_name=name, age=30, gender='M', phone=phone, address='-')
+
+    def search(self, query):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/reception/patients/typeahead/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [row['full_name'] for row in response.data]
+
+    def test_phone_prefix(self):
+        self.assertEqual(self.search('98765'), ['Ramesh Kumar', 'Kumari Devi'])
+        self.assertEqual(self.search('91234 00004'), ['Suresh Raman'])
+
+    def test_name_word_prefixes(self):
+        # Names starting with the query rank first, then shorter names
+        self.assertEqual(self.search('ram'), ['Ram Prasad', 'Ramesh Kumar', 'Suresh Raman'])
+        self.assertEqual(self.search('kum ram'), ['Ramesh Kumar'])
+        self.assertEqual(self.search('RAM pra'), ['Ram Prasad'])
+        self.assertEqual(self.search('xyz'), [])
+
+    def test_prefix_is_not_a_substring_match(self):
+        self.assertEqual(self.search('esh'), [])
+
+    def test_keystroke_runs_fixed_queries(self):
+        from .search import TYPEAHEAD_LIMIT, typeahead
+
+        for n in range(TYPEAHEAD_LIMIT * 3):
+            Patient.objects.create(full_name=f'Ramu Kumar {n}', age=30, gender='M', phone=f'98770{n:05d}', address='-')
+
+        # Phone prefix: one limited query
+        with self.assertNumQueries(1):
+            self.assertEqual(len(typeahead('98770')), TYPEAHEAD_LIMIT)
+        # Name words: candidate ids from the token index, then their patient rows
+        for query in ('ram', 'kum ram'):
+            with self.assertNumQueries(2):
+                self.assertEqual(len(typeahead(query)), TYPEAHEAD_LIMIT)
+
+
+class PatientListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reception', password='x', role='RECEPTION')
+        cls.doctor = User.objects.create_user('drmehta', password='x', role='DOCTOR', first_name='Anil', last_name='Mehta')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_patients(self, count, status='CLOSED'):
+        start = Patient.objects.count()
+        patients = []
+        for n in range(start, start + count):
+            patient = Patient.objects.create(full_name=f'Patient {n}', age=30, gender='M', phone=f'95000{n:05d}', address='-')
+            Visit.objects.create(patient=patient, status='CLOSED')
+            Visit.objects.create(patient=patient, doctor=self.doctor, status=status)
+            patients.append(patient)
+        return patients
+
+    def count_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/reception/patients/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_constant_queries_per_page(self):
+        self.add_patients(1)
+        few, response = self.count_queries()
+        self.add_patients(9)
+        many, response = self.count_queries()
+        # The count, then one page with the visit count and last doctor annotated
+        self.assertEqual((few, many), (2, 2))
+
+        row = response.data['results'][0]
+        self.assertEqual(row['total_visits'], 2)
+        self.assertEqual(row['last_consulted_doctor'], {'id': self.doctor.pk, 'name': 'Dr. Anil Mehta'})
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/reception/patients/{row['id']}/")
+        self.assertEqual(response.data['last_consulted_doctor'], row['last_consulted_doctor'])
+
+    def test_exclude_active(self):
+        closed = self.add_patients(2)
+        active = self.add_patients(1, status='IN_PROGRESS') + self.add_patients(1, status='OPEN')
+
+        count, response = self.count_queries({'exclude_active': 'true', 'page_size': 50})
+        self.assertEqual({row['id'] for row in response.data['results']}, {str(p.pk) for p in closed})
+        self.assertFalse(any(row['has_active_visit'] for row in response.data['results']))
+
+        # The filter is a correlated NOT EXISTS, so more patients and visits add no queries
+        self.add_patients(5)
+        self.add_patients(5, status='IN_PROGRESS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/reception/patients/', {'exclude_active': 'true', 'page_size': 50})
+        self.assertEqual((count, len(queries)), (2, 2))
+        self.assertEqual(response.data['count'], 7)
+        self.assertIn('NOT EXISTS', queries[-1]['sql'].upper())
 
-# Create your tests here.
+        response = self.client.get(f'/api/reception/patients/{active[0].pk}/')
+        self.assertTrue(response.data['has_active_visit'])
@@ -5,7 +5,8 @@ from django_filters.rest_framework import DjangoFilterBackend
 from revive_cms.utils import export_to_csv
 
 from .models import Patient, Visit
-from .serializers import PatientSerializer, VisitSerializer
+from .serializers import PatientSerializer, PatientTypeaheadSerializer, VisitSerializer
+from . import search
 
 
 from core.permissions import IsHospitalStaff
@@ -19,14 +20,13 @@ class PatientViewSet(viewsets.ModelViewSet):
     search_fields = ['full_name', 'phone']
 
     def get_queryset(self):
-        qs = Patient.objects.all().order_by('-created_at')
+        qs = PatientSerializer.setup_eager_loading(Patient.objects.all().order_by('-created_at'))
         
         # Filter Logic: Exclude active patients if requested
         exclude_active = self.request.query_params.get('exclude_active')
         if exclude_active == 'true':
-            # Exclude patients who have any active visit
-            active_statuses = ['OPEN', 'IN_PROGRESS', 'WAITING']
-            qs = qs.exclude(visits__status__in=active_statuses)
+            # Exclude patients who have any active visit: NOT EXISTS on (patient, status)
+            qs = qs.filter(has_active_visit=False)
             
         return qs
 
@@ -38,6 +38,14 @@ class PatientViewSet(viewsets.ModelViewSet):
             ['id', 'full_name', 'age', 'gender', 'phone', 'created_at']
         )
 
+    @action(detail=False, methods=['get'], url_path='typeahead')
+    def typeahead(self, request):
+        """
+        Ranked, fixed-size patient matches for search boxes: ?q=<phone prefix or name words>
+        """
+        patients = search.typeahead(request.query_params.get('q'))
+        return Response(PatientTypeaheadSerializer(patients, many=True).data)
+
     @action(detail=False, methods=['post'], url_path='register')
     def register(self, request):
         """
@@ -75,6 +83,9 @@ class VisitViewSet(viewsets.ModelViewSet):
     search_fields = ['patient__full_name', 'patient__phone']
     ordering_fields = ['created_at', 'updated_at']
 
+    def get_queryset(self):
+        return VisitSerializer.setup_eager_loading(Visit.objects.all().order_by('-created_at'))
+
     def perform_create(self, serializer):
         visit = serializer.save()
         match_role = None
@@ -84,71 +95,48 @@ class VisitViewSet(viewsets.ModelViewSet):
             match_role = visit.assigned_role
         elif visit.doctor:
             # Single doctor notification (legacy/specific)
-            from core.models import Notification
-            Notification.objects.create(
-                recipient=visit.doctor,
-                message=f"New patient assigned: {visit.patient.full_name}",
+            from core.notifications import notify_user
+            notify_user(
+                visit.doctor,
+                f"New patient assigned: {visit.patient.full_name}",
                 type='VISIT_ASSIGNED',
                 related_id=visit.id
             )
             return
 
         if match_role:
-            from core.models import Notification
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            
-            # Broadcast to all active users in that role
-            recipients = User.objects.filter(role=match_role, is_active=True)
-            notifications = [
-                Notification(
-                    recipient=u,
-                    message=f"New Patient in Queue: {visit.patient.full_name}",
-                    type='VISIT_ASSIGNED',
-                    related_id=visit.id
-                ) for u in recipients
-            ]
-            Notification.objects.bulk_create(notifications)
+            from core.notifications import notify_roles
+
+            # Broadcast to everyone in that role (stored once, read per user)
+            notify_roles(
+                match_role,
+                f"New Patient in Queue: {visit.patient.full_name}",
+                type='VISIT_ASSIGNED',
+                related_id=visit.id
+            )
 
     def perform_update(self, serializer):
         old_doctor = serializer.instance.doctor
         old_role = serializer.instance.assigned_role
         
-        # DEBUG LOGGING
-        print(f"\n=== VISIT UPDATE DEBUG ===")
-        print(f"Visit ID: {serializer.instance.id}")
-        print(f"Request data: {self.request.data}")
-        print(f"Old doctor: {old_doctor}")
-        print(f"Validated data doctor: {serializer.validated_data.get('doctor')}")
-        
         visit = serializer.save()
-        
-        print(f"After save - visit.doctor: {visit.doctor}")
-        print(f"=========================\n")
-        
+
         # Check for Doctor change
         if visit.doctor and visit.doctor != old_doctor:
-            from core.models import Notification
-            Notification.objects.create(
-                recipient=visit.doctor,
-                message=f"Transferred patient: {visit.patient.full_name}",
+            from core.notifications import notify_user
+            notify_user(
+                visit.doctor,
+                f"Transferred patient: {visit.patient.full_name}",
                 type='VISIT_ASSIGNED',
                 related_id=visit.id
             )
             
         # Check for Role change (Referral)
         if visit.assigned_role and visit.assigned_role != old_role and visit.assigned_role != 'DOCTOR':
-            from core.models import Notification
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            
-            recipients = User.objects.filter(role=visit.assigned_role, is_active=True)
-            notifications = [
-                Notification(
-                    recipient=u,
-                    message=f"New Referral: {visit.patient.full_name} (from {old_role or 'Reception'})",
-                    type='VISIT_ASSIGNED',
-                    related_id=visit.id
-                ) for u in recipients
-            ]
-            Notification.objects.bulk_create(notifications)
+            from core.notifications import notify_roles
+            notify_roles(
+                visit.assigned_role,
+                f"New Referral: {visit.patient.full_name} (from {old_role or 'Reception'})",
+                type='VISIT_ASSIGNED',
+                related_id=visit.id
+            )
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Supplier, PurchaseInvoice, PurchaseItem, PharmacyStock, PharmacySale, PharmacySaleItem
+from .models import Supplier, PurchaseInvoice, PurchaseItem, PharmacyStock, PharmacySale, PharmacySaleItem, BulkUploadJob
 
 @admin.register(Supplier)
 class SupplierAdmin(admin.ModelAdmin):
@@ -28,3 +28,8 @@ class PharmacySaleItemInline(admin.TabularInline):
 class PharmacySaleAdmin(admin.ModelAdmin):
     list_display = ('id', 'visit', 'total_amount', 'payment_status', 'sale_date')
     inlines = [PharmacySaleItemInline]
+
+@admin.register(BulkUploadJob)
+class BulkUploadJobAdmin(admin.ModelAdmin):
+    list_display = ('supplier_name', 'status', 'rows_parsed', 'rows_failed', 'items_created', 'created_at')
+    list_filter = ('status',)
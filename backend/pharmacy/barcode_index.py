@@ -0,0 +1,79 @@
+"""
+Per-process barcode -> FEFO batch list for the POS scan endpoint.
+
+Each barcode entry holds the serialized in-stock, non-deleted batches ordered by expiry,
+tagged with the barcode's version token (revive_cms.versions). The token is read from the
+shared cache at most once per settings.VERSION_CHECK_TTL, so a warm scan is two dict
+lookups and no query; the database is only read on a miss or after a write.
+
+Writes to PharmacyStock give the barcode a new token on commit (pharmacy.signals, and
+explicitly after bulk writes that skip signals). Writes in this process drop the entry at
+once; other worker processes see them within the TTL. A scan only suggests a batch, and
+the sale itself is a conditional UPDATE (pharmacy.stock), so a briefly stale suggestion
+cannot oversell.
+"""
+from django.db import transaction
+
+from revive_cms import versions
+
+from .models import PharmacyStock
+
+# Distinct barcodes kept per process before the index is dropped and refilled
+MAX_BARCODES = 20000
+
+_index = {}
+
+
+def version_key(barcode):
+    return f"pharmacy:barcode:{barcode}:v"
+
+
+def get_version(barcode):
+    return versions.get_version(version_key(barcode))
+
+
+def load_batches(barcode):
+    from .serializers import PharmacyStockSerializer
+    stocks = (
+        PharmacyStock.objects
+        .filter(barcode=barcode, is_deleted=False, qty_available__gt=0)
+        .order_by('expiry_date')
+    )
+    return [(stock.qty_available, PharmacyStockSerializer(stock).data) for stock in stocks]
+
+
+def get_batches(barcode):
+    """FEFO list of (qty_available, serialized stock) for `barcode`, from memory when current."""
+    # Read the version before the rows: a write landing in between leaves a stale tag, not stale data
+    version = get_version(barcode)
+    entry = _index.get(barcode)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    batches = load_batches(barcode)
+    if len(_index) >= MAX_BARCODES:
+        _index.clear()
+    _index[barcode] = (version, batches)
+    return batches
+
+
+def find_batch(barcode, qty):
+    """Serialized nearest-expiry batch with at least `qty` available, or None."""
+    for qty_available, data in get_batches(barcode):
+        if qty_available >= qty:
+            return data
+    return None
+
+
+def bump_versions(barcodes):
+    versions.bump([version_key(barcode) for barcode in barcodes])
+
+
+def invalidate(barcodes):
+    """Forgets the given barcodes here now, and everywhere once the transaction commits."""
+    barcodes = {barcode for barcode in barcodes if barcode}
+    if not barcodes:
+        return
+    for barcode in barcodes:
+        _index.pop(barcode, None)
+    transaction.on_commit(lambda: bump_versions(barcodes))
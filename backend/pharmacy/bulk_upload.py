@@ -0,0 +1,402 @@
+"""
+Supplier file (H/TH/T/F) ingestion for PharmacyBulkUploadView.
+
+Parsing is separated from writing: rows are turned into plain dicts first, then
+written in batches with one stock preload query, bulk_create/bulk_update and a
+single low-stock check per batch instead of per-row get_or_create/save().
+"""
+import csv
+import io
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from itertools import chain
+
+from django.db import models, transaction, connection
+from django.utils import timezone
+
+from .models import PharmacyStock, PurchaseInvoice, PurchaseItem, Supplier, BulkUploadJob
+
+logger = logging.getLogger(__name__)
+
+# T lines written per batch (also keeps IN (...) lists well under DB parameter limits)
+INGEST_BATCH_SIZE = 500
+
+# Per-row errors kept on a BulkUploadJob; later ones are only counted
+MAX_JOB_ERRORS = 500
+
+# A RUNNING job saves progress after every batch; one silent this long has lost its worker
+STALE_JOB_TIMEOUT = timedelta(minutes=15)
+
+GST_KEYS = ['GST', 'GST%', 'Tax', 'Tax %', 'IGST', 'TaxPerc']
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_header(row):
+    """
+    H,MediWMS,1.0,InvNo,Date,,,Type,CreditDays,...
+    """
+    inv_no = row[3] if len(row) > 3 else "Unknown"
+    inv_date_str = row[4] if len(row) > 4 else ""
+    p_type = row[7].upper() if len(row) > 7 else "CASH"
+    c_days = 0
+    try:
+        c_days = int(row[8]) if len(row) > 8 and row[8] else 0
+    except ValueError:
+        pass
+
+    # Convert date dd/mm/yyyy to yyyy-mm-dd
+    try:
+        inv_date = datetime.strptime(inv_date_str, '%d/%m/%Y').date()
+    except ValueError:
+        inv_date = datetime.now().date()
+
+    return {
+        'supplier_invoice_no': inv_no,
+        'invoice_date': inv_date,
+        'credit_days': c_days,
+        'purchase_type': 'CREDIT' if 'CREDIT' in p_type else 'CASH',
+    }
+
+
+def parse_item(headers, row):
+    """
+    Turns one T line into the fields needed for PurchaseItem and PharmacyStock.
+    """
+    data = {k.strip(): v for k, v in zip(headers, row) if k}
+    lookup = {k.lower(): v for k, v in data.items()}
+
+    # Helper to find key case-insensitively
+    def get_val(keys_list, default=''):
+        for key in keys_list:
+            if key.lower() in lookup:
+                return lookup[key.lower()]
+        return default
+
+    # Extract number from packing like "10S" or "10 Tablets"
+    strip_size_val = get_val(['Packing', 'ItemPerPack', 'Strip Size', 'Tablets per Strip', 'TPS', 'Unit'], 1)
+    match = re.search(r'(\d+)', str(strip_size_val))
+    tps = int(match.group(1)) if match else 1
+
+    # Parse Expiry (mm/yyyy)
+    try:
+        exp_date = datetime.strptime(get_val(['Expiry', 'Exp', 'Exp Date'], ''), '%m/%Y').date()
+    except ValueError:
+        exp_date = None
+
+    # Try to parse GST if available in common headers
+    gst_val = 0
+    for key in GST_KEYS:
+        if key in data and data[key]:
+            try:
+                gst_val = float(str(data[key]).replace('%', '').strip())
+                break
+            except ValueError:
+                pass
+
+    return {
+        'product_name': get_val(['Product Name', 'Item Name', 'Particulars'], 'Unknown'),
+        'batch_no': get_val(['Batch', 'Batch No'], 'N/A'),
+        'expiry_date': exp_date,
+        # CSV contains UNIT rates, not total amounts
+        'qty': to_float(get_val(['Qty', 'Quantity'], 0)),
+        'free_qty': to_float(get_val(['Free', 'Free Qty'], 0)),
+        'purchase_rate': to_float(get_val(['Rate', 'Price'], 0)),
+        'ptr': to_float(get_val(['PTR', 'Purchase Rate'], 0)),
+        'mrp': to_float(get_val(['MRP'], 0)),
+        'hsn': get_val(['HSN', 'HSN Code'], ''),
+        'manufacturer': get_val(['Manufacturer Name', 'Manufacturer.Name', 'Mfr Name', 'Mfr'], ''),
+        'barcode': get_val(['Product Code', 'Barcode', 'Code'], ''),
+        'tablets_per_strip': tps,
+        'gst_percent': gst_val,
+    }
+
+
+def iter_supplier_rows(reader):
+    """
+    Yields ('H', header, line_no) and ('T', item, line_no) tuples from a csv.reader over a
+    supplier file. T lines before an H/TH pair are skipped, as are F (footer) lines.
+    Rows are read one at a time, so a file object can be passed without reading it whole.
+    """
+    headers = []
+    has_invoice = False
+    for row in reader:
+        if not row:
+            continue
+        line_type = row[0].strip().upper()
+
+        if line_type == 'H':
+            has_invoice = True
+            yield 'H', parse_header(row), reader.line_num
+        elif line_type == 'TH':
+            headers = [h.strip() for h in row]
+        elif line_type == 'T':
+            if not has_invoice or not headers:
+                continue
+            yield 'T', parse_item(headers, row), reader.line_num
+
+
+def create_invoice(supplier, header, user):
+    return PurchaseInvoice.objects.create(
+        supplier=supplier,
+        total_amount=0,  # Set by finalize_invoice
+        created_by=user,
+        **header
+    )
+
+
+def finalize_invoice(invoice):
+    # Recalculate total amount from items
+    invoice.total_amount = PurchaseItem.objects.filter(purchase=invoice).aggregate(
+        total=models.Sum(models.F('purchase_rate') * models.F('qty'))
+    )['total'] or 0
+    invoice.save()
+
+
+def ingest_items(invoice, supplier, items):
+    """
+    Writes parsed T lines for `invoice`, INGEST_BATCH_SIZE at a time.
+    Returns the number of items written.
+    """
+    count = 0
+    for start in range(0, len(items), INGEST_BATCH_SIZE):
+        count += ingest_batch(invoice, supplier, items[start:start + INGEST_BATCH_SIZE])
+    return count
+
+
+def ingest_batch(invoice, supplier, items):
+    if not items:
+        return 0
+    from .signals import notify_low_stock
+    from .barcode_index import invalidate as invalidate_barcodes
+    from .catalog import refresh as refresh_catalog
+
+    PurchaseItem.objects.bulk_create([
+        PurchaseItem(
+            purchase=invoice,
+            **{k: v for k, v in item.items() if k != 'gst_percent'}
+        ) for item in items
+    ])
+
+    # Stock match logic: product_name + batch_no + expiry + supplier, preloaded in one query
+    existing = {
+        (s.name, s.batch_no, s.expiry_date): s
+        for s in PharmacyStock.objects.filter(
+            supplier=supplier,
+            name__in={item['product_name'] for item in items},
+            batch_no__in={item['batch_no'] for item in items},
+        )
+    }
+
+    new_stocks = {}
+    changed_stocks = {}
+    # bulk_update cost grows with rows x fields, so only send the fields that actually changed
+    changed_fields = {'qty_available', 'updated_at'}
+    now = timezone.now()
+    for item in items:
+        key = (item['product_name'], item['batch_no'], item['expiry_date'])
+        # User clarified that both 'Qty' and 'Free' are strips
+        qty_in = (item['qty'] + item['free_qty']) * item['tablets_per_strip']
+
+        stock = existing.get(key) or new_stocks.get(key)
+        if stock is None:
+            new_stocks[key] = PharmacyStock(
+                name=item['product_name'],
+                batch_no=item['batch_no'],
+                expiry_date=item['expiry_date'],
+                supplier=supplier,
+                barcode=item['barcode'],
+                mrp=item['mrp'],
+                # User confirmed "mrp price is sale price" (Selling at MRP)
+                selling_price=item['mrp'],
+                purchase_rate=item['purchase_rate'],
+                qty_available=qty_in,
+                tablets_per_strip=item['tablets_per_strip'],
+                manufacturer=item['manufacturer'],
+                hsn=item['hsn'],
+                gst_percent=item['gst_percent'],
+            )
+            continue
+
+        stock.qty_available += qty_in
+        # Update metadata fields if they are better/newer
+        updates = {
+            'mrp': item['mrp'],
+            'gst_percent': item['gst_percent'],
+            'selling_price': item['mrp'],
+            'purchase_rate': item['purchase_rate'],
+            'tablets_per_strip': item['tablets_per_strip'],
+        }
+        if item['manufacturer']: updates['manufacturer'] = item['manufacturer']
+        if item['hsn']: updates['hsn'] = item['hsn']
+        for field, value in updates.items():
+            if getattr(stock, field) != value:
+                setattr(stock, field, value)
+                changed_fields.add(field)
+        if key in existing:
+            stock.updated_at = now
+            changed_stocks[key] = stock
+
+    PharmacyStock.objects.bulk_create(new_stocks.values())
+    PharmacyStock.objects.bulk_update(changed_stocks.values(), sorted(changed_fields))
+
+    # bulk writes skip post_save, so run the low-stock check and barcode invalidation once for the whole batch
+    notify_low_stock(list(new_stocks.values()), created=True)
+    notify_low_stock(list(changed_stocks.values()))
+    invalidate_barcodes(stock.barcode for stock in chain(new_stocks.values(), changed_stocks.values()))
+    refresh_catalog({stock.name for stock in chain(new_stocks.values(), changed_stocks.values())})
+    return len(items)
+
+
+def validate_item(item):
+    """
+    Row-level checks done before a T line joins a batch, so one bad row
+    fails on its own in background jobs instead of failing its whole batch.
+    """
+    if item['expiry_date'] is None:
+        return "Invalid or missing expiry (expected mm/yyyy)."
+    if item['qty'] < 0 or item['free_qty'] < 0:
+        return "Quantity cannot be negative."
+    return None
+
+
+def emit_job_progress(job):
+    from revive_cms.sio import emit_event, user_room
+    emit_event('bulk_upload_progress', {
+        'job_id': str(job.id),
+        'status': job.status,
+        'rows_parsed': job.rows_parsed,
+        'rows_failed': job.rows_failed,
+        'items_created': job.items_created,
+    }, [user_room(job.created_by_id) if job.created_by_id else None], key=str(job.id))
+
+
+def save_job_progress(job, **extra):
+    for attr, value in extra.items():
+        setattr(job, attr, value)
+    job.save(update_fields=[
+        'status', 'rows_parsed', 'rows_failed', 'items_created', 'errors', 'invoice_no', 'updated_at'
+    ])
+    emit_job_progress(job)
+
+
+def run_upload_job(job_id):
+    """
+    Processes a queued BulkUploadJob: the stored file is read line by line and
+    written INGEST_BATCH_SIZE T lines at a time, each batch in its own transaction,
+    with progress saved and pushed over Socket.IO after every batch.
+    """
+    # Claim the job atomically so the request thread and process_upload_jobs never both run it
+    claimed = BulkUploadJob.objects.filter(id=job_id, status='QUEUED').update(
+        status='RUNNING', updated_at=timezone.now()
+    )
+    job = BulkUploadJob.objects.get(id=job_id)
+    if not claimed:
+        return job
+    emit_job_progress(job)
+
+    def record_error(line_no, message):
+        job.rows_failed += 1
+        if len(job.errors) < MAX_JOB_ERRORS:
+            job.errors.append({'line': line_no, 'error': message})
+
+    try:
+        supplier, _ = Supplier.objects.get_or_create(supplier_name=job.supplier_name.strip())
+        invoice = None
+        pending = []  # (line_no, item)
+
+        def flush():
+            if not pending or not invoice:
+                return
+            try:
+                with transaction.atomic():
+                    job.items_created += ingest_batch(invoice, supplier, [item for _, item in pending])
+                    finalize_invoice(invoice)
+            except Exception as e:
+                for line_no, _ in pending:
+                    record_error(line_no, str(e))
+            pending.clear()
+            save_job_progress(job)
+
+        with job.file.open('rb') as raw:
+            text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            for line_type, data, line_no in iter_supplier_rows(csv.reader(text)):
+                if line_type == 'H':
+                    flush()
+                    invoice = create_invoice(supplier, data, job.created_by)
+                    job.invoice_no = invoice.supplier_invoice_no
+                    continue
+
+                job.rows_parsed += 1
+                error = validate_item(data)
+                if error:
+                    record_error(line_no, error)
+                    continue
+                pending.append((line_no, data))
+                if len(pending) >= INGEST_BATCH_SIZE:
+                    flush()
+            flush()
+
+        save_job_progress(job, status='COMPLETED')
+    except Exception as e:
+        record_error(None, str(e))
+        save_job_progress(job, status='FAILED')
+    finally:
+        # The rows are in the database (or in job.errors) now; don't keep supplier files around
+        delete_job_file(job)
+    return job
+
+
+def delete_job_file(job):
+    if not job.file:
+        return
+    try:
+        job.file.delete(save=False)
+        job.save(update_fields=['file', 'updated_at'])
+    except Exception:
+        logger.exception("Could not delete upload file for job %s", job.id)
+
+
+def fail_stale_jobs(timeout=STALE_JOB_TIMEOUT):
+    """
+    Marks RUNNING jobs with no progress saved for `timeout` (worker thread or process died)
+    as FAILED and deletes their files. They are not run again: the batches they committed
+    are already in stock, so re-reading the file would add them twice. Returns the jobs.
+    """
+    failed = []
+    for job in BulkUploadJob.objects.filter(status='RUNNING', updated_at__lt=timezone.now() - timeout):
+        # Conditional, so a worker that saves progress meanwhile keeps its job
+        if not BulkUploadJob.objects.filter(pk=job.pk, status='RUNNING', updated_at=job.updated_at).update(
+            status='FAILED', updated_at=timezone.now()
+        ):
+            continue
+        job.errors.append({'line': None, 'error': (
+            f"Interrupted: no progress since {job.updated_at:%Y-%m-%d %H:%M}. {job.items_created} items "
+            f"were saved after {job.rows_parsed} rows; upload the rest of the file again."
+        )})
+        save_job_progress(job, status='FAILED')
+        delete_job_file(job)
+        failed.append(job)
+    return failed
+
+
+def start_upload_job(job):
+    """
+    Runs the job on a background thread once the request that queued it has committed.
+    Jobs left QUEUED (e.g. by a restart) can be picked up with `manage.py process_upload_jobs`,
+    which also fails jobs left RUNNING by a worker that died (fail_stale_jobs).
+    """
+    def target():
+        try:
+            run_upload_job(job.id)
+        finally:
+            connection.close()
+
+    transaction.on_commit(lambda: threading.Thread(target=target, daemon=True).start())
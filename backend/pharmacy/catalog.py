@@ -0,0 +1,115 @@
+"""
+Medicine catalog index: per-name stock totals plus word tokens for prefix search.
+
+refresh() recomputes the rows for a set of names with one grouped aggregate; stock signals
+call it for single saves and bulk ingestion calls it once per batch.
+"""
+from django.db import transaction
+from django.db.models import Sum, Count, Min, Q, Exists, OuterRef
+
+from revive_cms.utils import name_tokens, prefix_match
+from .models import PharmacyStock, MedicineCatalog, MedicineCatalogToken, Supplier
+
+# Medicines returned per search
+SEARCH_LIMIT = 50
+
+
+def aggregate(names=None):
+    """{name: (total_qty, batch_count, nearest_expiry)} over non-deleted batches."""
+    qs = PharmacyStock.objects.filter(is_deleted=False)
+    if names is not None:
+        qs = qs.filter(name__in=names)
+    rows = qs.values('name').annotate(
+        total=Sum('qty_available'),
+        batches=Count('id'),
+        nearest=Min('expiry_date', filter=Q(qty_available__gt=0)),
+    ).order_by()
+    return {row['name']: (row['total'] or 0, row['batches'], row['nearest']) for row in rows}
+
+
+@transaction.atomic
+def refresh(names):
+    """Brings the catalog rows for `names` in line with PharmacyStock."""
+    names = {name for name in names if name}
+    if not names:
+        return
+    totals = aggregate(names)
+    existing = {row.name: row for row in MedicineCatalog.objects.filter(name__in=names)}
+
+    new_rows, changed_rows = [], []
+    for name, (total, batches, nearest) in totals.items():
+        row = existing.get(name)
+        if row is None:
+            new_rows.append(MedicineCatalog(name=name, total_qty=total, batch_count=batches, nearest_expiry=nearest))
+        elif (row.total_qty, row.batch_count, row.nearest_expiry) != (total, batches, nearest):
+            row.total_qty, row.batch_count, row.nearest_expiry = total, batches, nearest
+            changed_rows.append(row)
+
+    gone = [row.pk for name, row in existing.items() if name not in totals]
+    if gone:
+        MedicineCatalog.objects.filter(pk__in=gone).delete()
+    if changed_rows:
+        MedicineCatalog.objects.bulk_update(changed_rows, ['total_qty', 'batch_count', 'nearest_expiry'])
+    if new_rows:
+        # Another transaction may insert the same new name first; skip those rows here
+        MedicineCatalog.objects.bulk_create(new_rows, ignore_conflicts=True)
+        inserted = set(MedicineCatalog.objects.filter(pk__in=[row.pk for row in new_rows]).values_list('pk', flat=True))
+        MedicineCatalogToken.objects.bulk_create([
+            MedicineCatalogToken(medicine=row, token=token)
+            for row in new_rows if row.pk in inserted for token in set(name_tokens(row.name))
+        ])
+        # The winner's totals may predate our stock rows, so bring its rows up to date too
+        lost = {row.name for row in new_rows if row.pk not in inserted}
+        if lost:
+            refresh(lost)
+
+
+@transaction.atomic
+def rebuild():
+    """Regenerates the whole catalog from PharmacyStock. Returns the number of medicines."""
+    MedicineCatalog.objects.all().delete()
+    refresh(aggregate().keys())
+    return MedicineCatalog.objects.count()
+
+
+def search(query, in_stock=False, limit=SEARCH_LIMIT):
+    """
+    Catalog rows whose name words start with every word of `query`, ordered by name.
+    """
+    tokens = sorted(set(name_tokens(query)), key=len, reverse=True)
+    if not tokens:
+        return MedicineCatalog.objects.none()
+
+    # Longest word drives the index lookup, the others are probed per medicine
+    matches = MedicineCatalogToken.objects.filter(prefix_match('token', tokens[0]))
+    for token in tokens[1:]:
+        matches = matches.filter(Exists(MedicineCatalogToken.objects.filter(
+            prefix_match('token', token),
+            medicine_id=OuterRef('medicine_id'),
+        )))
+
+    qs = MedicineCatalog.objects.filter(id__in=matches.values('medicine_id'))
+    if in_stock:
+        qs = qs.filter(total_qty__gt=0)
+    return qs.order_by('name')[:limit]
+
+
+def filter_stock(queryset, query):
+    """
+    Stock list search: medicine name words via the catalog, exact barcode, batch number
+    prefix or supplier name prefix, instead of LIKE '%x%' on four columns across a join.
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset
+    names = search(query, limit=None).values('name')
+    suppliers = Supplier.objects.filter(supplier_name__istartswith=query).values('id')
+    # One indexed lookup per column, unioned, rather than an OR that forces a full scan
+    stock = PharmacyStock.objects.order_by()
+    batches = [stock.filter(prefix_match('batch_no', prefix)).values('id') for prefix in {query, query.upper()}]
+    matches = stock.filter(name__in=names).values('id').union(
+        stock.filter(barcode=query).values('id'),
+        *batches,
+        stock.filter(supplier_id__in=suppliers).values('id'),
+    )
+    return queryset.filter(id__in=matches)
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from pharmacy import barcode_index
+from pharmacy.models import PharmacyStock
+from pharmacy.serializers import PharmacyStockSerializer
+
+
+def uncached_scan(barcode, qty):
+    # What the scan endpoint did before the index: one query and one serialization per scan
+    stock = (
+        PharmacyStock.objects
+        .filter(barcode=barcode, is_deleted=False, qty_available__gte=qty)
+        .order_by('expiry_date')
+        .first()
+    )
+    return PharmacyStockSerializer(stock).data if stock else None
+
+
+class Command(BaseCommand):
+    help = 'Compares POS barcode scan throughput with and without the in-process barcode index (read only).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('barcode', nargs='?', help='Barcode to scan (default: the one with most live batches)')
+        parser.add_argument('--scans', type=int, default=2000, help='Scans per run (default 2000)')
+        parser.add_argument('--qty', type=int, default=1, help='Quantity asked for by each scan (default 1)')
+
+    def handle(self, *args, **options):
+        barcode = options['barcode'] or (
+            PharmacyStock.objects
+            .filter(is_deleted=False, qty_available__gt=0).exclude(barcode__isnull=True).exclude(barcode='')
+            .values('barcode').annotate(batches=Count('id')).order_by('-batches')
+            .values_list('barcode', flat=True).first()
+        )
+        if not barcode:
+            raise CommandError('No in-stock batch with a barcode to scan.')
+        scans, qty = options['scans'], options['qty']
+
+        # Warm the index (and the version check) the way the first scan at a counter would
+        barcode_index.find_batch(barcode, qty)
+        if barcode_index.find_batch(barcode, qty) != uncached_scan(barcode, qty):
+            raise CommandError(f'Index and database disagree for {barcode}; is a write in flight?')
+
+        for label, scan in (('database', uncached_scan), ('index', barcode_index.find_batch)):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(scans):
+                    scan(barcode, qty)
+                elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{label:>8}: {scans / elapsed:12.0f} scans/s  "
+                f"{elapsed / scans * 1e6:9.1f} us/scan  {len(queries) / scans:.2f} queries/scan"
+            )
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from pharmacy.models import BulkUploadJob
+from pharmacy.bulk_upload import STALE_JOB_TIMEOUT, fail_stale_jobs, run_upload_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Processes queued pharmacy bulk upload jobs (e.g. ones never started because of a restart) '
+        'and fails RUNNING jobs whose worker died.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-minutes', type=int, default=int(STALE_JOB_TIMEOUT.total_seconds() // 60),
+            help='Fail RUNNING jobs with no progress for this many minutes (default %(default)s).'
+        )
+
+    def handle(self, *args, **options):
+        for job in fail_stale_jobs(timedelta(minutes=options['stale_minutes'])):
+            self.stdout.write(f"{job.id}: FAILED (no progress, {job.items_created} items saved)")
+
+        job_ids = list(BulkUploadJob.objects.filter(status='QUEUED').order_by('created_at').values_list('id', flat=True))
+        for job_id in job_ids:
+            job = run_upload_job(job_id)
+            self.stdout.write(f"{job.id}: {job.status} ({job.items_created} items, {job.rows_failed} failed)")
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(job_ids)} upload jobs."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy.catalog import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the medicine catalog index (per-name stock totals and search tokens) from PharmacyStock.'
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Catalog rebuilt with {count} medicines."))
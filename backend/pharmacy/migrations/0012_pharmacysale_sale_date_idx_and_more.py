@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_patient_patient_created_idx_visit_visit_created_idx_and_more'),
+        ('pharmacy', '0011_bulkuploadjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pharmacysale',
+            index=models.Index(fields=['-sale_date'], name='sale_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacysale',
+            index=models.Index(fields=['created_at'], name='sale_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacysale',
+            index=models.Index(fields=['patient', 'payment_status'], name='sale_patient_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacysaleitem',
+            index=models.Index(fields=['created_at'], name='saleitem_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['barcode', 'expiry_date'], name='stock_barcode_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['is_deleted', 'expiry_date'], name='stock_deleted_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['name', 'batch_no'], name='stock_name_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseinvoice',
+            index=models.Index(fields=['-invoice_date'], name='purchaseinv_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseinvoice',
+            index=models.Index(fields=['created_at'], name='purchaseinv_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseitem',
+            index=models.Index(fields=['created_at'], name='purchaseitem_created_idx'),
+        ),
+    ]
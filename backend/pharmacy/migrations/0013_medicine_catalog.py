@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:49
+
+import django.db.models.deletion
+import re
+import uuid
+from django.db import migrations, models
+from django.db.models import Sum, Count, Min, Q
+
+
+def build_catalog(apps, schema_editor):
+    PharmacyStock = apps.get_model('pharmacy', 'PharmacyStock')
+    MedicineCatalog = apps.get_model('pharmacy', 'MedicineCatalog')
+    MedicineCatalogToken = apps.get_model('pharmacy', 'MedicineCatalogToken')
+
+    rows = PharmacyStock.objects.filter(is_deleted=False).values('name').annotate(
+        total=Sum('qty_available'),
+        batches=Count('id'),
+        nearest=Min('expiry_date', filter=Q(qty_available__gt=0)),
+    ).order_by()
+    medicines = MedicineCatalog.objects.bulk_create([
+        MedicineCatalog(name=row['name'], total_qty=row['total'] or 0, batch_count=row['batches'], nearest_expiry=row['nearest'])
+        for row in rows
+    ])
+    MedicineCatalogToken.objects.bulk_create([
+        MedicineCatalogToken(medicine=medicine, token=token[:64])
+        for medicine in medicines for token in set(re.findall(r'\w+', medicine.name.lower()))
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0012_pharmacysale_sale_date_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineCatalog',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('total_qty', models.PositiveIntegerField(default=0)),
+                ('batch_count', models.PositiveIntegerField(default=0)),
+                ('nearest_expiry', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MedicineCatalogToken',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('token', models.CharField(max_length=64)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='pharmacy.medicinecatalog')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'medicine'], name='medicine_token_idx')],
+            },
+        ),
+        migrations.RunPython(build_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0013_medicine_catalog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['batch_no'], name='stock_batch_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0014_stock_batch_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='medicinecatalogtoken',
+            name='medicine_token_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='pharmacystock',
+            name='stock_batch_idx',
+        ),
+        migrations.AddIndex(
+            model_name='medicinecatalogtoken',
+            index=models.Index(fields=['token', 'medicine'], name='medicine_token_idx', opclasses=['varchar_pattern_ops', 'uuid_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='pharmacystock',
+            index=models.Index(fields=['batch_no'], name='stock_batch_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
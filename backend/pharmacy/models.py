@@ -31,6 +31,12 @@ class PurchaseInvoice(BaseModel):
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0)])
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-invoice_date'], name='purchaseinv_date_idx'),
+            models.Index(fields=['created_at'], name='purchaseinv_created_idx'),
+        ]
+
     def __str__(self):
         return f"Inv {self.supplier_invoice_no} - {self.supplier.supplier_name}"
 
@@ -66,11 +72,51 @@ class PharmacyStock(BaseModel):
                 name='unique_stock_name_batch_exp_supplier'
             )
         ]
+        indexes = [
+            # POS scan: barcode=..., ordered by nearest expiry
+            models.Index(fields=['barcode', 'expiry_date'], name='stock_barcode_expiry_idx'),
+            # Stock list / expiry report: is_deleted=False ordered by expiry_date
+            models.Index(fields=['is_deleted', 'expiry_date'], name='stock_deleted_expiry_idx'),
+            # Invoice deduction and doctor search lookups by name (+ batch)
+            models.Index(fields=['name', 'batch_no'], name='stock_name_batch_idx'),
+            # Stock list search by batch number prefix
+            models.Index(fields=['batch_no'], name='stock_batch_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.batch_no})"
 
 
+class MedicineCatalog(BaseModel):
+    """
+    One row per distinct medicine name with totals over its non-deleted batches, kept current
+    by pharmacy.catalog on stock writes. Search endpoints read this instead of grouping
+    PharmacyStock on every keystroke.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    total_qty = models.PositiveIntegerField(default=0)
+    batch_count = models.PositiveIntegerField(default=0)
+    nearest_expiry = models.DateField(null=True, blank=True)  # of batches still in stock
+
+    def __str__(self):
+        return f"{self.name} ({self.total_qty})"
+
+
+class MedicineCatalogToken(BaseModel):
+    """One lowercased word of a catalog name, matched by prefix (token LIKE 'x%', see pharmacy.catalog.search)."""
+    medicine = models.ForeignKey(MedicineCatalog, on_delete=models.CASCADE, related_name='tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        indexes = [
+            # Pattern opclass so PostgreSQL can serve startswith from it under any collation
+            models.Index(fields=['token', 'medicine'], name='medicine_token_idx', opclasses=['varchar_pattern_ops', 'uuid_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.medicine_id}"
+
+
 class PurchaseItem(BaseModel):
     purchase = models.ForeignKey(PurchaseInvoice, on_delete=models.CASCADE, related_name='items')
 
@@ -90,6 +136,11 @@ class PurchaseItem(BaseModel):
     hsn = models.CharField(max_length=20, blank=True)
     tablets_per_strip = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='purchaseitem_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.product_name} - {self.batch_no}"
 
@@ -122,6 +173,14 @@ class PharmacySale(BaseModel):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     payment_status = models.CharField(max_length=20, default='PENDING', choices=PAYMENT_STATUS)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-sale_date'], name='sale_date_idx'),
+            models.Index(fields=['created_at'], name='sale_created_idx'),
+            # pending_by_patient
+            models.Index(fields=['patient', 'payment_status'], name='sale_patient_status_idx'),
+        ]
+
     def __str__(self):
         return f"Sale {self.id}"
 
@@ -135,5 +194,36 @@ class PharmacySaleItem(BaseModel):
     amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     gst_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0)  # GST rate applied at sale time
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='saleitem_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.med_stock.name} x {self.qty}"
+
+
+class BulkUploadJob(BaseModel):
+    """
+    A supplier file queued for background ingestion (see pharmacy.bulk_upload.run_upload_job).
+    """
+    STATUS_CHOICES = (
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    )
+
+    file = models.FileField(upload_to='pharmacy_uploads/')
+    supplier_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    rows_parsed = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    items_created = models.PositiveIntegerField(default=0)
+    # [{"line": 12, "error": "..."}], capped at MAX_JOB_ERRORS entries
+    errors = models.JSONField(default=list, blank=True)
+    invoice_no = models.CharField(max_length=50, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.status})"
@@ -2,7 +2,7 @@ from django.db import transaction
 from rest_framework import serializers
 from .models import (
     Supplier, PharmacyStock, PurchaseInvoice, PurchaseItem,
-    PharmacySale, PharmacySaleItem
+    PharmacySale, PharmacySaleItem, BulkUploadJob
 )
 
 
@@ -15,6 +15,22 @@ class SupplierSerializer(serializers.ModelSerializer):
         read_only_fields = ['supplier_id', 'created_at', 'updated_at']
 
 
+class BulkUploadJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source='id', read_only=True)
+
+    class Meta:
+        model = BulkUploadJob
+        fields = [
+            'job_id', 'file', 'supplier_name', 'status', 'rows_parsed', 'rows_failed',
+            'items_created', 'errors', 'invoice_no', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'job_id', 'status', 'rows_parsed', 'rows_failed', 'items_created',
+            'errors', 'invoice_no', 'created_at', 'updated_at'
+        ]
+        extra_kwargs = {'file': {'write_only': True}}
+
+
 class PharmacyStockSerializer(serializers.ModelSerializer):
     med_id = serializers.UUIDField(source='id', read_only=True)
 
@@ -135,19 +151,24 @@ class PharmacySaleSerializer(serializers.ModelSerializer):
 
         sale = PharmacySale.objects.create(total_amount=0, **validated_data)
 
+        # reduce stock for all items in one conditional UPDATE (see pharmacy.stock)
+        from .stock import deduct, merge, InsufficientStock
+        try:
+            stocks = {s.pk: s for s in deduct(merge((item['med_stock'].pk, item['qty']) for item in items_data))}
+        except InsufficientStock as e:
+            stock, qty = e.shortages[0]
+            if stock.is_deleted:
+                raise serializers.ValidationError("Selected medicine stock is deleted.")
+            raise serializers.ValidationError(
+                f"Not enough stock for {stock.name} ({stock.batch_no}). Available: {stock.qty_available}"
+            )
+
         total = 0
+        sale_items = []
         for item in items_data:
-            med_stock = item['med_stock']
+            med_stock = stocks.get(item['med_stock'].pk, item['med_stock'])
             qty = item['qty']
 
-            if med_stock.is_deleted:
-                raise serializers.ValidationError("Selected medicine stock is deleted.")
-
-            if med_stock.qty_available < qty:
-                raise serializers.ValidationError(
-                    f"Not enough stock for {med_stock.name} ({med_stock.batch_no}). Available: {med_stock.qty_available}"
-                )
-
             unit_price = item.get('unit_price')
             if not unit_price:
                 # Calculate per-tablet price from strip selling price
@@ -157,18 +178,15 @@ class PharmacySaleSerializer(serializers.ModelSerializer):
             gst_percent = item.get('gst_percent', 0)
             total += amount
 
-            # reduce stock
-            med_stock.qty_available -= qty
-            med_stock.save()
-
-            PharmacySaleItem.objects.create(
+            sale_items.append(PharmacySaleItem(
                 sale=sale,
                 med_stock=med_stock,
                 qty=qty,
                 unit_price=unit_price,
                 amount=amount,
                 gst_percent=gst_percent
-            )
+            ))
+        PharmacySaleItem.objects.bulk_create(sale_items)
 
         sale.total_amount = total
         sale.save()
@@ -214,17 +232,16 @@ class PharmacySaleSerializer(serializers.ModelSerializer):
                  target_visit.status = 'OPEN' 
                  target_visit.save()
 
-        # Notify via Socket.IO
-        try:
-            from asgiref.sync import async_to_sync
-            from revive_cms.sio import sio
-            print(f"Emitting socket event for sale {sale.id}")
-            async_to_sync(sio.emit)('pharmacy_sale_update', {
-                'sale_id': str(sale.id),
-                'visit_id': str(sale.visit.id) if sale.visit else None,
-                'patient_id': str(sale.patient.id) if sale.patient else None
-            })
-        except Exception as e:
-            print(f"Socket emit error: {e}")
+        # Notify billing desks via Socket.IO
+        from core.realtime import publish
+        from revive_cms.sio import role_room, visit_room
+        publish('pharmacy_sale_update', 'pharmacy_sale', sale.id, PharmacySaleSerializer(sale).data, [
+            role_room('RECEPTION'),
+            visit_room(sale.visit_id) if sale.visit_id else None,
+        ], legacy={
+            'sale_id': str(sale.id),
+            'visit_id': str(sale.visit_id) if sale.visit_id else None,
+            'patient_id': str(sale.patient_id) if sale.patient_id else None
+        })
 
         return sale
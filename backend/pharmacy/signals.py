@@ -1,33 +1,63 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from .models import PharmacyStock
-from core.models import Notification
-from django.contrib.auth import get_user_model
+from .barcode_index import invalidate
+from . import catalog
+from core.alerts import check_levels, remember_level
+
+
+def notify_low_stock(stocks, created=False):
+    """
+    Raises low stock alerts for `stocks` that crossed their reorder level since they were
+    loaded (or, with created=True, that were inserted already low). Items that did not cross
+    cost no queries; bulk uploads pass a whole batch at once.
+    """
+    return check_levels('PHARMACY_STOCK', stocks, created=created)
+
+
+@receiver(post_init, sender=PharmacyStock)
+def remember_stock_level(sender, instance, **kwargs):
+    remember_level('PHARMACY_STOCK', instance)
+    deferred = instance.get_deferred_fields()
+    instance._loaded_barcode = None if 'barcode' in deferred else instance.barcode
+    # None means "unknown", so the next save refreshes the catalog
+    instance._catalog_key = None if CATALOG_FIELDS & deferred else catalog_key(instance)
+
+
+@receiver(post_save, sender=PharmacyStock)
+def check_low_stock(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    notify_low_stock([instance], created=created)
+
+
+@receiver(post_save, sender=PharmacyStock)
+@receiver(post_delete, sender=PharmacyStock)
+def invalidate_barcode_index(sender, instance, **kwargs):
+    # Old barcode too, in case the batch was relabelled
+    invalidate([instance.barcode, getattr(instance, '_loaded_barcode', None)])
+    instance._loaded_barcode = instance.barcode
+
+
+# The fields the medicine catalog totals depend on
+CATALOG_FIELDS = {'name', 'qty_available', 'is_deleted', 'expiry_date'}
+
+
+def catalog_key(stock):
+    return (stock.name, stock.qty_available, stock.is_deleted, stock.expiry_date)
 
-User = get_user_model()
 
 @receiver(post_save, sender=PharmacyStock)
-def check_low_stock(sender, instance, **kwargs):
-    if instance.qty_available < instance.reorder_level:
-        # Check if a recent notification already exists to avoid spam
-        # This is a basic implementation. Ideally we'd have a 'last_notified' field.
-        # check if active notification exists for this stock
-        exists = Notification.objects.filter(
-            message__contains=f"Low stock alert: {instance.name}",
-            is_read=False
-        ).exists()
-
-        if not exists:
-            # Notify all Pharmacy and Admin users
-            # For simplicity, let's notify the first Admin or all admins
-            # In a real app, we might have a group or specific role query
-            
-            # Find users with role 'PHARMACY' or 'ADMIN'
-            recipients = User.objects.filter(role__in=['PHARMACY', 'ADMIN'], is_active=True)
-            
-            for user in recipients:
-                Notification.objects.create(
-                    recipient=user,
-                    message=f"Low stock alert: {instance.name} (Batch: {instance.batch_no}) has only {instance.qty_available} units left.",
-                    type='WARNING'
-                )
+def refresh_medicine_catalog(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    loaded = getattr(instance, '_catalog_key', None)
+    current = catalog_key(instance)
+    if created or loaded != current:
+        catalog.refresh({instance.name, loaded[0] if loaded else None})
+    instance._catalog_key = current
+
+
+@receiver(post_delete, sender=PharmacyStock)
+def remove_from_medicine_catalog(sender, instance, **kwargs):
+    catalog.refresh({instance.name})
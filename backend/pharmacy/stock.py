@@ -0,0 +1,198 @@
+"""
+Stock movements for pharmacy batches.
+
+Sales and invoices take stock off through here instead of read-modify-save, so two
+counters selling the same batch at once can neither oversell it nor lose a decrement.
+Bulk writes skip post_save, so every movement finishes with stocks_changed(), which runs
+what the PharmacyStock signals would have (low stock alerts, barcode index, catalog).
+"""
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Q, Subquery, PositiveIntegerField
+from django.utils import timezone
+
+from .models import PharmacyStock
+
+
+class InsufficientStock(Exception):
+    """Raised by deduct() when some batches cannot cover their quantity; nothing was deducted."""
+
+    def __init__(self, shortages):
+        # [(stock, requested qty)], stock as it is now
+        self.shortages = shortages
+        super().__init__(', '.join(
+            f"{stock.name} ({stock.batch_no}): requested {qty}, available {stock.qty_available}"
+            for stock, qty in shortages
+        ))
+
+
+def merge(lines):
+    """[(stock_id, qty)] -> {stock_id: total qty}, so a batch listed twice is decremented once."""
+    quantities = {}
+    for stock_id, qty in lines:
+        quantities[stock_id] = quantities.get(stock_id, 0) + qty
+    return quantities
+
+
+def per_batch(quantities):
+    """CASE expression giving each batch's quantity inside a single UPDATE."""
+    return Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def deduct(quantities):
+    """
+    Takes {stock_id: qty} off in one conditional UPDATE
+    (qty_available = qty_available - n WHERE qty_available >= n AND NOT is_deleted).
+    The row lock taken by the UPDATE makes the check and the decrement one step, and rows
+    are matched through the primary key index so concurrent sales lock them in the same order.
+
+    All-or-nothing: if any batch is short or deleted, nothing is deducted and
+    InsufficientStock lists the short batches. Returns the updated stocks.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return []
+
+    amount = per_batch(quantities)
+    with transaction.atomic():
+        updated = PharmacyStock.objects.filter(
+            pk__in=sorted(quantities), is_deleted=False, qty_available__gte=amount,
+        ).update(qty_available=F('qty_available') - amount, updated_at=timezone.now())
+
+        stocks = list(PharmacyStock.objects.filter(pk__in=quantities))
+        if updated < len(quantities):
+            # Rolls the partial UPDATE back with the savepoint
+            raise InsufficientStock([
+                (stock, quantities[stock.pk]) for stock in stocks
+                if stock.is_deleted or stock.qty_available < quantities[stock.pk]
+            ])
+
+    for stock in stocks:
+        remember_previous(stock, stock.qty_available + quantities[stock.pk])
+    stocks_changed(stocks)
+    return stocks
+
+
+def deduct_available(lines):
+    """
+    Takes [(stock_id, qty)] off line by line, never below zero, for callers that record a
+    sale that already happened (e.g. an invoice) and must not fail on a short batch.
+    Rows are locked in primary key order with select_for_update and written back in one
+    bulk UPDATE. Returns [(stock or None, deducted)] in line order.
+    """
+    ids = {pk for pk, qty in lines if pk and qty > 0}
+    if not ids:
+        return [(None, 0) for line in lines]
+
+    now = timezone.now()
+    result, changed = [], {}
+    with transaction.atomic():
+        stocks = {
+            stock.pk: stock
+            for stock in PharmacyStock.objects.select_for_update().filter(pk__in=ids).order_by('pk')
+        }
+        for pk, qty in lines:
+            stock = stocks.get(pk)
+            deducted = min(stock.qty_available, qty) if stock and qty > 0 else 0
+            if deducted:
+                stock.qty_available -= deducted
+                stock.updated_at = now
+                changed[pk] = stock
+            result.append((stock, deducted))
+        PharmacyStock.objects.bulk_update(changed.values(), ['qty_available', 'updated_at'])
+
+    stocks_changed(list(changed.values()))
+    return result
+
+
+def resolve(pairs):
+    """
+    {(name, batch_no): stock or None} for invoice lines, with one query.
+    The exact batch wins; otherwise the nearest-expiry batch of that name, preferring
+    live batches with stock.
+    """
+    names = {name for name, batch in pairs}
+    if not names:
+        return {}
+    exact, in_stock, by_name = {}, {}, {}
+    for stock in PharmacyStock.objects.filter(name__in=names).order_by('is_deleted', 'expiry_date'):
+        exact.setdefault((stock.name, stock.batch_no), stock)
+        if not stock.is_deleted and stock.qty_available > 0:
+            in_stock.setdefault(stock.name, stock)
+        by_name.setdefault(stock.name, stock)
+    return {
+        (name, batch): exact.get((name, batch)) or in_stock.get(name) or by_name.get(name)
+        for name, batch in pairs
+    }
+
+
+def allocate(lines):
+    """
+    First-expiry-first-out split of [(medicine name or barcode, qty)] across batches.
+
+    A barcode line draws from every batch of the medicine that barcode labels. Expired,
+    deleted and empty batches are skipped, and lines for the same medicine share what is
+    left. All lines are resolved with one query; nothing is deducted here (see deduct()).
+    Returns [{'item', 'qty', 'allocations': [(stock, qty)], 'shortfall'}] in line order.
+    """
+    keys = {item for item, qty in lines}
+    if not keys:
+        return []
+
+    today = timezone.localdate()
+    usable = Q(is_deleted=False, qty_available__gt=0, expiry_date__gte=today)
+    barcode_names = PharmacyStock.objects.filter(barcode__in=keys).values('name')
+    stocks = list(
+        PharmacyStock.objects
+        .filter((Q(name__in=keys) | Q(name__in=Subquery(barcode_names))) & usable | Q(barcode__in=keys))
+        .order_by('expiry_date', 'created_at')
+    )
+
+    names = {stock.name for stock in stocks}
+    labels = {}
+    for stock in stocks:
+        labels.setdefault(stock.barcode, set()).add(stock.name)
+    # The barcode rows are loaded whatever their state (to find their medicine); drop the unusable ones
+    batches = [
+        stock for stock in stocks
+        if not stock.is_deleted and stock.qty_available > 0 and stock.expiry_date >= today
+    ]
+    remaining = {stock.pk: stock.qty_available for stock in batches}
+
+    plan = []
+    for item, qty in lines:
+        medicines = {item} if item in names else labels.get(item, set())
+        allocations = []
+        wanted = qty
+        for stock in batches:
+            if not wanted:
+                break
+            if stock.name not in medicines or not remaining[stock.pk]:
+                continue
+            taken = min(wanted, remaining[stock.pk])
+            remaining[stock.pk] -= taken
+            wanted -= taken
+            allocations.append((stock, taken))
+        plan.append({'item': item, 'qty': qty, 'allocations': allocations, 'shortfall': wanted})
+    return plan
+
+
+def remember_previous(stock, qty):
+    """Makes a freshly loaded stock look as if it was loaded before the movement, for crossing checks."""
+    stock._alert_level = (qty, stock.reorder_level)
+
+
+def stocks_changed(stocks, created=False):
+    """Post-write work for stocks changed by a bulk write (what the post_save signals do per row)."""
+    if not stocks:
+        return
+    from .signals import notify_low_stock
+    from .barcode_index import invalidate as invalidate_barcodes
+    from .catalog import refresh as refresh_catalog
+
+    notify_low_stock(stocks, created=created)
+    invalidate_barcodes(stock.barcode for stock in stocks)
+    refresh_catalog({stock.name for stock in stocks})
@@ -1,3 +1,494 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+import threading
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core.models import AlertState, Notification
+from users.models import User
+from .bulk_upload import run_upload_job
+from .models import (
+    BulkUploadJob, PharmacySale, PharmacySaleItem, PharmacyStock, PurchaseInvoice, PurchaseItem, Supplier,
+)
+
+
+def make_stock(**fields):
+    values = {
+        'name': 'Paracetamol 500mg',
+        'batch_no': 'B1',
+        'expiry_date': date.today() + timedelta(days=365),
+        'mrp': 10,
+        'selling_price': 10,
+        'qty_available': 100,
+        'reorder_level': 10,
+    }
+    values.update(fields)
+    return PharmacyStock.objects.create(**values)
+
+
+class LowStockAlertTests(TestCase):
+    def test_deferred_load_does_not_recurse(self):
+        make_stock()
+        stock = PharmacyStock.objects.only('pk').get()
+        self.assertIsNone(stock._alert_level)
+        self.assertEqual(stock.qty_available, 100)
+
+    def test_alerts_once_per_crossing(self):
+        stock = make_stock(qty_available=12)
+
+        stock.qty_available = 5
+        stock.save()
+        stock.qty_available = 4
+        stock.save()
+        self.assertEqual(Notification.objects.filter(related_id=stock.pk).count(), 2)  # PHARMACY + ADMIN
+        self.assertTrue(AlertState.objects.get(item_id=stock.pk).is_active)
+
+        stock.qty_available = 50
+        stock.save()
+        self.assertFalse(AlertState.objects.get(item_id=stock.pk).is_active)
+
+        stock.qty_available = 3
+        stock.save()
+        self.assertEqual(Notification.objects.filter(related_id=stock.pk).count(), 4)
+
+    def test_deferred_save_does_not_realert(self):
+        stock = make_stock(qty_available=5)
+        sent = Notification.objects.filter(related_id=stock.pk).count()
+
+        stock = PharmacyStock.objects.only('pk', 'batch_no').get()
+        stock.batch_no = 'B2'
+        stock.save()
+        self.assertEqual(Notification.objects.filter(related_id=stock.pk).count(), sent)
+
+
+    def test_losing_a_race_on_a_new_item_does_not_alert(self):
+        from unittest import mock
+        from core.alerts import check_levels
+
+        stock = make_stock(qty_available=50)
+        AlertState.objects.all().delete()
+        stock.qty_available = 5
+        real_bulk_create = AlertState.objects.bulk_create
+
+        def other_writer_first(states, **kwargs):
+            # Another sale of the same batch inserted the state (and sent its alert) just before
+            AlertState.objects.create(
+                item_type='PHARMACY_STOCK', item_id=stock.pk, kind='LOW_STOCK', is_active=True, level=6, threshold=10
+            )
+            return real_bulk_create(states, **kwargs)
+
+        with mock.patch.object(AlertState.objects, 'bulk_create', side_effect=other_writer_first):
+            self.assertEqual(check_levels('PHARMACY_STOCK', [stock]), 0)
+        self.assertFalse(Notification.objects.filter(related_id=stock.pk).exists())
+
+    def test_losing_a_race_on_a_known_item_does_not_alert(self):
+        from unittest import mock
+        from core.alerts import check_levels
+
+        stock = make_stock(qty_available=5)
+        AlertState.objects.update(is_active=False)
+        Notification.objects.all().delete()
+        stock._alert_level = (50, 10)
+        real_filter = AlertState.objects.filter
+        lookups = []
+
+        def stale_lookup(*args, **kwargs):
+            lookups.append(kwargs)
+            if len(lookups) == 1:
+                states = list(real_filter(*args, **kwargs))
+                # Another writer raises the alert right after we read the inactive state
+                real_filter(item_id=stock.pk).update(is_active=True)
+                return states
+            return real_filter(*args, **kwargs)
+
+        with mock.patch.object(AlertState.objects, 'filter', side_effect=stale_lookup):
+            self.assertEqual(check_levels('PHARMACY_STOCK', [stock]), 0)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_seed_migration_is_silent(self):
+        from importlib import import_module
+        from django.apps import apps
+
+        stock = make_stock(qty_available=50)
+        PharmacyStock.objects.filter(pk=stock.pk).update(qty_available=3)
+        Notification.objects.all().delete()
+
+        import_module('core.migrations.0008_seed_alert_states').seed_alert_states(apps, None)
+        state = AlertState.objects.get(item_id=stock.pk)
+        self.assertEqual((state.is_active, state.level), (True, 3))
+        self.assertFalse(Notification.objects.exists())
+
+
+SUPPLIER_FILE = """H,MediWMS,1.0,INV-77,05/03/2026,,,CREDIT,30
+TH,Product Name,Batch,Expiry,Qty,Free,Rate,MRP,Packing,Product Code,GST
+T,Cetirizine 10mg,C1,12/2027,10,2,8.50,12.00,10S,8901,12
+T,Cetirizine 10mg,C1,12/2027,5,0,8.50,12.00,10S,8901,12
+T,Azithromycin 500mg,Z9,06/2027,1,0,60.00,90.00,3S,8902,12
+F,3
+"""
+
+
+class BulkUploadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('pharmacist', password='x', role='PHARMACY'))
+        self.supplier = Supplier.objects.create(supplier_name='Medico')
+
+    def upload(self):
+        return self.client.post('/api/pharmacy/bulk-upload/', {
+            'file': SimpleUploadedFile('invoice.csv', SUPPLIER_FILE.encode(), content_type='text/csv'),
+            'supplier_name': 'Medico',
+        }, format='multipart')
+
+    def test_merges_lines_into_existing_and_new_batches(self):
+        existing = make_stock(
+            name='Cetirizine 10mg', batch_no='C1', expiry_date=date(2027, 12, 1),
+            supplier=self.supplier, qty_available=40,
+        )
+        response = self.upload()
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['items_processed'], 3)
+
+        invoice = PurchaseInvoice.objects.get(supplier_invoice_no='INV-77')
+        self.assertEqual(invoice.purchase_type, 'CREDIT')
+        self.assertEqual(PurchaseItem.objects.filter(purchase=invoice).count(), 3)
+
+        # (10 + 2 + 5 strips) x 10 tablets on top of the 40 already there
+        existing.refresh_from_db()
+        self.assertEqual(existing.qty_available, 210)
+        self.assertEqual(PharmacyStock.objects.filter(name='Cetirizine 10mg').count(), 1)
+
+        created = PharmacyStock.objects.get(name='Azithromycin 500mg')
+        self.assertEqual((created.qty_available, created.barcode, created.supplier_id), (3, '8902', self.supplier.pk))
+
+    def test_new_low_batch_alerts_once(self):
+        self.upload()
+        created = PharmacyStock.objects.get(name='Azithromycin 500mg')
+        self.assertEqual(Notification.objects.filter(related_id=created.pk).count(), 2)
+        self.assertTrue(AlertState.objects.get(item_id=created.pk).is_active)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UploadJobTests(TestCase):
+    def test_job_ingests_and_removes_its_file(self):
+        job = BulkUploadJob.objects.create(
+            supplier_name='Medico',
+            file=SimpleUploadedFile('invoice.csv', SUPPLIER_FILE.encode()),
+        )
+        path, queued_at = job.file.path, job.updated_at
+        self.assertTrue(os.path.exists(path))
+
+        run_upload_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_parsed, job.items_created, job.invoice_no), ('COMPLETED', 3, 3, 'INV-77'))
+        self.assertGreater(job.updated_at, queued_at)
+        self.assertFalse(job.file)
+        self.assertFalse(os.path.exists(path))
+
+    def test_claimed_job_is_not_run_twice(self):
+        job = BulkUploadJob.objects.create(
+            supplier_name='Medico',
+            file=SimpleUploadedFile('invoice.csv', SUPPLIER_FILE.encode()),
+        )
+        run_upload_job(job.id)
+        run_upload_job(job.id)
+        self.assertEqual(PurchaseItem.objects.count(), 3)
+
+    def test_stale_running_job_is_failed(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+
+        stale, live = [
+            BulkUploadJob.objects.create(
+                supplier_name='Medico', status='RUNNING',
+                file=SimpleUploadedFile('invoice.csv', SUPPLIER_FILE.encode()),
+            ) for _ in range(2)
+        ]
+        BulkUploadJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(minutes=20))
+        path = stale.file.path
+
+        call_command('process_upload_jobs', stdout=StringIO())
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((stale.status, live.status), ('FAILED', 'RUNNING'))
+        self.assertIn('Interrupted', stale.errors[-1]['error'])
+        self.assertFalse(os.path.exists(path))
+        # Not re-run: nothing was ingested twice
+        self.assertFalse(PurchaseItem.objects.exists())
+
+    def test_jobs_are_listed_to_their_uploader_and_admins(self):
+        pharmacists = [User.objects.create_user(f'pharmacist{n}', password='x', role='PHARMACY') for n in range(2)]
+        admin = User.objects.create_user('admin', password='x', role='ADMIN')
+        jobs = [
+            BulkUploadJob.objects.create(supplier_name='Medico', file='pharmacy_uploads/x.csv', created_by=user)
+            for user in pharmacists
+        ]
+        client = APIClient()
+
+        client.force_authenticate(pharmacists[0])
+        self.assertEqual([job['job_id'] for job in client.get('/api/pharmacy/upload-jobs/').data['results']], [str(jobs[0].pk)])
+        self.assertEqual(client.get(f'/api/pharmacy/upload-jobs/{jobs[1].pk}/').status_code, 404)
+
+        client.force_authenticate(admin)
+        self.assertEqual(client.get('/api/pharmacy/upload-jobs/').data['count'], 2)
+
+
+class BarcodeIndexTests(TestCase):
+    def setUp(self):
+        from revive_cms import versions
+        from . import barcode_index
+
+        # Both outlive the per-test rollback of the cache table
+        versions.clear()
+        barcode_index._index.clear()
+
+    def test_versions_live_in_the_shared_cache(self):
+        from django.conf import settings
+        self.assertNotIn('LocMemCache', settings.CACHES['default']['BACKEND'])
+
+    def test_warm_scan_runs_no_query(self):
+        from . import barcode_index
+
+        make_stock(barcode='8900', qty_available=50)
+        barcode_index.find_batch('8900', 1)
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                self.assertEqual(barcode_index.find_batch('8900', 1)['qty_available'], 50)
+
+    def test_write_in_this_process_is_seen_at_once(self):
+        from . import barcode_index
+
+        stock = make_stock(barcode='8903', qty_available=50)
+        barcode_index.find_batch('8903', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.qty_available = 0
+            stock.save()
+        self.assertIsNone(barcode_index.find_batch('8903', 1))
+
+    @override_settings(VERSION_CHECK_TTL=0)
+    def test_write_in_another_process_invalidates_the_index(self):
+        from django.core.cache import caches
+        from revive_cms.versions import new_version
+        from . import barcode_index
+
+        stock = make_stock(barcode='8901', qty_available=50)
+        self.assertEqual(barcode_index.find_batch('8901', 1)['qty_available'], 50)
+
+        # Another worker sells the batch and stores a new token through its own cache connection
+        PharmacyStock.objects.filter(pk=stock.pk).update(qty_available=0)
+        caches.create_connection('default').set(barcode_index.version_key('8901'), new_version(), None)
+        self.assertIsNone(barcode_index.find_batch('8901', 1))
+
+    @override_settings(VERSION_CHECK_TTL=0)
+    def test_every_bump_gets_a_new_token(self):
+        from django.core.cache import cache
+        from . import barcode_index
+
+        seen = {barcode_index.get_version('8902')}
+        for _ in range(5):
+            barcode_index.bump_versions(['8902'])
+            seen.add(barcode_index.get_version('8902'))
+        # A token lost from the cache is replaced, never reissued
+        cache.delete(barcode_index.version_key('8902'))
+        seen.add(barcode_index.get_version('8902'))
+        self.assertEqual(len(seen), 7)
+
+    def test_benchmark_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        make_stock(barcode='8904', qty_available=50)
+        out = StringIO()
+        call_command('bench_barcode_scan', '--scans', '50', stdout=out)
+        lines = dict(line.split(':', 1) for line in out.getvalue().strip().splitlines())
+        self.assertIn('1.00 queries/scan', lines['database'.rjust(8)])
+        self.assertIn('0.00 queries/scan', lines['index'.rjust(8)])
+
+
+class MedicineCatalogTests(TestCase):
+    def test_refresh_tolerates_a_concurrent_insert_of_the_same_name(self):
+        from unittest import mock
+        from . import catalog
+        from .models import MedicineCatalog, MedicineCatalogToken
+
+        stock = make_stock(name='Zinc Sulphate', qty_available=100)
+        PharmacyStock.objects.filter(pk=stock.pk).update(qty_available=70)
+
+        # The first lookup misses the row, as if another worker inserted it after we looked
+        real_filter = MedicineCatalog.objects.filter
+        lookups = []
+
+        def stale_filter(*args, **kwargs):
+            lookups.append(kwargs)
+            if len(lookups) == 1:
+                return MedicineCatalog.objects.none()
+            return real_filter(*args, **kwargs)
+
+        with mock.patch.object(MedicineCatalog.objects, 'filter', side_effect=stale_filter):
+            catalog.refresh({'Zinc Sulphate'})
+
+        row = MedicineCatalog.objects.get(name='Zinc Sulphate')
+        self.assertEqual(row.total_qty, 70)
+        self.assertEqual(sorted(MedicineCatalogToken.objects.values_list('token', flat=True)), ['sulphate', 'zinc'])
+
+    def test_search_by_word_prefixes(self):
+        from . import catalog
+
+        make_stock(name='Zinc Sulphate', batch_no='Z1')
+        make_stock(name='Zincovit Syrup', batch_no='Z2', qty_available=0)
+        make_stock(name='Vitamin C', batch_no='V1')
+        self.assertEqual([row.name for row in catalog.search('zinc')], ['Zinc Sulphate', 'Zincovit Syrup'])
+        self.assertEqual([row.name for row in catalog.search('syr zinc')], ['Zincovit Syrup'])
+        self.assertEqual([row.name for row in catalog.search('zinc', in_stock=True)], ['Zinc Sulphate'])
+
+    def test_keystroke_queries_do_not_grow_with_batches(self):
+        from . import catalog
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('pharmacist', password='x', role='PHARMACY'))
+
+        def keystroke_queries():
+            counts = []
+            for url in ('/api/pharmacy/stock/doctor-search/', '/api/pharmacy/stock/'):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url, {'search': 'zinc sul'})
+                self.assertEqual(response.status_code, 200)
+                counts.append(len(queries))
+            return counts
+
+        make_stock(name='Zinc Sulphate', batch_no='Z0')
+        few = keystroke_queries()
+        PharmacyStock.objects.bulk_create([
+            PharmacyStock(name=name, batch_no=f'Z{n}', expiry_date=date.today() + timedelta(days=100 + n),
+                          mrp=10, selling_price=10, qty_available=10)
+            for n in range(1, 40) for name in ('Zinc Sulphate', 'Zincovit Syrup', 'Vitamin C')
+        ])
+        catalog.rebuild()
+        # Doctor search reads only the catalog; the stock list is the count plus one page
+        self.assertEqual(few, [1, 2])
+        self.assertEqual(keystroke_queries(), few)
+
+
+class DispenseTests(TestCase):
+    """Whole-prescription sales split across batches, nearest expiry first."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pharmacist', password='x', role='PHARMACY')
+        today = date.today()
+        amoxicillin = {'name': 'Amoxicillin 500mg', 'barcode': '8905'}
+        cls.far = make_stock(batch_no='A-FAR', expiry_date=today + timedelta(days=365), qty_available=40, **amoxicillin)
+        cls.near = make_stock(batch_no='A-NEAR', expiry_date=today + timedelta(days=60), qty_available=20, **amoxicillin)
+        cls.expired = make_stock(batch_no='A-OLD', expiry_date=today - timedelta(days=1), qty_available=100, **amoxicillin)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def dispense(self, *lines):
+        return self.client.post('/api/pharmacy/sales/dispense/', {
+            'payment_status': 'PENDING',
+            'lines': [{'item': item, 'qty': qty} for item, qty in lines],
+        }, format='json')
+
+    def sold(self, sale_id):
+        return sorted(PharmacySaleItem.objects.filter(sale_id=sale_id).values_list('med_stock__batch_no', 'qty'))
+
+    def stock_left(self):
+        return dict(PharmacyStock.objects.values_list('batch_no', 'qty_available'))
+
+    def test_splits_a_line_across_batches_nearest_expiry_first(self):
+        response = self.dispense(('Amoxicillin 500mg', 35))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.sold(response.data['sale_id']), [('A-FAR', 15), ('A-NEAR', 20)])
+        self.assertEqual(self.stock_left(), {'A-NEAR': 0, 'A-FAR': 25, 'A-OLD': 100})
+
+    def test_barcode_line_shares_batches_with_a_name_line(self):
+        response = self.dispense(('Amoxicillin 500mg', 10), ('8905', 15))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.sold(response.data['sale_id']), [('A-FAR', 5), ('A-NEAR', 10), ('A-NEAR', 10)])
+        self.assertEqual(self.stock_left(), {'A-NEAR': 0, 'A-FAR': 35, 'A-OLD': 100})
+
+    def test_shortfall_sells_nothing(self):
+        response = self.dispense(('Amoxicillin 500mg', 10), ('8905', 60))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            [(line['item'], line['shortfall'], [(b['batch_no'], b['qty']) for b in line['batches']])
+             for line in response.data['lines']],
+            [('Amoxicillin 500mg', 0, [('A-NEAR', 10)]), ('8905', 10, [('A-NEAR', 10), ('A-FAR', 40)])],
+        )
+        self.assertFalse(PharmacySale.objects.exists())
+        self.assertEqual(self.stock_left(), {'A-NEAR': 20, 'A-FAR': 40, 'A-OLD': 100})
+
+
+@tag('threaded')
+class ConcurrentStockTests(TransactionTestCase):
+    """Parallel sales of one batch: no oversell, no negative stock, no lost decrements."""
+
+    THREADS = 20
+
+    def run_in_threads(self, target, count):
+        barrier = threading.Barrier(count)
+        results, errors = [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(target())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_deduct_never_oversells(self):
+        from .stock import InsufficientStock, deduct
+
+        stock = make_stock(qty_available=100)
+
+        def sell():
+            try:
+                deduct({stock.pk: 7})
+                return True
+            except InsufficientStock:
+                return False
+
+        results, errors = self.run_in_threads(sell, self.THREADS)
+        self.assertEqual(errors, [])
+        stock.refresh_from_db()
+        # 14 sales of 7 fit in 100; the rest are refused, none partially applied
+        self.assertEqual(results.count(True), 14)
+        self.assertEqual(stock.qty_available, 100 - 14 * 7)
+
+    def test_deduct_available_loses_no_updates(self):
+        from .stock import deduct_available
+
+        stock = make_stock(qty_available=100)
+        results, errors = self.run_in_threads(lambda: deduct_available([(stock.pk, 3)])[0][1], self.THREADS)
+        self.assertEqual(errors, [])
+        stock.refresh_from_db()
+        self.assertEqual(sum(results), 60)
+        self.assertEqual(stock.qty_available, 40)
+
+    def test_deduct_available_stops_at_zero(self):
+        from .stock import deduct_available
+
+        stock = make_stock(qty_available=50)
+        results, errors = self.run_in_threads(lambda: deduct_available([(stock.pk, 4)])[0][1], self.THREADS)
+        self.assertEqual(errors, [])
+        stock.refresh_from_db()
+        self.assertEqual(stock.qty_available, 0)
+        self.assertEqual(sum(results), 50)
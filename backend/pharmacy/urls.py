@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SupplierViewSet, PharmacyStockViewSet, PurchaseInvoiceViewSet, PharmacySaleViewSet, PharmacyBulkUploadView, PharmacyQueueViewSet
+from .views import SupplierViewSet, PharmacyStockViewSet, PurchaseInvoiceViewSet, PharmacySaleViewSet, PharmacyBulkUploadView, PharmacyQueueViewSet, BulkUploadJobViewSet
 
 router = DefaultRouter()
 router.register(r'suppliers', SupplierViewSet, basename='suppliers')
@@ -8,6 +8,7 @@ router.register(r'stock', PharmacyStockViewSet, basename='stock')
 router.register(r'purchases', PurchaseInvoiceViewSet, basename='purchases')
 router.register(r'sales', PharmacySaleViewSet, basename='sales')
 router.register(r'queue', PharmacyQueueViewSet, basename='queue')
+router.register(r'upload-jobs', BulkUploadJobViewSet, basename='upload-jobs')
 
 urlpatterns = [
     path('bulk-upload/', PharmacyBulkUploadView.as_view(), name='pharmacy-bulk-upload'),
@@ -1,20 +1,20 @@
 import csv
 import io
-from datetime import datetime
 from django.db import transaction, models
 from django.db.models import Q
-from rest_framework import viewsets, permissions, filters, status
+from rest_framework import viewsets, mixins, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser
 
-from .models import Supplier, PharmacyStock, PurchaseInvoice, PurchaseItem, PharmacySale
+from .models import Supplier, PharmacyStock, PurchaseInvoice, PharmacySale, BulkUploadJob
+from .bulk_upload import iter_supplier_rows, create_invoice, ingest_items, finalize_invoice, start_upload_job
 from patients.models import Visit
 from patients.serializers import VisitSerializer
 from .serializers import (
     SupplierSerializer, PharmacyStockSerializer,
-    PurchaseInvoiceSerializer, PharmacySaleSerializer
+    PurchaseInvoiceSerializer, PharmacySaleSerializer, BulkUploadJobSerializer
 )
 
 
@@ -25,6 +25,55 @@ class IsPharmacyOrAdmin(permissions.BasePermission):
         return request.user.is_superuser or getattr(request.user, "role", None) in ["PHARMACY", "ADMIN", "DOCTOR", "RECEPTION"]
 
 
+def parse_lines(data):
+    """
+    [{"item": name or barcode, "qty": n}] from an allocation/dispense request.
+    Returns (lines, errors) where lines is [(item, qty, line)].
+    """
+    lines, errors = [], {}
+    raw = data.get('lines')
+    if not isinstance(raw, list) or not raw:
+        return [], {'lines': ["A non-empty list of lines is required."]}
+    for i, line in enumerate(raw):
+        if not isinstance(line, dict):
+            errors[str(i)] = ["Expected an object."]
+            continue
+        item = str(line.get('item') or '').strip()
+        try:
+            qty = int(line.get('qty') or 0)
+        except (ValueError, TypeError):
+            qty = 0
+        if not item:
+            errors[str(i)] = ["item (medicine name or barcode) is required."]
+        elif qty <= 0:
+            errors[str(i)] = ["Quantity must be greater than 0."]
+        else:
+            lines.append((item, qty, line))
+    return lines, ({'lines': errors} if errors else {})
+
+
+def unit_price(stock):
+    # Per-tablet price from strip selling price, to the paisa
+    return round(stock.selling_price / stock.tablets_per_strip, 2)
+
+
+def plan_data(plan):
+    return [{
+        'item': line['item'],
+        'qty': line['qty'],
+        'shortfall': line['shortfall'],
+        'batches': [{
+            'med_stock': stock.id,
+            'name': stock.name,
+            'batch_no': stock.batch_no,
+            'barcode': stock.barcode,
+            'expiry_date': stock.expiry_date,
+            'qty': qty,
+            'unit_price': unit_price(stock),
+        } for stock, qty in line['allocations']],
+    } for line in plan]
+
+
 class PharmacyBulkUploadView(APIView):
     permission_classes = [IsPharmacyOrAdmin]
     parser_classes = [MultiPartParser]
@@ -43,194 +92,24 @@ class PharmacyBulkUploadView(APIView):
             supplier, _ = Supplier.objects.get_or_create(supplier_name=supplier_name.strip())
             
             decoded_file = file_obj.read().decode('utf-8')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.reader(io_string)
+            reader = csv.reader(io.StringIO(decoded_file))
+
+            # Parse everything first, grouping T lines under the H line they follow
+            invoices = []
+            for line_type, data, _ in iter_supplier_rows(reader):
+                if line_type == 'H':
+                    invoices.append((data, []))
+                else:
+                    invoices[-1][1].append(data)
 
             invoice = None
-            headers = []
             items_created = 0
-
-            for row in reader:
-                if not row: continue
-                line_type = row[0].strip().upper()
-
-                if line_type == 'H':
-                    # Parse H line
-                    # H,MediWMS,1.0,InvNo,Date,,,Type,CreditDays,...
-                    inv_no = row[3] if len(row) > 3 else "Unknown"
-                    inv_date_str = row[4] if len(row) > 4 else ""
-                    p_type = row[7].upper() if len(row) > 7 else "CASH"
-                    c_days = 0
-                    try: 
-                        c_days = int(row[8]) if len(row) > 8 and row[8] else 0
-                    except: pass
-
-                    # Convert date dd/mm/yyyy to yyyy-mm-dd
-                    try:
-                        inv_date = datetime.strptime(inv_date_str, '%d/%m/%Y').date()
-                    except:
-                        inv_date = datetime.now().date()
-
-                    invoice = PurchaseInvoice.objects.create(
-                        supplier=supplier,
-                        supplier_invoice_no=inv_no,
-                        invoice_date=inv_date,
-                        credit_days=c_days,
-                        purchase_type='CREDIT' if 'CREDIT' in p_type else 'CASH',
-                        total_amount=0, # Will update later
-                        created_by=request.user
-                    )
-
-                elif line_type == 'TH':
-                    headers = [h.strip() for h in row]
-
-                elif line_type == 'T':
-                    if not invoice or not headers: continue
-                    
-                    # Process rows
-                    # Normalize keys (strip whitespace, etc)
-                    # Create a dictionary from headers and row, then normalize keys
-                    raw_data = dict(zip(headers, row))
-                    data = {k.strip(): v for k, v in raw_data.items() if k}
-                    
-                    # Helper to find key case-insensitively
-                    def get_val(keys_list, default=''):
-                        for k in data.keys():
-                            if k.lower() in [x.lower() for x in keys_list]:
-                                return data[k]
-                        return default
-
-                    p_name = get_val(['Product Name', 'Item Name', 'Particulars'], 'Unknown')
-                    batch = get_val(['Batch', 'Batch No'], 'N/A')
-                    exp_str = get_val(['Expiry', 'Exp', 'Exp Date'], '')
-                    
-                    qty_val = get_val(['Qty', 'Quantity'], 0)
-                    try: qty = float(qty_val)
-                    except: qty = 0
-                    
-                    free_val = get_val(['Free', 'Free Qty'], 0)
-                    try: free = float(free_val)
-                    except: free = 0
-                    
-                    rate_val = get_val(['Rate', 'Price'], 0)
-                    try: rate = float(rate_val)
-                    except: rate = 0
-                    
-                    ptr_val = get_val(['PTR', 'Purchase Rate'], 0)
-                    try: ptr = float(ptr_val)
-                    except: ptr = 0
-                    
-                    mrp_val = get_val(['MRP'], 0)
-                    try: mrp = float(mrp_val)
-                    except: mrp = 0
-
-                    if qty and qty > 0:
-                        # Logic removed: CSV contains UNIT rates, not total amounts.
-                        # rate = round(rate / qty, 2)
-                        # mrp = round(mrp / qty, 2)
-                        # if ptr > 0: ptr = round(ptr / qty, 2)
-                        pass
-
-                    
-                    hsn = get_val(['HSN', 'HSN Code'], '')
-                    manufacturer = get_val(['Manufacturer Name', 'Manufacturer.Name', 'Mfr Name', 'Mfr'], '')
-                    barcode = get_val(['Product Code', 'Barcode', 'Code'], '')
-                    
-                    # New: Tablets per strip
-                    strip_size_val = get_val(['Packing', 'ItemPerPack', 'Strip Size', 'Tablets per Strip', 'TPS', 'Unit'], 1)
-                    try:
-                        # Extract number from packing like "10S" or "10 Tablets"
-                        import re
-                        match = re.search(r'(\d+)', str(strip_size_val))
-                        tps = int(match.group(1)) if match else 1
-                    except:
-                        tps = 1
-
-                    # Parse Expiry (mm/yyyy)
-                    try:
-                        # Assuming end of month or 1st of month
-                        exp_date = datetime.strptime(exp_str, '%m/%Y').date()
-                    except:
-                        exp_date = None
-
-                    # Create PurchaseItem
-                    PurchaseItem.objects.create(
-                        purchase=invoice,
-                        product_name=p_name,
-                        barcode=barcode,
-                        batch_no=batch,
-                        expiry_date=exp_date,
-                        qty=qty,
-                        free_qty=free,
-                        purchase_rate=rate,
-                        mrp=mrp,
-                        ptr=ptr,
-                        manufacturer=manufacturer,
-                        hsn=hsn,
-                        tablets_per_strip=tps
-                    )
-
-                    # Update/Create Stock
-                    # User clarified that both 'Qty' and 'Free' are strips
-                    total_qty_in = (qty + free) * tps
-                    
-                    # Try to parse GST if available in common headers
-                    gst_val = 0
-                    for key in ['GST', 'GST%', 'Tax', 'Tax %', 'IGST', 'TaxPerc']:
-                        if key in data and data[key]:
-                            try:
-                                val_str = str(data[key]).replace('%', '').strip()
-                                gst_val = float(val_str)
-                                break
-                            except: pass
-
-                    # Calculate Selling Price
-                    # User confirmed "mrp price is sale price" (Selling at MRP)
-                    calculated_selling_price = mrp
-
-                    stock, created = PharmacyStock.objects.get_or_create(
-                        name=p_name,
-                        batch_no=batch,
-                        expiry_date=exp_date,
-                        supplier=supplier,
-                        defaults={
-                            'barcode': barcode,
-                            'mrp': mrp,
-                            'selling_price': calculated_selling_price,
-                            'purchase_rate': rate,
-                            'qty_available': total_qty_in,
-                            'tablets_per_strip': tps,
-                            'manufacturer': manufacturer,
-                            'hsn': hsn,
-                            'gst_percent': gst_val
-                        }
-                    )
-                    if not created:
-                        stock.qty_available += total_qty_in
-                        # Update metadata fields if they are better/newer
-                        stock.mrp = mrp
-                        stock.gst_percent = gst_val
-                        stock.selling_price = calculated_selling_price
-                        stock.purchase_rate = rate
-                        stock.tablets_per_strip = tps
-                        if manufacturer: stock.manufacturer = manufacturer
-                        if hsn: stock.hsn = hsn
-                        stock.save()
-
-                    items_created += 1
-
-                elif line_type == 'F':
-                    # Parse final amount from footer if needed, or calculate from T lines
-                    # For now, let's just sum T line amounts (Rate * Qty)
-                    pass
-
-            if invoice:
-                # Recalculate total amount from items
-                total_inv = PurchaseItem.objects.filter(purchase=invoice).aggregate(
-                    total=models.Sum(models.F('purchase_rate') * models.F('qty'))
-                )['total'] or 0
-                invoice.total_amount = total_inv
-                invoice.save()
+            # Inner atomic so a failing batch rolls back even though the error is caught below
+            with transaction.atomic():
+                for header, items in invoices:
+                    invoice = create_invoice(supplier, header, request.user)
+                    items_created += ingest_items(invoice, supplier, items)
+                    finalize_invoice(invoice)
 
             return Response({
                 "message": "Bulk upload successful",
@@ -242,6 +121,34 @@ class PharmacyBulkUploadView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class BulkUploadJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Background variant of PharmacyBulkUploadView for large files.
+    POST (multipart: file, supplier_name) stores the file and returns the job id immediately;
+    GET /<job_id>/ returns progress, which is also pushed as 'bulk_upload_progress' over Socket.IO.
+    """
+    queryset = BulkUploadJob.objects.all().order_by('-created_at')
+    serializer_class = BulkUploadJobSerializer
+    permission_classes = [IsPharmacyOrAdmin]
+    parser_classes = [MultiPartParser]
+
+    def get_queryset(self):
+        # Admins see every upload; everyone else only their own
+        user = self.request.user
+        if user.is_superuser or user.role == 'ADMIN':
+            return self.queryset
+        return self.queryset.filter(created_by=user)
+
+    def perform_create(self, serializer):
+        job = serializer.save(created_by=self.request.user)
+        start_upload_job(job)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+
 class SupplierViewSet(viewsets.ModelViewSet):
     queryset = Supplier.objects.all().order_by('-created_at')
     serializer_class = SupplierSerializer
@@ -254,16 +161,18 @@ class SupplierViewSet(viewsets.ModelViewSet):
 class PharmacyStockViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = PharmacyStockSerializer
     permission_classes = [IsPharmacyOrAdmin]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'barcode', 'batch_no', 'supplier__supplier_name']
+    filter_backends = [filters.OrderingFilter]
     ordering_fields = ['expiry_date', 'qty_available', 'updated_at', 'supplier__supplier_name']
     ordering = ['expiry_date']
 
     def get_queryset(self):
+        from .catalog import filter_stock
         qs = PharmacyStock.objects.filter(is_deleted=False)
         supplier_id = self.request.query_params.get('supplier')
         if supplier_id:
             qs = qs.filter(supplier_id=supplier_id)
+        # ?search= matches name words (medicine catalog), barcode, batch or supplier prefix
+        qs = filter_stock(qs, self.request.query_params.get('search'))
         return qs.order_by('expiry_date')
 
     @action(detail=False, methods=['get'], url_path='low-stock')
@@ -297,12 +206,9 @@ class PharmacyStockViewSet(viewsets.ReadOnlyModelViewSet):
         if qty <= 0:
             return Response({"qty": ["Quantity must be greater than 0."]}, status=status.HTTP_400_BAD_REQUEST)
 
-        stock = (
-            self.get_queryset()
-            .filter(barcode=barcode, qty_available__gte=qty)
-            .order_by('expiry_date')
-            .first()
-        )
+        # In-memory FEFO index; only touches the database on a miss or after a stock write
+        from .barcode_index import find_batch
+        stock = find_batch(barcode, qty)
 
         if not stock:
             return Response(
@@ -310,7 +216,21 @@ class PharmacyStockViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        return Response(self.get_serializer(stock).data, status=status.HTTP_200_OK)
+        return Response(stock, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='allocate')
+    def allocate(self, request):
+        """
+        Multi-batch FEFO split for a whole prescription (nothing is deducted):
+        Input: { "lines": [ { "item": "name or barcode", "qty": 30 }, ... ] }
+        Output: per line, the batches to take from (nearest expiry first) and any shortfall.
+        """
+        lines, errors = parse_lines(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        from .stock import allocate
+        return Response(plan_data(allocate([(item, qty) for item, qty, _ in lines])))
 
     @action(detail=False, methods=['get'], url_path='doctor-search')
     def doctor_search(self, request):
@@ -322,22 +242,16 @@ class PharmacyStockViewSet(viewsets.ReadOnlyModelViewSet):
         if len(query) < 2:
             return Response([])
 
-        from django.db.models import Sum
-        qs = (
-            PharmacyStock.objects
-            .filter(is_deleted=False, name__icontains=query)
-            .values('name')
-            .annotate(total_qty=Sum('qty_available'))
-            .order_by('name')
-        )
-
+        # Precomputed per-medicine totals, matched by word prefix (see pharmacy.catalog)
+        from .catalog import search
         results = []
-        for item in qs:
+        for item in search(query):
             results.append({
                 # Use name as ID to unique key it in frontend lists
-                'id': item['name'],
-                'name': item['name'],
-                'qty_available': item['total_qty'] or 0
+                'id': item.name,
+                'name': item.name,
+                'qty_available': item.total_qty,
+                'nearest_expiry': item.nearest_expiry
             })
         
         return Response(results)
@@ -368,6 +282,43 @@ class PharmacySaleViewSet(viewsets.ModelViewSet):
         ctx["request"] = self.request
         return ctx
 
+    @action(detail=False, methods=['post'], url_path='dispense')
+    def dispense(self, request):
+        """
+        Sells a whole prescription in one request, split across batches by nearest expiry:
+        Input: { "patient": id, "visit": id, "lines": [ { "item": "name or barcode", "qty": 30 }, ... ] }
+        A line may carry its own "unit_price" and "gst_percent". Nothing is sold if any line is short.
+        """
+        lines, errors = parse_lines(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        from .stock import allocate
+        plan = allocate([(item, qty) for item, qty, _ in lines])
+        if any(line['shortfall'] for line in plan):
+            return Response(
+                {"detail": "Insufficient stock for some lines.", "lines": plan_data(plan)},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        items = []
+        for (item, qty, line), allocated in zip(lines, plan):
+            for stock, taken in allocated['allocations']:
+                items.append({
+                    'med_stock': stock.id,
+                    'qty': taken,
+                    'unit_price': line.get('unit_price') or unit_price(stock),
+                    'gst_percent': line.get('gst_percent', stock.gst_percent),
+                })
+
+        data = {k: v for k, v in request.data.items() if k != 'lines'}
+        data['items'] = items
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        # Decrements all batches in one conditional UPDATE; a batch sold meanwhile fails the whole sale
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['get'], url_path='pending_by_patient')
     def pending_by_patient(self, request):
         patient_id = request.query_params.get('patient_id')
@@ -409,10 +360,11 @@ class PharmacyQueueViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         # Visits assigned to PHARMACY
         # OR assigned to LAB but have a prescription in doctor_note
-        return Visit.objects.filter(
+        qs = Visit.objects.filter(
             Q(assigned_role='PHARMACY') | 
             (Q(assigned_role='LAB') & ~Q(doctor_note__prescription={}) & Q(doctor_note__prescription__isnull=False))
         ).exclude(status='CLOSED').order_by('updated_at')
+        return VisitSerializer.setup_eager_loading(qs)
 
     @action(detail=True, methods=['post'])
     def dispense(self, request, pk=None):
@@ -1,3 +1,7 @@
 from django.contrib import admin
+from .models import DailyRevenueRollup
 
-# Register your models here.
+@admin.register(DailyRevenueRollup)
+class DailyRevenueRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'department', 'amount', 'count')
+    list_filter = ('department',)
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reports.rollup import rebuild, check
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds (or with --check, verifies) the DailyRevenueRollup table for a date range.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day (YYYY-MM-DD). Defaults to 30 days ago.')
+        parser.add_argument('--end', help='Last day (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--check', action='store_true', help='Only compare rollup against raw tables.')
+
+    def parse_date(self, value, default):
+        if not value:
+            return default
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = self.parse_date(options['start'], today - timedelta(days=30))
+        end = self.parse_date(options['end'], today)
+        if start > end:
+            raise CommandError("--start must be before --end.")
+
+        if options['check']:
+            mismatches = check(start, end)
+            for date, department, stored, raw in mismatches:
+                self.stdout.write(
+                    f"{date} {department}: rollup={stored[0]} ({stored[1]} rows), raw={raw[0]} ({raw[1]} rows)"
+                )
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} rollup rows differ from raw tables.")
+            self.stdout.write(self.style.SUCCESS(f"Rollup consistent for {start} to {end}."))
+            return
+
+        count = rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup rows for {start} to {end}."))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:17
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenueRollup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('date', models.DateField()),
+                ('department', models.CharField(choices=[('BILLING', 'Billing'), ('PHARMACY', 'Pharmacy'), ('LAB', 'Lab')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'department'), name='unique_rollup_date_department')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import Sum, Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    """
+    Fills DailyRevenueRollup for all history (same aggregation as reports.rollup.rebuild),
+    so dashboards and profit analytics see past days without a manual rebuild.
+    """
+    DailyRevenueRollup = apps.get_model('reports', 'DailyRevenueRollup')
+    sources = [
+        ('BILLING', apps.get_model('billing', 'Invoice'), 'total_amount', {'payment_status': 'PAID'}),
+        ('PHARMACY', apps.get_model('pharmacy', 'PharmacySale'), 'total_amount', {}),
+        ('LAB', apps.get_model('lab', 'LabCharge'), 'amount', {}),
+    ]
+
+    DailyRevenueRollup.objects.all().delete()
+    rows = []
+    for department, model, field, filters in sources:
+        totals = (
+            model.objects.filter(created_at__isnull=False, **filters)
+            .annotate(day=TruncDate('created_at'))
+            .values('day')
+            .annotate(total=Sum(field), num=Count('id'))
+            .order_by()
+        )
+        rows.extend(
+            DailyRevenueRollup(date=row['day'], department=department, amount=row['total'] or 0, count=row['num'])
+            for row in totals
+        )
+    DailyRevenueRollup.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_initial'),
+        ('billing', '0007_invoice_gst_amount'),
+        ('pharmacy', '0014_stock_batch_idx'),
+        ('lab', '0013_labcharge_labcharge_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,30 @@
 from django.db import models
+from core.models import BaseModel
 
-# Create your models here.
+
+class DailyRevenueRollup(BaseModel):
+    """
+    Pre-aggregated revenue per (day, department), maintained by reports.signals.
+    BILLING = paid invoices, PHARMACY = pharmacy sales, LAB = lab charges.
+    """
+    DEPARTMENT_CHOICES = (
+        ('BILLING', 'Billing'),
+        ('PHARMACY', 'Pharmacy'),
+        ('LAB', 'Lab'),
+    )
+
+    date = models.DateField()
+    department = models.CharField(max_length=20, choices=DEPARTMENT_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'department'],
+                name='unique_rollup_date_department'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.department}: {self.amount}"
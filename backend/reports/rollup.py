@@ -0,0 +1,138 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyRevenueRollup
+
+
+def get_sources():
+    """
+    (department, model, amount field, extra filter) for every table that feeds the rollup.
+    Imported lazily because billing/pharmacy/lab all import patients, which is loaded first.
+    """
+    from billing.models import Invoice
+    from pharmacy.models import PharmacySale
+    from lab.models import LabCharge
+    return [
+        ('BILLING', Invoice, 'total_amount', {'payment_status': 'PAID'}),
+        ('PHARMACY', PharmacySale, 'total_amount', {}),
+        ('LAB', LabCharge, 'amount', {}),
+    ]
+
+
+def get_contribution(instance):
+    """
+    What a single row adds to the rollup: (date, department, amount, count) or None.
+    """
+    for department, model, field, filters in get_sources():
+        if isinstance(instance, model):
+            if instance.created_at is None:
+                return None
+            for attr, value in filters.items():
+                if getattr(instance, attr) != value:
+                    return None
+            amount = Decimal(str(getattr(instance, field) or 0))
+            return (timezone.localdate(instance.created_at), department, amount, 1)
+    return None
+
+
+def apply_delta(date, department, amount, count):
+    if not amount and not count:
+        return
+    with transaction.atomic():
+        rollup, created = DailyRevenueRollup.objects.get_or_create(
+            date=date,
+            department=department,
+            defaults={'amount': amount, 'count': count}
+        )
+        if not created:
+            DailyRevenueRollup.objects.filter(pk=rollup.pk).update(
+                amount=F('amount') + amount,
+                count=F('count') + count
+            )
+
+
+def apply_change(old, new):
+    """
+    Moves a row's contribution from `old` to `new` (either may be None).
+    """
+    if old == new:
+        return
+    if old:
+        date, department, amount, count = old
+        apply_delta(date, department, -amount, -count)
+    if new:
+        apply_delta(*new)
+
+
+def aggregate_raw(start_date, end_date):
+    """
+    Recomputes {(date, department): (amount, count)} straight from the source tables.
+    """
+    from revive_cms.utils import day_bounds
+
+    start, end = day_bounds(start_date, end_date)
+    totals = {}
+    for department, model, field, filters in get_sources():
+        rows = (
+            model.objects.filter(
+                created_at__gte=start,
+                created_at__lt=end,
+                **filters
+            )
+            .annotate(day=TruncDate('created_at'))
+            .values('day')
+            .annotate(total=Sum(field), num=Count('id'))
+        )
+        for row in rows:
+            totals[(row['day'], department)] = (row['total'] or Decimal('0'), row['num'])
+    return totals
+
+
+@transaction.atomic
+def rebuild(start_date, end_date):
+    """
+    Replaces the rollup rows in [start_date, end_date] with freshly aggregated ones.
+    """
+    DailyRevenueRollup.objects.filter(date__gte=start_date, date__lte=end_date).delete()
+    rows = [
+        DailyRevenueRollup(date=date, department=department, amount=amount, count=count)
+        for (date, department), (amount, count) in aggregate_raw(start_date, end_date).items()
+    ]
+    DailyRevenueRollup.objects.bulk_create(rows)
+    return len(rows)
+
+
+def check(start_date, end_date):
+    """
+    Compares the rollup against the source tables.
+    Returns a list of (date, department, rollup (amount, count), raw (amount, count)) mismatches.
+    """
+    raw = aggregate_raw(start_date, end_date)
+    stored = {
+        (r.date, r.department): (r.amount, r.count)
+        for r in DailyRevenueRollup.objects.filter(date__gte=start_date, date__lte=end_date)
+    }
+    empty = (Decimal('0'), 0)
+    mismatches = []
+    for key in sorted(set(raw) | set(stored)):
+        if raw.get(key, empty) != stored.get(key, empty):
+            mismatches.append((key[0], key[1], stored.get(key, empty), raw.get(key, empty)))
+    return mismatches
+
+
+def get_totals(start_date, end_date):
+    """
+    {date: {department: amount}} read from the rollup for a date window.
+    """
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    rows = DailyRevenueRollup.objects.filter(
+        date__gte=start_date, date__lte=end_date
+    ).values_list('date', 'department', 'amount')
+    for date, department, amount in rows:
+        totals[date][department] += amount
+    return totals
@@ -0,0 +1,40 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from billing.models import Invoice
+from pharmacy.models import PharmacySale
+from lab.models import LabCharge
+from .rollup import get_contribution, apply_change
+
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_save, sender=PharmacySale)
+@receiver(pre_save, sender=LabCharge)
+def remember_rollup_contribution(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Keep what the stored row currently contributes so post_save only applies the delta
+    old = None
+    if not instance._state.adding:
+        previous = sender.objects.filter(pk=instance.pk).first()
+        if previous:
+            old = get_contribution(previous)
+    instance._rollup_old = old
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=PharmacySale)
+@receiver(post_save, sender=LabCharge)
+def update_revenue_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new = get_contribution(instance)
+    apply_change(getattr(instance, '_rollup_old', None), new)
+    instance._rollup_old = new
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=PharmacySale)
+@receiver(post_delete, sender=LabCharge)
+def remove_from_revenue_rollup(sender, instance, **kwargs):
+    apply_change(get_contribution(instance), None)
@@ -1,3 +1,181 @@
+import csv
+import io
+from unittest import skipUnless
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from billing.models import Invoice
+from patients.models import Patient, Visit
+from revive_cms.utils import day_bounds
+from users.models import User
+
+
+# Four revenue and expense aggregates for the report window, then one query for the rows
+FINANCIAL_EXPORT_QUERIES = 5
+
+
+def read_csv(response):
+    return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+
+class ReportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('admin', password='x', role='ADMIN')
+        cls.doctor = User.objects.create_user('doctor', password='x', role='DOCTOR')
+        cls.visits = [
+            Visit.objects.create(
+                patient=Patient.objects.create(full_name=f'Patient {n}', age=40, gender='M', phone=f'91000{n:05d}', address='-'),
+                doctor=cls.doctor if n % 2 else None,
+            )
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate().isoformat()
+
+
+class CSVExportTests(ReportTestCase):
+    def test_opd_export_streams_rows(self):
+        response = self.client.get('/api/reports/opd/', {'export': 'csv', 'start_date': self.today, 'end_date': self.today})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="opd_report.csv"')
+
+        rows = read_csv(response)
+        self.assertEqual(rows[0], ['Visit ID', 'Patient', 'Doctor', 'Status', 'Date'])
+        self.assertEqual(sorted(row[0] for row in rows[1:]), sorted(str(visit.pk) for visit in self.visits))
+        self.assertEqual(sorted(row[2] for row in rows[1:]), ['N/A', 'N/A', 'doctor'])
+
+    def export_queries(self, url):
+        # Rows are read while the body streams, so the queries are counted through the last chunk
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'export': 'csv', 'start_date': self.today, 'end_date': self.today})
+            rows = read_csv(response)
+        return len(queries), len(rows) - 1
+
+    def test_export_queries_do_not_grow_with_rows(self):
+        from unittest import mock
+
+        for n in range(3, 40):
+            patient = Patient.objects.create(full_name=f'Patient {n}', age=40, gender='M', phone=f'91000{n:05d}', address='-')
+            Invoice.objects.create(visit=Visit.objects.create(patient=patient), total_amount=100, payment_status='PAID')
+
+        # Several chunks per export: chunking must not turn into a query per chunk or per row
+        with mock.patch('revive_cms.utils.EXPORT_CHUNK_SIZE', 4):
+            self.assertEqual(self.export_queries('/api/reports/opd/'), (1, 40))
+            self.assertEqual(self.export_queries('/api/reports/financial/'), (FINANCIAL_EXPORT_QUERIES, 37))
+
+
+class DateRangeFilterTests(ReportTestCase):
+    """Report windows filter on half-open created_at bounds, which the created_at indexes can serve."""
+
+    def test_reports_do_not_cast_created_at_to_date(self):
+        for url in ['/api/reports/opd/', '/api/reports/financial/', '/api/reports/lab/', '/api/reports/pharmacy/']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'start_date': self.today, 'end_date': self.today})
+            self.assertEqual(response.status_code, 200, url)
+            for query in queries:
+                sql = query['sql'].lower()
+                self.assertNotIn('cast_date', sql, url)
+                self.assertNotIn('date("', sql, url)
+
+    def test_opd_window_counts_todays_visits(self):
+        response = self.client.get('/api/reports/opd/', {'start_date': self.today, 'end_date': self.today})
+        self.assertEqual(len(response.data['details']), len(self.visits))
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads SQLite EXPLAIN QUERY PLAN output')
+    def test_date_range_uses_created_at_index(self):
+        start, end = day_bounds(self.today, self.today)
+        plan = Visit.objects.filter(created_at__gte=start, created_at__lt=end).explain()
+        self.assertIn('USING INDEX visit_created_idx', plan)
+        plan = Invoice.objects.filter(created_at__gte=start, created_at__lt=end, payment_status='PAID').explain()
+        self.assertIn('USING INDEX invoice_status_created_idx', plan)
+
+
+class RevenueRollupTests(ReportTestCase):
+    """After every write the rollup must equal a fresh aggregate of the source tables."""
+
+    def assertRollupMatchesRaw(self):
+        from .rollup import aggregate_raw, check
+
+        today = timezone.localdate()
+        self.assertEqual(check(today, today), [])
+        return {department: totals for (day, department), totals in aggregate_raw(today, today).items()}
+
+    def test_invoice_create_update_paid_and_delete(self):
+        from decimal import Decimal
+        from billing.models import InvoiceItem
+        from billing.totals import add_items
+
+        invoice = Invoice.objects.create(visit=self.visits[0], total_amount=500)
+        self.assertNotIn('BILLING', self.assertRollupMatchesRaw())
+
+        invoice.payment_status = 'PAID'
+        invoice.save()
+        self.assertEqual(self.assertRollupMatchesRaw()['BILLING'], (Decimal('500.00'), 1))
+
+        # Items added to a paid invoice move its total with an UPDATE that skips the signals
+        add_items(invoice, [InvoiceItem(dept='LAB', description='CBC', qty=1, unit_price=250, amount=250)])
+        self.assertEqual(self.assertRollupMatchesRaw()['BILLING'], (Decimal('750.00'), 1))
+
+        invoice.refresh_from_db()
+        invoice.payment_status = 'PENDING'
+        invoice.save()
+        self.assertNotIn('BILLING', self.assertRollupMatchesRaw())
+
+        invoice.payment_status = 'PAID'
+        invoice.save()
+        invoice.delete()
+        self.assertNotIn('BILLING', self.assertRollupMatchesRaw())
+
+    def test_pharmacy_and_lab_rows(self):
+        from decimal import Decimal
+        from lab.models import LabCharge
+        from pharmacy.models import PharmacySale
+
+        sale = PharmacySale.objects.create(total_amount=120)
+        charge = LabCharge.objects.create(visit=self.visits[1], test_name='CBC', amount=300)
+        sale.total_amount = 150
+        sale.save()
+        totals = self.assertRollupMatchesRaw()
+        self.assertEqual((totals['PHARMACY'], totals['LAB']), ((Decimal('150.00'), 1), (Decimal('300.00'), 1)))
+
+        sale.delete()
+        charge.delete()
+        self.assertEqual(self.assertRollupMatchesRaw(), {})
+
+    def test_backfill_migration_covers_existing_rows(self):
+        from importlib import import_module
+        from django.apps import apps
+        from lab.models import LabCharge
+        from .models import DailyRevenueRollup
+
+        Invoice.objects.create(visit=self.visits[0], total_amount=500, payment_status='PAID')
+        LabCharge.objects.create(visit=self.visits[1], test_name='CBC', amount=300)
+        DailyRevenueRollup.objects.all().delete()
+
+        import_module('reports.migrations.0002_backfill_revenue_rollup').backfill_rollup(apps, None)
+        self.assertEqual(set(self.assertRollupMatchesRaw()), {'BILLING', 'LAB'})
+
+    def test_check_command_reports_drift_until_rebuilt(self):
+        from django.core.management import call_command, CommandError
+        from .models import DailyRevenueRollup
+
+        Invoice.objects.create(visit=self.visits[0], total_amount=500, payment_status='PAID')
+        DailyRevenueRollup.objects.filter(department='BILLING').update(amount=1)
+
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_revenue_rollup', '--check', stdout=out)
+        self.assertIn('BILLING: rollup=1.00 (1 rows), raw=500', out.getvalue())
 
-# Create your tests here.
+        call_command('rebuild_revenue_rollup', stdout=io.StringIO())
+        call_command('rebuild_revenue_rollup', '--check', stdout=io.StringIO())
+        self.assertRollupMatchesRaw()
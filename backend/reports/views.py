@@ -11,45 +11,54 @@ from billing.models import Invoice, InvoiceItem
 from pharmacy.models import PharmacySale, PharmacySaleItem, PharmacyStock, PurchaseInvoice, PurchaseItem, Supplier
 from lab.models import LabCharge, LabInventoryLog
 from medical.models import DoctorNote
-from django.db.models.functions import TruncDate
-import csv
-from django.http import HttpResponse
+from .rollup import get_totals
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from itertools import chain
+from revive_cms.utils import stream_csv, iter_rows, day_bounds
 
 class BaseReportView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_date_range(self, request):
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
-        
-        # If dates are empty strings or None, default to today
-        if not start_date or start_date == 'null' or start_date == 'undefined':
-            start_date = timezone.now().date()
-        if not end_date or end_date == 'null' or end_date == 'undefined':
-            end_date = timezone.now().date()
-            
+        start_date = self.parse_date_param(request.query_params.get('start_date'))
+        end_date = self.parse_date_param(request.query_params.get('end_date'))
         return str(start_date), str(end_date)
 
+    def parse_date_param(self, value):
+        # Empty, 'null'/'undefined' or malformed dates default to today
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return timezone.localdate()
+
+    def get_datetime_range(self, request):
+        """
+        Returns (start_date, end_date, start, end): the requested dates for the response plus
+        half-open aware bounds for filtering, i.e. created_at__gte=start, created_at__lt=end.
+        """
+        start_date, end_date = self.get_date_range(request)
+        start, end = day_bounds(start_date, end_date)
+        return start_date, end_date, start, end
+
     def export_csv(self, filename, headers, data):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
-        writer = csv.writer(response)
-        writer.writerow(headers)
-        for row in data:
-            writer.writerow(row)
-        return response
+        # `data` should be a lazy iterable (see iter_rows) so the export streams in constant memory
+        return stream_csv(filename, headers, data)
 
 class OPDReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         visits = Visit.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).select_related('patient', 'doctor')
 
         if request.query_params.get('export') == 'csv':
-            data = [[v.id, v.patient.name, v.doctor.username if v.doctor else "N/A", v.status, v.created_at] for v in visits]
+            data = iter_rows(
+                visits.annotate(doctor_display=Coalesce('doctor__username', Value('N/A'))),
+                'id', 'patient__full_name', 'doctor_display', 'status', 'created_at'
+            )
             return self.export_csv("opd_report", ["Visit ID", "Patient", "Doctor", "Status", "Date"], data)
         
         details = [{
@@ -69,15 +78,18 @@ class OPDReportView(BaseReportView):
 
 class DoctorReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         notes = DoctorNote.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).select_related('visit__doctor', 'visit__patient')
 
         if request.query_params.get('export') == 'csv':
-            data = [[n.id, n.visit.doctor.username if n.visit.doctor else "N/A", n.visit.patient.full_name, n.diagnosis, n.created_at] for n in notes]
+            data = iter_rows(
+                notes.annotate(doctor_display=Coalesce('visit__doctor__username', Value('N/A'))),
+                'id', 'doctor_display', 'visit__patient__full_name', 'diagnosis', 'created_at'
+            )
             return self.export_csv("doctor_report", ["Note ID", "Doctor", "Patient", "Diagnosis", "Date"], data)
 
         details = [{
@@ -99,13 +111,13 @@ class DoctorReportView(BaseReportView):
 
 class FinancialReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         # 1. REVENUE
         # Main Billing Invoices
         invoices = Invoice.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
+            created_at__gte=start,
+            created_at__lt=end,
             payment_status='PAID'
         ).select_related('visit__patient')
         
@@ -113,8 +125,8 @@ class FinancialReportView(BaseReportView):
         # To avoid double counting, we only take sales where visit is null 
         # (Assuming visit-linked pharmacy items are in the main Invoice)
         pharmacy_sales = PharmacySale.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
+            created_at__gte=start,
+            created_at__lt=end,
             visit__isnull=True
         )
 
@@ -125,14 +137,14 @@ class FinancialReportView(BaseReportView):
         # 2. EXPENSES (COGS)
         # Pharmacy Purchases
         pharmacy_purchases = PurchaseInvoice.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).aggregate(total=Sum('total_amount'))['total'] or 0
         
         # Lab Purchases (Logs with STOCK_IN)
         lab_purchases = LabInventoryLog.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date,
+            created_at__gte=start,
+            created_at__lt=end,
             transaction_type='STOCK_IN'
         ).aggregate(total=Sum(F('qty') * F('cost')))['total'] or 0
         
@@ -140,7 +152,10 @@ class FinancialReportView(BaseReportView):
         net_profit = total_revenue - total_expense
 
         if request.query_params.get('export') == 'csv':
-            data = [[i.id, i.visit.patient.full_name if i.visit else i.patient_name, i.total_amount, i.payment_status, i.created_at] for i in invoices]
+            data = iter_rows(
+                invoices.annotate(patient_display=Coalesce('visit__patient__full_name', 'patient_name')),
+                'id', 'patient_display', 'total_amount', 'payment_status', 'created_at'
+            )
             return self.export_csv("financial_report", ["Invoice ID", "Patient", "Amount", "Status", "Date"], data)
         
         details = [{
@@ -163,15 +178,18 @@ class FinancialReportView(BaseReportView):
 
 class PharmacySalesReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         sales = PharmacySale.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         )
 
         if request.query_params.get('export') == 'csv':
-            data = [[s.id, s.patient_name, s.total_amount, s.created_at] for s in sales]
+            data = iter_rows(
+                sales.annotate(patient_display=Coalesce('patient__full_name', 'visit__patient__full_name', Value('Walk-in'))),
+                'id', 'patient_display', 'total_amount', 'created_at'
+            )
             return self.export_csv("pharmacy_sales", ["Sale ID", "Patient", "Total", "Date"], data)
 
         details = [{
@@ -190,15 +208,15 @@ class PharmacySalesReportView(BaseReportView):
 
 class LabTestReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         tests = LabCharge.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).select_related('visit__patient')
 
         if request.query_params.get('export') == 'csv':
-            data = [[t.id, t.visit.patient.name, t.test_name, t.amount, t.created_at] for t in tests]
+            data = iter_rows(tests, 'id', 'visit__patient__full_name', 'test_name', 'amount', 'created_at')
             return self.export_csv("lab_report", ["Test ID", "Patient", "Test Name", "Amount", "Date"], data)
 
         details = [{
@@ -219,15 +237,15 @@ class LabTestReportView(BaseReportView):
 
 class LabInventoryReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         logs = LabInventoryLog.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).select_related('item')
 
         if request.query_params.get('export') == 'csv':
-            data = [[l.id, l.item.item_name, l.transaction_type, l.qty, l.cost, l.performed_by, l.created_at] for l in logs]
+            data = iter_rows(logs, 'id', 'item__item_name', 'transaction_type', 'qty', 'cost', 'performed_by', 'created_at')
             return self.export_csv("inventory_report", ["Log ID", "Item", "Type", "Qty", "Cost", "User", "Date"], data)
 
         details = [{
@@ -267,43 +285,28 @@ class ProfitAnalyticsView(APIView):
         previous_month_end = current_month_start - timedelta(days=1)
         previous_month_start = previous_month_end.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         
-        # Calculate revenue for current month
-        current_billing = Invoice.objects.filter(
-            created_at__gte=current_month_start,
-            created_at__lte=current_month_end,
-            payment_status='PAID'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        current_pharmacy = PharmacySale.objects.filter(
-            created_at__gte=current_month_start,
-            created_at__lte=current_month_end
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        current_lab = LabCharge.objects.filter(
-            created_at__gte=current_month_start,
-            created_at__lte=current_month_end
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        current_total = float(current_billing) + float(current_pharmacy) + float(current_lab)
-        
-        # Calculate revenue for previous month
-        previous_billing = Invoice.objects.filter(
-            created_at__gte=previous_month_start,
-            created_at__lte=previous_month_end,
-            payment_status='PAID'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        previous_pharmacy = PharmacySale.objects.filter(
-            created_at__gte=previous_month_start,
-            created_at__lte=previous_month_end
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        previous_lab = LabCharge.objects.filter(
-            created_at__gte=previous_month_start,
-            created_at__lte=previous_month_end
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        previous_total = float(previous_billing) + float(previous_pharmacy) + float(previous_lab)
+        # Read daily rollup rows for both months in one query instead of scanning raw tables
+        daily_totals = get_totals(previous_month_start.date(), current_month_end.date())
+
+        def month_totals(start, end):
+            totals = {'BILLING': 0, 'PHARMACY': 0, 'LAB': 0}
+            for date, departments in daily_totals.items():
+                if start.date() <= date <= end.date():
+                    for department, amount in departments.items():
+                        totals[department] += float(amount)
+            return totals
+
+        current = month_totals(current_month_start, current_month_end)
+        current_billing = current['BILLING']
+        current_pharmacy = current['PHARMACY']
+        current_lab = current['LAB']
+        current_total = current_billing + current_pharmacy + current_lab
+
+        previous = month_totals(previous_month_start, previous_month_end)
+        previous_billing = previous['BILLING']
+        previous_pharmacy = previous['PHARMACY']
+        previous_lab = previous['LAB']
+        previous_total = previous_billing + previous_pharmacy + previous_lab
         
         # Calculate growth percentage
         if previous_total > 0:
@@ -343,26 +346,31 @@ class ProfitAnalyticsView(APIView):
 
 class PharmacyInventoryReportView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         # Stock IN (Purchases)
         purchases = PurchaseItem.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).values('product_name', 'batch_no', 'qty', 'created_at', 'purchase_rate')
         
         # Stock OUT (Sales)
         sales = PharmacySaleItem.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).values('med_stock__name', 'med_stock__batch_no', 'qty', 'created_at', 'unit_price')
 
         if request.query_params.get('export') == 'csv':
-            data = []
-            for p in purchases:
-                data.append([p['created_at'], p['product_name'], p['batch_no'], 'IN', p['qty'], p['purchase_rate']])
-            for s in sales:
-                data.append([s['created_at'], s['med_stock__name'], s['med_stock__batch_no'], 'OUT', s['qty'], s['unit_price']])
+            data = chain(
+                iter_rows(
+                    purchases.annotate(direction=Value('IN')),
+                    'created_at', 'product_name', 'batch_no', 'direction', 'qty', 'purchase_rate'
+                ),
+                iter_rows(
+                    sales.annotate(direction=Value('OUT')),
+                    'created_at', 'med_stock__name', 'med_stock__batch_no', 'direction', 'qty', 'unit_price'
+                ),
+            )
             return self.export_csv("inventory_logs", ["Date", "Item", "Batch", "Type", "Qty", "Rate"], data)
 
         details = []
@@ -404,7 +412,7 @@ class ExpiryReportView(BaseReportView):
         stocks = PharmacyStock.objects.filter(expiry_date__lte=target_date, is_deleted=False).order_by('expiry_date')
 
         if request.query_params.get('export') == 'csv':
-            data = [[s.name, s.batch_no, s.expiry_date, s.qty_available, s.mrp] for s in stocks]
+            data = iter_rows(stocks, 'name', 'batch_no', 'expiry_date', 'qty_available', 'mrp')
             return self.export_csv("expiry_report", ["Item", "Batch", "Expiry", "Qty Available", "MRP"], data)
 
         details = [{
@@ -431,7 +439,7 @@ class SupplierPurchaseReportView(BaseReportView):
         ).select_related('supplier')
 
         if request.query_params.get('export') == 'csv':
-            data = [[p.supplier_invoice_no, p.supplier.supplier_name, p.invoice_date, p.total_amount, p.purchase_type] for p in purchases]
+            data = iter_rows(purchases, 'supplier_invoice_no', 'supplier__supplier_name', 'invoice_date', 'total_amount', 'purchase_type')
             return self.export_csv("supplier_purchase_report", ["Invoice No", "Supplier", "Date", "Total", "Type"], data)
 
         details = [{
@@ -451,16 +459,16 @@ class SupplierPurchaseReportView(BaseReportView):
 
 class VisitBillingSummaryView(BaseReportView):
     def get(self, request):
-        start_date, end_date = self.get_date_range(request)
+        start_date, end_date, start, end = self.get_datetime_range(request)
         
         # Each row is an Invoice Item
         inv_items = InvoiceItem.objects.filter(
-            created_at__date__gte=start_date,
-            created_at__date__lte=end_date
+            created_at__gte=start,
+            created_at__lt=end
         ).select_related('invoice__visit__patient')
 
         if request.query_params.get('export') == 'csv':
-            data = [[i.invoice.id, i.invoice.patient_name, i.dept, i.description, i.qty, i.amount, i.created_at] for i in inv_items]
+            data = iter_rows(inv_items, 'invoice__id', 'invoice__patient_name', 'dept', 'description', 'qty', 'amount', 'created_at')
             return self.export_csv("billing_summary", ["Invoice ID", "Patient", "Dept", "Description", "Qty", "Amount", "Date"], data)
 
         details = [{
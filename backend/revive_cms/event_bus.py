@@ -0,0 +1,151 @@
+"""
+Outbound Socket.IO event bus.
+
+Request threads never talk to the socket server directly: emit_event() registers a
+transaction.on_commit hook that drops the event on an asyncio queue owned by the
+Socket.IO server's event loop. One dispatcher task drains the queue, coalesces events
+for the same entity that arrive within COALESCE_WINDOW, and emits them: rooms in parallel,
+each room's events in order, so clients tracking per-room seq never see them reordered.
+A write's latency therefore no longer depends on how long the socket send takes.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for more events after the first one so duplicates can be merged
+COALESCE_WINDOW = 0.05
+
+# Events beyond this many waiting are dropped (clients recover via the resume endpoint)
+MAX_QUEUE_SIZE = 10000
+
+
+def split_lanes(items):
+    """
+    Splits queued items into lanes that share no room, each in queue order. An event for
+    several rooms joins the lanes of all of them, so no room can see two events reordered.
+    """
+    lanes = []  # [rooms, [(position, item)]]
+    for position, item in enumerate(items):
+        lane = [set(item[3]), [(position, item)]]
+        for other in [other for other in lanes if other[0] & lane[0]]:
+            lanes.remove(other)
+            lane[0] |= other[0]
+            lane[1] = other[1] + lane[1]
+        lanes.append(lane)
+    return [[item for _, item in sorted(entries, key=lambda entry: entry[0])] for _, entries in lanes]
+
+
+class EventBus:
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+        self.metrics = {
+            'enqueued': 0,
+            'dispatched': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'failed': 0,
+            'last_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+            'total_latency_ms': 0.0,
+        }
+
+    def start(self):
+        """Binds the bus to the running (Socket.IO server) loop. Safe to call repeatedly."""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
+        loop.create_task(self.run())
+
+    def publish(self, event, data, rooms, key=None):
+        """
+        Queues `event` for `rooms` once the current transaction commits.
+        Events sharing a non-None `key` within the coalescing window are merged (last one wins).
+        """
+        transaction.on_commit(lambda: self.enqueue(event, data, rooms, key))
+
+    def enqueue(self, event, data, rooms, key=None):
+        if self.loop is None or self.loop.is_closed():
+            # No socket server in this process (management command, WSGI) - nobody to deliver to
+            self.metrics['dropped'] += 1
+            return
+        item = (time.monotonic(), event, data, rooms, key)
+        self.loop.call_soon_threadsafe(self.put, item)
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            self.metrics['enqueued'] += 1
+        except asyncio.QueueFull:
+            self.metrics['dropped'] += 1
+
+    async def run(self):
+        while True:
+            batch = OrderedDict()
+            self.add(batch, await self.queue.get())
+            deadline = self.loop.time() + COALESCE_WINDOW
+            while True:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self.add(batch, await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Lanes share no room, so they go out concurrently and one slow room doesn't hold up
+            # the rest; within a lane events are awaited one by one so each room gets them in seq order
+            await asyncio.gather(*(self.dispatch_in_order(lane) for lane in split_lanes(batch.values())))
+
+    async def dispatch_in_order(self, items):
+        for item in items:
+            await self.dispatch(item)
+
+    def add(self, batch, item):
+        enqueued_at, event, data, rooms, key = item
+        if key is None:
+            batch[object()] = item
+            return
+        batch_key = (event, tuple(rooms), key)
+        previous = batch.pop(batch_key, None)
+        if previous is not None:
+            self.metrics['coalesced'] += 1
+            # Keep the original enqueue time so latency covers the whole wait
+            enqueued_at = previous[0]
+            superseded = list(previous[2].get('superseded', [])) if isinstance(previous[2], dict) else []
+            if isinstance(data, dict) and isinstance(previous[2], dict) and 'seq' in previous[2]:
+                # Tell sequence-tracking clients which deltas this one replaces
+                data = {**data, 'superseded': superseded + [previous[2]['seq']]}
+        batch[batch_key] = (enqueued_at, event, data, rooms, key)
+
+    async def dispatch(self, item):
+        from .sio import sio
+        enqueued_at, event, data, rooms, key = item
+        try:
+            await sio.emit(event, data, to=rooms)
+            self.metrics['dispatched'] += 1
+        except Exception:
+            self.metrics['failed'] += 1
+            logger.exception("Socket emit error for %s to %s", event, rooms)
+        latency = (time.monotonic() - enqueued_at) * 1000
+        self.metrics['last_latency_ms'] = latency
+        self.metrics['max_latency_ms'] = max(self.metrics['max_latency_ms'], latency)
+        self.metrics['total_latency_ms'] += latency
+
+    def get_metrics(self):
+        dispatched = self.metrics['dispatched'] + self.metrics['failed']
+        return {
+            **self.metrics,
+            'running': self.loop is not None and not self.loop.is_closed(),
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'avg_latency_ms': self.metrics['total_latency_ms'] / dispatched if dispatched else 0.0,
+        }
+
+
+event_bus = EventBus()
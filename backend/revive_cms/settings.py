@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -89,13 +91,102 @@ ASGI_APPLICATION = 'revive_cms.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
+#
+# DB_ENGINE=postgres for multi-node / production deployments, otherwise SQLite tuned
+# for a single-node clinic. Everything else is read from the environment as well.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'revive'),
+            'USER': os.environ.get('DB_USER', 'revive'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Persistent connections, re-checked before reuse
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL', 'false').lower() == 'true':
+        # psycopg 3 connection pool; Django requires CONN_MAX_AGE = 0 when pooling
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # A file outside the tree, so the threaded stress tests see the same WAL/locking as
+            # production; runs without them use the in-memory database (revive_cms.test_runner)
+            'TEST': {
+                'NAME': os.environ.get('DB_TEST_NAME', os.path.join(tempfile.gettempdir(), 'revive_cms_test.sqlite3')),
+            },
+            'OPTIONS': {
+                # Seconds to wait on a locked database before raising "database is locked"
+                'timeout': int(os.environ.get('DB_BUSY_TIMEOUT', '20')),
+                # Take the write lock up front so concurrent writers queue instead of deadlocking
+                'transaction_mode': 'IMMEDIATE',
+                # WAL lets readers run alongside the writer; mmap/cache cut read syscalls
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA mmap_size={int(os.environ.get('DB_SQLITE_MMAP_SIZE', 268435456))};"
+                    'PRAGMA cache_size=-64000;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+        }
+    }
+
+TEST_RUNNER = 'revive_cms.test_runner.TestRunner'
+
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Cache
+#
+# The barcode index and lab test catalog keep their version tokens here, so every worker
+# process must share one cache. CACHE_BACKEND=database (default) uses a table created by
+# migrations (core 0009, or `manage.py createcachetable`); CACHE_BACKEND=redis uses CACHE_URL
+# and needs the redis package; locmem is per process and only fits a single-process dev server.
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'database')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_URL', 'redis://localhost:6379/1'),
+        }
     }
-}
+elif CACHE_BACKEND == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': os.environ.get('CACHE_TABLE', 'revive_cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '50000')),
+            },
+        }
+    }
+
+# Seconds a process trusts a version it read from the cache before checking it again, so hot
+# scans and catalog revalidations do not query the cache table (see revive_cms.versions).
+# Writes elsewhere are seen within this window; 0 checks on every read.
+VERSION_CHECK_TTL = float(os.environ.get('CACHE_VERSION_TTL', '1'))
 
 
 # Password validation
@@ -134,6 +225,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (pharmacy bulk upload jobs)
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = 'media/'
+
 # Auth User Model
 AUTH_USER_MODEL = 'users.User'
 
@@ -159,3 +254,16 @@ SIMPLE_JWT = {
 }
 
 
+
+# Logging: app modules log through logging.getLogger(__name__) to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.environ.get('LOG_LEVEL', 'INFO'),
+    },
+}
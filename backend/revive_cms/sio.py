@@ -1,19 +1,100 @@
+import logging
 import socketio
 import os
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 
 # Create a Socket.IO server
 # cors_allowed_origins='*' is important for development
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 
+logger = logging.getLogger(__name__)
+
+
+# --- Rooms ---
+# Every authenticated connection joins its role room and its own user room at connect.
+# Clients may additionally join visit rooms to follow a single visit.
+def role_room(role):
+    return f"role:{role}"
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+def visit_room(visit_id):
+    return f"visit:{visit_id}"
+
+
+def target_rooms(rooms, include_admin=True):
+    """Drops empty entries and duplicates; admins receive everything unless told otherwise."""
+    admin = [role_room('ADMIN')] if include_admin else []
+    return list(dict.fromkeys(admin + [r for r in rooms if r]))
+
+
+def emit_event(event, data, rooms, include_admin=True, key=None):
+    """
+    Sends `event` only to the given rooms (admins always receive it) instead of
+    broadcasting to every connected terminal. Safe to call from sync request code:
+    the event is queued on the event bus after commit and never blocks the caller.
+    Events with the same `key` sent in quick succession are coalesced.
+    """
+    from .event_bus import event_bus
+    event_bus.publish(event, data, target_rooms(rooms, include_admin), key=key)
+
+
+def get_user_for_token(token):
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.tokens import AccessToken
+    try:
+        user_id = AccessToken(token)['user_id']
+        return get_user_model().objects.get(id=user_id, is_active=True)
+    except Exception:
+        return None
+
+
+def can_join_room(user_id, room):
+    from django.contrib.auth import get_user_model
+    from patients.permissions import can_follow_visit
+    kind, _, visit_id = str(room).partition(':')
+    if kind != 'visit':
+        return False
+    user = get_user_model().objects.filter(id=user_id, is_active=True).first()
+    return user is not None and can_follow_visit(user, visit_id)
+
+
 @sio.event
-async def connect(sid, environ):
-    print(f"SocketIO Client Connected: {sid}")
+async def connect(sid, environ, auth=None):
+    # JWT from the socket.io `auth` payload, or ?token= for clients that can't send auth
+    token = (auth or {}).get('token') or parse_qs(environ.get('QUERY_STRING', '')).get('token', [None])[0]
+    user = await sync_to_async(get_user_for_token)(token) if token else None
+    if user is None:
+        raise socketio.exceptions.ConnectionRefusedError('authentication failed')
+
+    # Bind the outbound event bus to this (the server's) event loop
+    from .event_bus import event_bus
+    event_bus.start()
+
+    role = 'ADMIN' if user.is_superuser else user.role
+    await sio.save_session(sid, {'user_id': str(user.id), 'role': role})
+    await sio.enter_room(sid, role_room(role))
+    await sio.enter_room(sid, user_room(user.id))
+    logger.info("SocketIO client connected: %s (%s, %s)", sid, user.username, role)
 
 @sio.event
 async def disconnect(sid):
-    print(f"SocketIO Client Disconnected: {sid}")
+    logger.info("SocketIO client disconnected: %s", sid)
 
 @sio.event
 async def join_room(sid, room):
-    print(f"SocketIO joining room: {room}")
+    # Only visit rooms can be joined on demand, and only by staff working that visit;
+    # role/user rooms are assigned at connect
+    session = await sio.get_session(sid)
+    if not await sync_to_async(can_join_room)(session.get('user_id'), room):
+        logger.warning("SocketIO join refused: %s -> %s", sid, room)
+        return False
+    logger.debug("SocketIO joining room: %s -> %s", sid, room)
     await sio.enter_room(sid, room)
+    return True
+
+@sio.event
+async def leave_room(sid, room):
+    await sio.leave_room(sid, room)
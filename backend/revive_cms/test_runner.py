@@ -0,0 +1,32 @@
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import iter_test_cases
+
+# Tag for tests that write from several threads at once
+THREADED = 'threaded'
+
+
+def tags_of(test):
+    method = getattr(test, getattr(test, '_testMethodName', ''), None)
+    return set(getattr(test, 'tags', ())) | set(getattr(method, 'tags', ()))
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Keeps SQLite's file-backed test database (settings TEST NAME, in the temp directory) for
+    runs that include tests tagged 'threaded', and uses the in-memory one otherwise. The
+    shared in-memory database locks whole tables across connections and does not wait on
+    the busy timeout, so concurrent writers fail there instead of queueing as in production.
+    """
+
+    def build_suite(self, *args, **kwargs):
+        suite = super().build_suite(*args, **kwargs)
+        self.threaded = any(THREADED in tags_of(test) for test in iter_test_cases(suite))
+        return suite
+
+    def setup_databases(self, **kwargs):
+        if not getattr(self, 'threaded', True):
+            for connection in connections.all():
+                if connection.vendor == 'sqlite':
+                    connection.settings_dict['TEST']['NAME'] = None
+        return super().setup_databases(**kwargs)
@@ -1,19 +1,159 @@
 import csv
-from django.http import HttpResponse
+import re
+from itertools import chain
+from datetime import date, datetime, time, timedelta
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 
-def export_to_csv(queryset, filename, fields):
-    response = HttpResponse(content_type='text/csv')
+# Rows fetched per database round trip while streaming an export
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object for csv.writer that hands each encoded line straight back."""
+    def write(self, value):
+        return value
+
+
+def stream_csv(filename, headers, rows):
+    """
+    Streams `rows` (any iterable of sequences, ideally a values_list().iterator())
+    as a CSV download without building the file in memory.
+    """
+    writer = csv.writer(Echo())
+
+    def generate():
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(generate(), content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(fields)
-    
-    for obj in queryset:
-        row = []
-        for field in fields:
-            val = getattr(obj, field, "")
-            if callable(val): val = val()
-            row.append(val)
-        writer.writerow(row)
-        
     return response
+
+
+def iter_rows(queryset, *fields):
+    """
+    values_list() projection of `fields` walked in chunks, so only one chunk is held at a time.
+    """
+    return queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def day_bounds(start_date, end_date=None):
+    """
+    Half-open [start, end) aware datetimes covering the local days start_date..end_date.
+    Filter with created_at__gte=start, created_at__lt=end instead of created_at__date so the
+    database can use the index on the raw column rather than casting every row.
+    """
+    if end_date is None:
+        end_date = start_date
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = date.fromisoformat(end_date)
+
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def name_tokens(name):
+    """
+    Lowercased words of `name`, in order, each cut to the token column length (64).
+    """
+    return [token[:64] for token in TOKEN_RE.findall((name or '').lower())]
+
+
+# Sorts after every character in byte (UTF-8 / memcmp) order
+MAX_CHAR = '\U0010ffff'
+
+
+def prefix_match(field, prefix):
+    """
+    Q for `field` starting with `prefix` that an index on `field` can serve.
+    startswith (LIKE 'x%') is seekable on PostgreSQL through a varchar_pattern_ops index
+    under any collation. SQLite's LIKE cannot use a normal index, so there it is also bounded
+    by a range, which is exact because SQLite compares text byte by byte.
+    """
+    match = Q(**{f'{field}__startswith': prefix})
+    if connection.vendor == 'sqlite':
+        match &= Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + MAX_CHAR})
+    return match
+
+
+def sync_nested(parent, related_name, items_data, prepare=None, derived_fields=()):
+    """
+    Makes parent.<related_name> match `items_data` (validated dicts from a nested many=True
+    serializer) without rewriting rows that did not change. An item whose 'id' is one of the
+    parent's rows updates that row; other items become new rows; rows left out are removed.
+    That is at most one delete, one bulk_update (changed columns only) and one bulk_create.
+
+    `prepare(obj)` runs on every new or changed row before it is written; list the fields it
+    sets in `derived_fields` so they are saved too. Returns (created, updated) instances.
+    """
+    manager = getattr(parent, related_name)
+    model = manager.model
+    fk = manager.field.name
+    existing = {obj.pk: obj for obj in manager.all()}
+
+    created, updated, kept = [], [], set()
+    changed_fields = set()
+    for data in items_data:
+        data = dict(data)
+        obj = existing.get(data.pop('id', None))
+        if obj is None or obj.pk in kept:
+            created.append(model(**{fk: parent}, **data))
+            continue
+        kept.add(obj.pk)
+        changed = []
+        for name, value in data.items():
+            field = model._meta.get_field(name)
+            if field.is_relation:
+                # Compare ids so unchanged foreign keys are not fetched
+                current, new = getattr(obj, field.attname), getattr(value, 'pk', value)
+            else:
+                current, new = getattr(obj, name), value
+            if current != new:
+                setattr(obj, name, value)
+                changed.append(name)
+        if changed:
+            changed_fields.update(changed)
+            updated.append(obj)
+
+    removed = [pk for pk in existing if pk not in kept]
+    if removed:
+        model.objects.filter(pk__in=removed).delete()
+
+    if prepare:
+        for obj in chain(created, updated):
+            prepare(obj)
+    if updated:
+        now = timezone.now()
+        for obj in updated:
+            obj.updated_at = now
+        model.objects.bulk_update(updated, sorted(changed_fields | set(derived_fields) | {'updated_at'}))
+    if created:
+        model.objects.bulk_create(created)
+    return created, updated
+
+
+def export_to_csv(queryset, filename, fields):
+    if isinstance(queryset, QuerySet):
+        return stream_csv(filename, fields, iter_rows(queryset, *fields))
+
+    def rows():
+        for obj in queryset:
+            row = []
+            for field in fields:
+                val = getattr(obj, field, "")
+                if callable(val): val = val()
+                row.append(val)
+            yield row
+
+    return stream_csv(filename, fields, rows())
@@ -0,0 +1,66 @@
+"""
+Version tokens for per-process caches (the POS barcode index, the lab test catalog).
+
+Tokens live in the shared cache (settings.CACHES), so a write in one worker process
+invalidates what every other worker holds. Reading the shared cache on every hit would
+still cost a query with the default DatabaseCache, so each process also remembers the
+tokens it has read for settings.VERSION_CHECK_TTL seconds: within that window a hit is a
+dict lookup. Writes made in this process are seen at once (bump() updates the local copy);
+writes from other processes are seen within the TTL. Set CACHE_VERSION_TTL=0 to check the
+shared cache on every read (cheap with CACHE_BACKEND=redis).
+
+bump() stores a new random token instead of calling incr(): on the database and locmem
+backends incr() is a get followed by a set, so two writers could both move N to N+1 and an
+entry loaded in between, tagged N+1, would then look current.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Tokens remembered per process before the local copy is dropped and refilled
+MAX_KEYS = 50000
+
+# key -> (token, monotonic time until which it is trusted without asking the shared cache)
+_seen = {}
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def remember(key, version, now=None):
+    if len(_seen) >= MAX_KEYS:
+        _seen.clear()
+    _seen[key] = (version, (time.monotonic() if now is None else now) + settings.VERSION_CHECK_TTL)
+
+
+def get_version(key):
+    """The current token for `key`, from this process when it was checked within the TTL."""
+    now = time.monotonic()
+    seen = _seen.get(key)
+    if seen is not None and now < seen[1]:
+        return seen[0]
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    remember(key, version, now)
+    return version
+
+
+def bump(keys):
+    """Gives every key in `keys` a fresh token, here and in the shared cache."""
+    versions = {key: new_version() for key in keys}
+    if not versions:
+        return
+    cache.set_many(versions, None)
+    for key, version in versions.items():
+        remember(key, version)
+
+
+def clear():
+    """Forgets every token read by this process (the next read of each asks the shared cache)."""
+    _seen.clear()
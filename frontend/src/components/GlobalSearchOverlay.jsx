@@ -30,7 +30,7 @@ const GlobalSearchOverlay = () => {
             setLoading(true);
             try {
                 const [pRes, iRes, sRes] = await Promise.all([
-                    api.get(`/reception/patients/?search=${encodeURIComponent(globalSearch)}`),
+                    api.get(`/reception/patients/typeahead/?q=${encodeURIComponent(globalSearch)}`),
                     api.get(`/billing/invoices/?search=${encodeURIComponent(globalSearch)}`),
                     api.get(`/pharmacy/stock/?search=${encodeURIComponent(globalSearch)}`)
                 ]);
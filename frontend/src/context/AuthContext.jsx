@@ -1,5 +1,6 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import api from '../api/axios';
+import { reconnectSocket } from '../socket';
 
 const AuthContext = createContext();
 
@@ -31,6 +32,7 @@ export const AuthProvider = ({ children }) => {
         // Fetch profile to get role
         const profile = await api.get('/users/me/');
         setUser(profile.data);
+        reconnectSocket();
         return profile.data;
     };
 
@@ -3,12 +3,14 @@ import { Search, Bell, Check, Command, Clock, Inbox, Globe } from 'lucide-react'
 import { useSearch } from '../context/SearchContext';
 import { useAuth } from '../context/AuthContext';
 import api from '../api/axios';
+import { socket } from '../socket';
 import { motion, AnimatePresence } from 'framer-motion';
 
 const Header = () => {
     const { globalSearch, setGlobalSearch } = useSearch();
     const { user } = useAuth();
     const [notifications, setNotifications] = useState([]);
+    const [unreadCount, setUnreadCount] = useState(0);
     const [showDropdown, setShowDropdown] = useState(false);
     const [currentTime, setCurrentTime] = useState(new Date());
     const dropdownRef = useRef(null);
@@ -43,11 +45,32 @@ const Header = () => {
     useEffect(() => {
         if (user) {
             fetchNotifications();
-            const interval = setInterval(fetchNotifications, 30000);
-            return () => clearInterval(interval);
+            fetchUnreadCount();
+            // The server pushes the badge count whenever it changes; no polling needed
+            const onCount = (data) => setUnreadCount(data.unread);
+            socket.on('notification_count', onCount);
+            socket.on('connect', fetchUnreadCount);
+            return () => {
+                socket.off('notification_count', onCount);
+                socket.off('connect', fetchUnreadCount);
+            };
         }
     }, [user]);
 
+    // Refresh the list each time the dropdown opens
+    useEffect(() => {
+        if (showDropdown) fetchNotifications();
+    }, [showDropdown]);
+
+    const fetchUnreadCount = async () => {
+        try {
+            const { data } = await api.get('/core/notifications/unread_count/');
+            setUnreadCount(data.unread);
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
     const fetchNotifications = async () => {
         try {
             const { data } = await api.get('/core/notifications/');
@@ -59,14 +82,23 @@ const Header = () => {
 
     const markAsRead = async (id) => {
         try {
-            await api.post('/core/notifications/mark_read/', { ids: [id] });
+            const { data } = await api.post('/core/notifications/mark_read/', { ids: [id] });
+            setUnreadCount(data.unread);
             fetchNotifications();
         } catch (err) {
             console.error(err);
         }
     };
 
-    const unreadCount = notifications.filter(n => !n.is_read).length;
+    const markAllAsRead = async () => {
+        try {
+            await api.post('/core/notifications/mark_all_read/');
+            setUnreadCount(0);
+            fetchNotifications();
+        } catch (err) {
+            console.error(err);
+        }
+    };
 
     return (
         <header className="h-20 bg-white/90 backdrop-blur-xl border-b border-slate-100 px-8 flex items-center justify-between sticky top-0 z-40">
@@ -139,9 +171,16 @@ const Header = () => {
                                 <div className="px-6 py-6 bg-slate-950 text-white">
                                     <div className="flex justify-between items-center">
                                         <h3 className="font-bold text-lg">Notifications</h3>
-                                        <span className="text-[10px] font-bold bg-blue-600 px-2 py-1 rounded-full uppercase">
-                                            {unreadCount} New
-                                        </span>
+                                        <div className="flex items-center gap-2">
+                                            {unreadCount > 0 && (
+                                                <button onClick={markAllAsRead} className="text-[10px] font-bold text-slate-300 hover:text-white uppercase flex items-center gap-1">
+                                                    <Check size={12} /> Mark all read
+                                                </button>
+                                            )}
+                                            <span className="text-[10px] font-bold bg-blue-600 px-2 py-1 rounded-full uppercase">
+                                                {unreadCount} New
+                                            </span>
+                                        </div>
                                     </div>
                                 </div>
 
@@ -325,7 +325,7 @@ const Billing = () => {
             patient_name: formData.patient_name,
             payment_status: formData.payment_status,
             total_amount: subtotal.toFixed(2),
-            items: formData.items.map(({ id, created_at, updated_at, ...rest }) => rest),
+            items: formData.items.map(({ created_at, updated_at, ...rest }) => rest),
             visit: formData.visit
         };
 
@@ -183,7 +183,7 @@ const Pharmacy = () => {
     const searchPatients = async (q) => {
         setPatientSearch(q);
         if (q.length < 2) { setPatients([]); return; }
-        try { const { data } = await api.get(`reception/patients/?search=${q}`); setPatients(data.results || data); } catch (err) { }
+        try { const { data } = await api.get(`reception/patients/typeahead/?q=${encodeURIComponent(q)}`); setPatients(data.results || data); } catch (err) { }
     };
     const searchDoctors = async (q) => {
         setDoctorSearch(q);
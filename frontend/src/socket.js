@@ -1,7 +1,15 @@
 import { io } from 'socket.io-client';
 
 // Connect to the backend URL
+// The server authenticates the JWT at connect and routes events to role/user rooms
 export const socket = io('http://localhost:8000', {
     transports: ['websocket'],
     autoConnect: true,
+    auth: (cb) => cb({ token: localStorage.getItem('access_token') }),
 });
+
+// Re-authenticate after login/logout so the socket joins the right rooms
+export const reconnectSocket = () => {
+    socket.disconnect();
+    socket.connect();
+};